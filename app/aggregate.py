@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+from typing import Any, Sequence
+
+import numpy as np
+
+from app.batch import SEGMENT_TYPES, BatchScores, score_batch_compact
+from app.rules_loader import RuleSet
+
+# Group key for members without a value, and for values beyond max_groups.
+MISSING_GROUP = ""
+OTHER_GROUP = "__other__"
+
+
+class _Histogram:
+    # Fixed-width bins keyed by index (bin i covers [i * width, (i + 1) * width)),
+    # so the value range need not be known before the first member arrives.
+
+    def __init__(self, width: float) -> None:
+        self.width = width
+        self.bins: dict[int, int] = {}
+
+    def add(self, values: np.ndarray) -> None:
+        indexes, counts = np.unique(np.floor(values / self.width).astype(np.int64), return_counts=True)
+        for index, count in zip(indexes.tolist(), counts.tolist()):
+            self.bins[index] = self.bins.get(index, 0) + count
+
+    def summary(self) -> dict[str, Any]:
+        # Rounded so that e.g. 3 * 0.1 is reported as 0.3.
+        return {
+            "bin_width": self.width,
+            "bins": [
+                {"start": round(index * self.width, 12), "count": self.bins[index]} for index in sorted(self.bins)
+            ],
+        }
+
+
+class Aggregator:
+    # Folds scored batches into counts per segment and type, per value of each
+    # group_by field, and score/difference histograms. Memory grows with the
+    # number of groups and bins, not with the number of members.
+
+    def __init__(
+        self,
+        ruleset: RuleSet,
+        group_by: Sequence[str] = (),
+        score_bin_width: float = 50.0,
+        difference_bin_width: float = 0.25,
+        max_groups: int = 1000,
+    ) -> None:
+        if score_bin_width <= 0 or difference_bin_width <= 0:
+            raise ValueError("Histogram bin widths must be positive")
+        self.rule_set_version = ruleset.rule_set_version
+        self.segments = ruleset.compiled.segments
+        self.group_by = tuple(dict.fromkeys(group_by))
+        self.max_groups = max(max_groups, 1)
+        self.total = 0
+        self.invalid = 0
+        self._width = len(self.segments) * len(SEGMENT_TYPES)
+        self._counts = np.zeros(self._width, dtype=np.int64)
+        self._group_ids: dict[str, dict[str, int]] = {field: {} for field in self.group_by}
+        self._group_counts = {field: np.zeros((0, self._width), dtype=np.int64) for field in self.group_by}
+        self._best_scores = _Histogram(score_bin_width)
+        self._differences = _Histogram(difference_bin_width)
+
+    def add_members(self, members: list[dict[str, Any]], ruleset: RuleSet) -> None:
+        if members:
+            self.add(score_batch_compact(members, ruleset), members)
+
+    def add(self, batch: BatchScores, members: list[dict[str, Any]]) -> None:
+        # Codes as in BatchScores.counts: segment index * len(SEGMENT_TYPES) + type.
+        codes = batch.best.astype(np.intp) * len(SEGMENT_TYPES) + batch.types
+        self._counts += np.bincount(codes, minlength=self._width)
+        for field in self.group_by:
+            ids = np.fromiter(
+                (self._group_id(field, member.get(field)) for member in members), dtype=np.intp, count=len(members)
+            )
+            groups = len(self._group_ids[field])
+            tally = np.bincount(ids * self._width + codes, minlength=groups * self._width)
+            counts = self._group_counts[field]
+            if counts.shape[0] < groups:
+                counts = self._group_counts[field] = np.pad(counts, ((0, groups - counts.shape[0]), (0, 0)))
+            counts += tally.reshape(groups, self._width)
+        self._best_scores.add(batch.best_scores())
+        self._differences.add(batch.differences())
+        self.total += len(batch)
+
+    def _group_id(self, field: str, value: Any) -> int:
+        key = MISSING_GROUP if value is None else str(value).strip()
+        ids = self._group_ids[field]
+        group_id = ids.get(key)
+        if group_id is None:
+            if len(ids) >= self.max_groups and key != OTHER_GROUP:
+                return self._group_id(field, OTHER_GROUP)
+            group_id = ids[key] = len(ids)
+        return group_id
+
+    def _by_segment(self, counts: np.ndarray, keep_empty: bool) -> dict[str, dict[str, int]]:
+        rows = counts.reshape(len(self.segments), len(SEGMENT_TYPES)).tolist()
+        return {
+            segment: dict(zip(SEGMENT_TYPES, row))
+            for segment, row in zip(self.segments, rows)
+            if keep_empty or any(row)
+        }
+
+    def counts(self) -> dict[tuple[str, str], int]:
+        return {
+            (segment, segment_type): count
+            for segment, types in self._by_segment(self._counts, False).items()
+            for segment_type, count in types.items()
+            if count
+        }
+
+    def summary(self) -> dict[str, Any]:
+        groups: dict[str, dict[str, dict[str, dict[str, int]]]] = {}
+        for field in self.group_by:
+            counts = self._group_counts[field]
+            values = sorted(self._group_ids[field].items(), key=lambda item: (item[0] == OTHER_GROUP, item[0]))
+            groups[field] = {value: self._by_segment(counts[group_id], False) for value, group_id in values}
+        return {
+            "total": self.total,
+            "invalid": self.invalid,
+            "segments": self._by_segment(self._counts, True),
+            "groups": groups,
+            "histograms": {
+                "best_score": self._best_scores.summary(),
+                "difference": self._differences.summary(),
+            },
+            "rule_set_version": self.rule_set_version,
+        }
+
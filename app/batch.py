@@ -0,0 +1,379 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Mapping, Sequence
+
+import numpy as np
+
+from app.metrics import metrics
+from app.rules_loader import RuleSet
+from app.segmenter import SegmentResult, _lookup_field, _round_scores, explain_positions, segment_probabilities
+
+
+SEGMENT_TYPES = ("Core", "Mid", "Rest")
+
+
+def _position_matrix(columns: list[Sequence[Any] | None], size: int, ruleset: RuleSet) -> np.ndarray:
+    # One row per member holding the positions of its matched features, padded
+    # with a sentinel that points at an all-zero coefficient row. columns holds
+    # the raw values of each compiled field (None when the field is absent).
+    compiled = ruleset.compiled
+    sentinel = len(compiled.coefficients)
+    positions = np.full((size, max(len(compiled.fields), 1)), sentinel, dtype=np.intp)
+    width = 0
+    rows: list[list[int]] = [[] for _ in range(size)]
+    for field, values in zip(compiled.fields, columns):
+        if values is None:
+            continue
+        memo: dict[str, tuple[int, ...]] = {}
+        for row, raw_value in zip(rows, values):
+            if type(raw_value) is str:
+                matches = memo.get(raw_value)
+                if matches is None:
+                    matches = _lookup_field(raw_value, field, ruleset.case_insensitive)
+                    memo[raw_value] = matches
+            elif raw_value is None:
+                continue
+            else:
+                matches = _lookup_field(raw_value, field, ruleset.case_insensitive)
+            if matches:
+                row.extend(matches)
+    for index, row in enumerate(rows):
+        if row:
+            if len(row) > positions.shape[1]:
+                positions = np.pad(
+                    positions,
+                    ((0, 0), (0, len(row) - positions.shape[1])),
+                    constant_values=sentinel,
+                )
+            positions[index, : len(row)] = row
+            width = max(width, len(row))
+    # Sorting keeps the per-member summation in rule order, matching score_member.
+    return np.sort(positions[:, :width], axis=1)
+
+
+def _score_matrix(positions: np.ndarray, ruleset: RuleSet) -> np.ndarray:
+    compiled = ruleset.compiled
+    coefficients = np.zeros((len(compiled.coefficients) + 1, len(compiled.segments)), dtype=np.float64)
+    if compiled.coefficients:
+        coefficients[:-1] = np.asarray(compiled.coefficients, dtype=np.float64)
+    scores = np.tile(np.asarray(compiled.intercepts, dtype=np.float64), (positions.shape[0], 1))
+    # Accumulate one matched feature per step instead of a single matmul: the
+    # summation order has to match score_member for the scores to be identical.
+    for column in range(positions.shape[1]):
+        scores += coefficients[positions[:, column]]
+    return scores
+
+
+def _rank(scores: np.ndarray, segments: tuple[str, ...]) -> tuple[np.ndarray, np.ndarray | None]:
+    # Columns are visited in lexicographic name order so that argmax, which
+    # returns the first maximum, reproduces the name tie-break.
+    lex_order = np.array(sorted(range(len(segments)), key=lambda index: segments[index]), dtype=np.intp)
+    lex_scores = scores[:, lex_order]
+    rows = np.arange(scores.shape[0])
+    best = np.argmax(lex_scores, axis=1)
+    if len(segments) < 2:
+        return lex_order[best], None
+    lex_scores[rows, best] = -np.inf
+    second = np.argmax(lex_scores, axis=1)
+    return lex_order[best], lex_order[second]
+
+
+def _top_k(scores: np.ndarray, segments: tuple[str, ...], k: int) -> tuple[np.ndarray, np.ndarray]:
+    # Column indices and scores of the k best segments per row, best first,
+    # with ties broken by name like _rank: argpartition selects k candidates
+    # and only those are sorted.
+    lex_order = np.array(sorted(range(len(segments)), key=lambda index: segments[index]), dtype=np.intp)
+    lex_scores = scores[:, lex_order]
+    width = lex_scores.shape[1]
+    k = min(k, width)
+    if k < width:
+        selected = np.argpartition(-lex_scores, k - 1, axis=1)[:, :k]
+    else:
+        selected = np.broadcast_to(np.arange(width), lex_scores.shape)
+    # Lexicographic order first, so the stable sort below breaks ties by name.
+    selected = np.sort(selected, axis=1)
+    values = np.take_along_axis(lex_scores, selected, axis=1)
+    order = np.argsort(-values, axis=1, kind="stable")
+    selected = np.take_along_axis(selected, order, axis=1)
+    values = np.take_along_axis(values, order, axis=1)
+    if k < width:
+        # argpartition picks arbitrarily among scores tied with the k-th; rows
+        # where a tied segment was left out are ranked with a full stable sort.
+        kth = values[:, -1:]
+        ambiguous = np.flatnonzero((lex_scores == kth).sum(axis=1) > (values == kth).sum(axis=1))
+        if ambiguous.size:
+            full = np.argsort(-lex_scores[ambiguous], axis=1, kind="stable")[:, :k]
+            selected[ambiguous] = full
+            values[ambiguous] = np.take_along_axis(lex_scores[ambiguous], full, axis=1)
+    return lex_order[selected], values
+
+
+def score_batch(
+    members: list[dict[str, Any]],
+    ruleset: RuleSet,
+    include_features: bool = False,
+    pretty_scores: bool = False,
+    explain: bool = False,
+    top_k: int = 0,
+    probabilities: bool = False,
+) -> list[SegmentResult]:
+    if not members:
+        return []
+    return _score_position_matrix(
+        _member_positions(members, ruleset), ruleset, include_features, pretty_scores, explain, top_k, probabilities
+    )
+
+
+def score_batch_compact(members: list[dict[str, Any]], ruleset: RuleSet) -> BatchScores:
+    # Like score_batch without the optional outputs, as arrays instead of one
+    # SegmentResult per member; see encode_batch_scores for serializing them.
+    return _rank_batch(_member_positions(members, ruleset), ruleset)
+
+
+def _member_positions(members: list[dict[str, Any]], ruleset: RuleSet) -> np.ndarray:
+    with metrics.timer("batch_features"):
+        columns = [[member.get(field.input_field) for member in members] for field in ruleset.compiled.fields]
+        return _position_matrix(columns, len(members), ruleset)
+
+
+def column_length(columns: Mapping[str, Sequence[Any]]) -> int:
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError(f"All columns must have the same length, got lengths {sorted(lengths)}")
+    return lengths.pop() if lengths else 0
+
+
+def score_columns(
+    columns: Mapping[str, Sequence[Any]],
+    ruleset: RuleSet,
+    include_features: bool = False,
+    pretty_scores: bool = False,
+    explain: bool = False,
+    top_k: int = 0,
+    probabilities: bool = False,
+) -> list[SegmentResult]:
+    # Columnar counterpart of score_batch: member i has the value columns[f][i]
+    # for field f, and null entries count as missing fields. Columns no rule
+    # refers to are never read.
+    size = column_length(columns)
+    if not size:
+        return []
+    return _score_position_matrix(
+        _column_positions(columns, size, ruleset),
+        ruleset,
+        include_features,
+        pretty_scores,
+        explain,
+        top_k,
+        probabilities,
+    )
+
+
+def score_columns_compact(columns: Mapping[str, Sequence[Any]], ruleset: RuleSet) -> BatchScores:
+    return _rank_batch(_column_positions(columns, column_length(columns), ruleset), ruleset)
+
+
+def _column_positions(columns: Mapping[str, Sequence[Any]], size: int, ruleset: RuleSet) -> np.ndarray:
+    with metrics.timer("batch_features"):
+        return _position_matrix([columns.get(field.input_field) for field in ruleset.compiled.fields], size, ruleset)
+
+
+@dataclass(frozen=True)
+class BatchScores:
+    # Batch results as arrays: the score matrix, best/second segment indices
+    # into `segments` and type codes into SEGMENT_TYPES. Segment names are
+    # only looked up when a row is materialized or encoded, which keeps large
+    # batches far smaller than one SegmentResult per member.
+    segments: tuple[str, ...]
+    scores: np.ndarray
+    best: np.ndarray
+    second: np.ndarray | None
+    types: np.ndarray
+
+    def __len__(self) -> int:
+        return self.scores.shape[0]
+
+    def best_scores(self) -> np.ndarray:
+        return self.scores[np.arange(len(self)), self.best]
+
+    def second_scores(self) -> np.ndarray | None:
+        if self.second is None:
+            return None
+        return self.scores[np.arange(len(self)), self.second]
+
+    def differences(self) -> np.ndarray:
+        return _differences(self.best_scores(), self.second_scores())
+
+    def counts(self) -> dict[tuple[str, str], int]:
+        # Members per (segment, type), without materializing any rows.
+        codes = self.best.astype(np.intp) * len(SEGMENT_TYPES) + self.types
+        tally = np.bincount(codes, minlength=len(self.segments) * len(SEGMENT_TYPES)).tolist()
+        return {
+            (self.segments[code // len(SEGMENT_TYPES)], SEGMENT_TYPES[code % len(SEGMENT_TYPES)]): count
+            for code, count in enumerate(tally)
+            if count
+        }
+
+    def results(self, pretty_scores: bool = False) -> list[SegmentResult]:
+        return _materialize(None, None, self, False, pretty_scores, False, None, False)
+
+    def __getitem__(self, rows: Any) -> BatchScores:
+        return BatchScores(
+            segments=self.segments,
+            scores=self.scores[rows],
+            best=self.best[rows],
+            second=self.second[rows] if self.second is not None else None,
+            types=self.types[rows],
+        )
+
+
+def _rank_batch(positions: np.ndarray, ruleset: RuleSet) -> BatchScores:
+    segments = ruleset.compiled.segments
+    with metrics.timer("batch_score"):
+        scores = _score_matrix(positions, ruleset)
+    with metrics.timer("batch_rank"):
+        best, second = _rank(scores, segments)
+        rows = np.arange(scores.shape[0])
+        differences = _differences(scores[rows, best], scores[rows, second] if second is not None else None)
+        core_threshold = ruleset.thresholds["core_threshold"]
+        mid_threshold = ruleset.thresholds["mid_threshold"]
+        # Codes into SEGMENT_TYPES: Core, Mid, Rest.
+        types = np.where(
+            differences > core_threshold,
+            0,
+            np.where((differences > mid_threshold) & (differences <= core_threshold), 1, 2),
+        ).astype(np.uint8)
+    # The smallest integer type that holds every segment index.
+    index_dtype = np.min_scalar_type(max(len(segments) - 1, 0))
+    return BatchScores(
+        segments=segments,
+        scores=scores,
+        best=best.astype(index_dtype),
+        second=second.astype(index_dtype) if second is not None else None,
+        types=types,
+    )
+
+
+def _differences(best_scores: np.ndarray, second_scores: np.ndarray | None) -> np.ndarray:
+    if second_scores is None:
+        return np.zeros(best_scores.shape[0], dtype=np.float64)
+    return best_scores - second_scores
+
+
+def _score_position_matrix(
+    positions: np.ndarray,
+    ruleset: RuleSet,
+    include_features: bool,
+    pretty_scores: bool,
+    explain: bool = False,
+    top_k: int = 0,
+    probabilities: bool = False,
+) -> list[SegmentResult]:
+    batch = _rank_batch(positions, ruleset)
+    with metrics.timer("batch_rank"):
+        ranked = _top_k(batch.scores, batch.segments, top_k) if top_k > 0 else None
+    with metrics.timer("batch_materialize"):
+        return _materialize(
+            ruleset,
+            positions,
+            batch,
+            include_features,
+            pretty_scores,
+            explain,
+            ranked,
+            probabilities,
+        )
+
+
+def _materialize(
+    ruleset: RuleSet | None,
+    positions: np.ndarray | None,
+    batch: BatchScores,
+    include_features: bool,
+    pretty_scores: bool,
+    explain: bool,
+    ranked: tuple[np.ndarray, np.ndarray] | None,
+    probabilities: bool,
+) -> list[SegmentResult]:
+    # ruleset and positions are only needed for include_features and explain.
+    if include_features or explain:
+        assert ruleset is not None and positions is not None
+        features = ruleset.features
+        sentinel = len(ruleset.compiled.coefficients)
+    segments = batch.segments
+    best_indices = batch.best.tolist()
+    second_indices = batch.second.tolist() if batch.second is not None else None
+    best_values = batch.best_scores().tolist()
+    second_scores = batch.second_scores()
+    second_values = second_scores.tolist() if second_scores is not None else None
+    difference_values = batch.differences().tolist()
+    type_values = [SEGMENT_TYPES[code] for code in batch.types.tolist()]
+    contributions: dict[int, dict[str, float]] = {}
+    ranked_indices = ranked[0].tolist() if ranked is not None else None
+    ranked_scores = ranked[1].tolist() if ranked is not None else None
+    results: list[SegmentResult] = []
+    for index, row_scores in enumerate(batch.scores.tolist()):
+        score_map = dict(zip(segments, row_scores))
+        best_score = best_values[index]
+        second_best_score = second_values[index] if second_values is not None else None
+        difference = difference_values[index]
+        # Per row with the single-member softmax, so both give the same floats.
+        probability_map = segment_probabilities(score_map, pretty_scores) if probabilities else None
+        if pretty_scores:
+            score_map = _round_scores(score_map)
+            best_score = round(best_score, 4)
+            if second_best_score is not None:
+                second_best_score = round(second_best_score, 4)
+            difference = round(difference, 4)
+        matched_features = None
+        explanation = None
+        if include_features or explain:
+            row_positions = [position for position in positions[index].tolist() if position != sentinel]
+        if include_features:
+            matched = set(row_positions)
+            matched_features = [
+                {
+                    "feature_id": feature.feature_id,
+                    "input_field": feature.input_field,
+                    "match_value": feature.match_value,
+                    "value": 1 if position in matched else 0,
+                }
+                for position, feature in enumerate(features)
+            ]
+        if explain:
+            explanation = explain_positions(
+                row_positions,
+                ruleset,
+                best_indices[index],
+                second_indices[index] if second_indices is not None else None,
+                pretty_scores,
+                contributions,
+            )
+        ranking = None
+        if ranked_indices is not None and ranked_scores is not None:
+            top_score = ranked_scores[index][0]
+            ranking = [
+                {
+                    "segment": segments[segment_index],
+                    "score": round(score, 4) if pretty_scores else score,
+                    "margin": round(top_score - score, 4) if pretty_scores else top_score - score,
+                }
+                for segment_index, score in zip(ranked_indices[index], ranked_scores[index])
+            ]
+        results.append(
+            SegmentResult(
+                segment=segments[best_indices[index]],
+                second_segment=segments[second_indices[index]] if second_indices is not None else None,
+                type=type_values[index],
+                difference=difference,
+                best_score=best_score,
+                second_best_score=second_best_score,
+                scores=score_map,
+                matched_features=matched_features,
+                explanation=explanation,
+                ranking=ranking,
+                probabilities=probability_map,
+            )
+        )
+    return results
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Sequence
+
+from app.metrics import metrics
+from app.rules_loader import RuleSet
+from app.segmenter import SegmentResult, _matched_positions, _matched_positions_per_ruleset, _score_positions
+
+
+class ScoreCache:
+    # The key is the member's feature signature: the positions of the features
+    # it matches after normalization and code/alias mapping. Fields the rule set
+    # does not score, and values that match no rule, do not affect the key.
+    # It also holds the rule set's content fingerprint, so results computed on
+    # older rules (e.g. inserted by a request that was in flight during a
+    # reload) are never served for edited rules under the same version.
+    # Cached results are shared between callers and must be treated as read-only.
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[Any, ...], SegmentResult] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def score(
+        self,
+        member: dict[str, Any],
+        ruleset: RuleSet,
+        include_features: bool = False,
+        pretty_scores: bool = False,
+        explain: bool = False,
+        top_k: int = 0,
+        probabilities: bool = False,
+    ) -> SegmentResult:
+        options = (include_features, pretty_scores, explain, top_k, probabilities)
+        with metrics.timer("features"):
+            positions = _matched_positions(member, ruleset)
+        return self._score_matched(positions, ruleset, options)
+
+    def score_rulesets(
+        self, member: dict[str, Any], rulesets: Sequence[RuleSet], pretty_scores: bool = False
+    ) -> list[SegmentResult]:
+        # One result per rule set, with the member's fields read only once.
+        options = (False, pretty_scores, False, 0, False)
+        with metrics.timer("features"):
+            matched = _matched_positions_per_ruleset(member, rulesets)
+        return [self._score_matched(positions, ruleset, options) for positions, ruleset in zip(matched, rulesets)]
+
+    def _score_matched(
+        self, positions: list[int], ruleset: RuleSet, options: tuple[bool, bool, bool, int, bool]
+    ) -> SegmentResult:
+        if self.max_size <= 0:
+            with metrics.timer("score"):
+                return _score_positions(positions, ruleset, *options)
+        key = (ruleset.rule_set_version, ruleset.fingerprint, options, tuple(positions))
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+        with metrics.timer("score"):
+            result = _score_positions(positions, ruleset, *options)
+        with self._lock:
+            self._entries[key] = result
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
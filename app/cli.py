@@ -0,0 +1,469 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Any, Callable, Iterator, NamedTuple, TextIO, Union
+
+from app.batch import score_batch
+from app.config import Settings
+from app.delta import FingerprintStore, rule_set_key, segment_delta
+from app.profiler import DEFAULT_INTERVAL, SamplingProfiler, Stack, collapsed_stacks, pstats_dump
+from app.rules_artifact import artifact_path, load_ruleset, write_artifact
+from app.rules_loader import RuleSet, RulesLoaderError
+from app.segmenter import SegmentResult
+
+FORMATS = ("csv", "jsonl", "parquet")
+# Parquet column types; score_* columns and the other result columns are float64.
+_PARQUET_STRING_COLUMNS = ("previous_segment", "previous_type", "segment", "second_segment", "type", "rule_set_version")
+PROGRESS_INTERVAL_SECONDS = 2.0
+RESULT_COLUMNS = ("segment", "second_segment", "type", "difference", "best_score", "second_best_score")
+
+_worker_ruleset: RuleSet | None = None
+_worker_store: FingerprintStore | None = None
+
+
+class CLIError(ValueError):
+    pass
+
+
+class JSONLines(NamedTuple):
+    path: str
+    first_line: int
+    lines: list[str]
+
+
+Chunk = Union[list[dict[str, Any]], JSONLines]
+
+
+def _infer_format(path: str, explicit: str | None) -> str:
+    if explicit:
+        return explicit
+    suffix = Path(path).suffix.lower().lstrip(".")
+    if suffix == "ndjson":
+        return "jsonl"
+    if suffix == "json":
+        # Usually a single JSON document (an array), which would fail line by line.
+        raise CLIError(
+            f"'{path}': .json files are not read or written as JSON Lines (one object per line); "
+            "use a .jsonl file or pass --input-format/--output-format jsonl"
+        )
+    if suffix in FORMATS:
+        return suffix
+    raise CLIError(f"Cannot infer format of '{path}', pass it explicitly")
+
+
+def _open_text(path: str, mode: str) -> TextIO:
+    if path == "-":
+        return sys.stdin if "r" in mode else sys.stdout
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def _read_csv(path: str, chunk_size: int, delimiter: str) -> Iterator[list[dict[str, Any]]]:
+    handle = _open_text(path, "r")
+    try:
+        chunk: list[dict[str, Any]] = []
+        for row in csv.DictReader(handle, delimiter=delimiter):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+def _read_jsonl(path: str, chunk_size: int) -> Iterator[JSONLines]:
+    # Lines are handed to the workers unparsed so JSON decoding runs in parallel.
+    handle = _open_text(path, "r")
+    try:
+        first_line = 1
+        lines: list[str] = []
+        for line in handle:
+            lines.append(line)
+            if len(lines) >= chunk_size:
+                yield JSONLines(path, first_line, lines)
+                first_line += len(lines)
+                lines = []
+        if lines:
+            yield JSONLines(path, first_line, lines)
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+def _parse_jsonl(chunk: JSONLines) -> list[dict[str, Any]]:
+    members: list[dict[str, Any]] = []
+    for line_number, line in enumerate(chunk.lines, start=chunk.first_line):
+        if not line.strip():
+            continue
+        try:
+            member = json.loads(line)
+        except json.JSONDecodeError as exc:
+            raise CLIError(f"{chunk.path}:{line_number}: invalid JSON: {exc}") from exc
+        if not isinstance(member, dict):
+            raise CLIError(f"{chunk.path}:{line_number}: each line must be a JSON object")
+        members.append(member)
+    return members
+
+
+def _import_parquet() -> Any:
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as exc:
+        raise CLIError("Parquet support requires the 'pyarrow' package") from exc
+    return pyarrow
+
+
+def _read_parquet(path: str, chunk_size: int) -> Iterator[list[dict[str, Any]]]:
+    pyarrow = _import_parquet()
+    parquet_file = pyarrow.parquet.ParquetFile(path)
+    for record_batch in parquet_file.iter_batches(batch_size=chunk_size):
+        yield record_batch.to_pylist()
+
+
+def read_chunks(path: str, input_format: str, chunk_size: int, delimiter: str = ",") -> Iterator[Chunk]:
+    if input_format == "csv":
+        return _read_csv(path, chunk_size, delimiter)
+    if input_format == "jsonl":
+        return _read_jsonl(path, chunk_size)
+    return _read_parquet(path, chunk_size)
+
+
+def _init_worker(ruleset: RuleSet, delta_store: Path | None = None) -> None:
+    global _worker_ruleset, _worker_store
+    _worker_ruleset = ruleset
+    _worker_store = FingerprintStore(delta_store) if delta_store is not None else None
+
+
+def _output_columns(ruleset: RuleSet, id_field: str | None, delta: bool = False) -> list[str]:
+    columns = [id_field] if id_field else []
+    if delta:
+        columns.extend(("previous_segment", "previous_type"))
+    columns.extend(RESULT_COLUMNS)
+    columns.append("rule_set_version")
+    columns.extend(f"score_{segment}" for segment in ruleset.segments)
+    return columns
+
+
+def _score_chunk(
+    chunk: Chunk,
+    id_field: str | None,
+    pretty_scores: bool,
+    output_format: str,
+    delimiter: str,
+) -> tuple[int, Any]:
+    # Formatting happens in the worker as well; it costs about as much as the
+    # scoring itself and would otherwise serialize on the parent process.
+    ruleset = _worker_ruleset
+    assert ruleset is not None
+    if isinstance(chunk, JSONLines):
+        chunk = _parse_jsonl(chunk)
+    scored: list[tuple[dict[str, Any], SegmentResult]]
+    if _worker_store is not None:
+        # Delta mode writes only the members whose result changed since the last run.
+        assert id_field is not None
+        try:
+            changed, _ = segment_delta(chunk, ruleset, _worker_store, id_field, pretty_scores=pretty_scores)
+        except ValueError as exc:
+            raise CLIError(str(exc)) from exc
+        scored = [
+            (
+                {
+                    id_field: delta.member_id,
+                    "previous_segment": delta.previous_segment,
+                    "previous_type": delta.previous_type,
+                },
+                delta.result,
+            )
+            for delta in changed
+        ]
+    else:
+        scored = [
+            ({id_field: member.get(id_field)} if id_field else {}, result)
+            for member, result in zip(chunk, score_batch(chunk, ruleset, pretty_scores=pretty_scores))
+        ]
+    flat = output_format != "jsonl"
+    rows: list[dict[str, Any]] = []
+    for prefix, result in scored:
+        row = dict(prefix)
+        for column in RESULT_COLUMNS:
+            row[column] = getattr(result, column)
+        row["rule_set_version"] = ruleset.rule_set_version
+        if flat:
+            for segment, score in result.scores.items():
+                row[f"score_{segment}"] = score
+        else:
+            row["scores"] = result.scores
+        rows.append(row)
+
+    if output_format == "jsonl":
+        return len(chunk), "".join(
+            json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n" for row in rows
+        )
+    if output_format == "csv":
+        buffer = io.StringIO()
+        columns = _output_columns(ruleset, id_field, _worker_store is not None)
+        writer = csv.DictWriter(buffer, fieldnames=columns, delimiter=delimiter)
+        writer.writerows(rows)
+        return len(chunk), buffer.getvalue()
+    return len(chunk), rows
+
+
+def _profiled_score_chunk(chunk: Chunk, *options: Any) -> tuple[int, Any, Counter[Stack]]:
+    with SamplingProfiler(thread_ids={threading.get_ident()}) as profiler:
+        count, block = _score_chunk(chunk, *options)
+    return count, block, profiler.samples
+
+
+def _scored_chunks(
+    chunks: Iterator[Chunk],
+    ruleset: RuleSet,
+    workers: int,
+    options: tuple[str | None, bool, str, str],
+    delta_store: Path | None = None,
+    profile: Counter[Stack] | None = None,
+) -> Iterator[tuple[int, Any]]:
+    # With profile, each chunk is sampled in the process scoring it and the
+    # stacks are added to profile.
+    if profile is not None:
+        for count, block, samples in _scored(chunks, ruleset, workers, options, delta_store, _profiled_score_chunk):
+            profile.update(samples)
+            yield count, block
+    else:
+        yield from _scored(chunks, ruleset, workers, options, delta_store, _score_chunk)
+
+
+def _scored(
+    chunks: Iterator[Chunk],
+    ruleset: RuleSet,
+    workers: int,
+    options: tuple[str | None, bool, str, str],
+    delta_store: Path | None,
+    score: Callable[..., Any],
+) -> Iterator[Any]:
+    if workers <= 1:
+        _init_worker(ruleset, delta_store)
+        for chunk in chunks:
+            yield score(chunk, *options)
+        return
+    # Pool.imap would drain the whole input up front; keeping a bounded window of
+    # pending chunks keeps memory flat while preserving input order.
+    max_pending = workers * 2
+    with Pool(workers, initializer=_init_worker, initargs=(ruleset, delta_store)) as pool:
+        pending: deque[Any] = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(score, (chunk, *options)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+class _TextWriter:
+    def __init__(self, handle: TextIO, header: str = "") -> None:
+        self._handle = handle
+        if header:
+            handle.write(header)
+
+    def write(self, block: str) -> None:
+        self._handle.write(block)
+
+    def close(self) -> None:
+        pass
+
+
+class _ParquetWriter:
+    # The schema is declared up front: inferred from the first chunk, a column
+    # that happens to be all null there (e.g. second_best_score) would get
+    # type null and reject later chunks. Ids are written as strings.
+
+    def __init__(self, path: str, columns: list[str], id_field: str | None) -> None:
+        if path == "-":
+            raise CLIError("Parquet output requires a file path")
+        self._pyarrow = _import_parquet()
+        self._path = path
+        self._id_field = id_field
+        self._schema = self._pyarrow.schema(
+            [
+                (
+                    column,
+                    self._pyarrow.string()
+                    if column == id_field or column in _PARQUET_STRING_COLUMNS
+                    else self._pyarrow.float64(),
+                )
+                for column in columns
+            ]
+        )
+        self._writer: Any = None
+
+    def write(self, rows: list[dict[str, Any]]) -> None:
+        if self._id_field:
+            for row in rows:
+                member_id = row.get(self._id_field)
+                if member_id is not None:
+                    row[self._id_field] = str(member_id)
+        table = self._pyarrow.Table.from_pylist(rows, schema=self._schema)
+        if self._writer is None:
+            self._writer = self._pyarrow.parquet.ParquetWriter(self._path, self._schema)
+        self._writer.write_table(table)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+
+def _report(stream: TextIO, rows: int, started: float, final: bool = False) -> None:
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    label = "done" if final else "progress"
+    stream.write(f"[{label}] {rows} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)\n")
+    stream.flush()
+
+
+def _settings(args: argparse.Namespace) -> Settings:
+    overrides: dict[str, Any] = {}
+    if args.rules:
+        overrides["rules_path"] = args.rules
+    if args.code_lists:
+        overrides["code_list_path"] = args.code_lists
+    return Settings(**overrides)
+
+
+def _segment_command(args: argparse.Namespace) -> int:
+    if args.delta_store and not args.id_field:
+        raise CLIError("--delta-store requires --id-field")
+    ruleset = load_ruleset(_settings(args))
+    if args.delta_store:
+        # The store keeps only the current rules; rows of earlier ones are never read again.
+        FingerprintStore(args.delta_store).prune([rule_set_key(ruleset)])
+
+    input_format = _infer_format(args.input, args.input_format)
+    output_format = args.output_format or (
+        "jsonl" if args.output == "-" else _infer_format(args.output, None)
+    )
+    chunks = read_chunks(args.input, input_format, args.chunk_size, args.delimiter)
+
+    handle: TextIO | None = None
+    writer: _TextWriter | _ParquetWriter
+    if output_format == "parquet":
+        columns = _output_columns(ruleset, args.id_field, args.delta_store is not None)
+        writer = _ParquetWriter(args.output, columns, args.id_field)
+    else:
+        handle = _open_text(args.output, "w")
+        header = ""
+        if output_format == "csv":
+            buffer = io.StringIO()
+            columns = _output_columns(ruleset, args.id_field, args.delta_store is not None)
+            csv.writer(buffer, delimiter=args.delimiter).writerow(columns)
+            header = buffer.getvalue()
+        writer = _TextWriter(handle, header)
+
+    options = (args.id_field, args.pretty_scores, output_format, args.delimiter)
+    profile: Counter[Stack] | None = Counter() if args.profile else None
+    started = time.perf_counter()
+    last_report = started
+    total = 0
+    try:
+        for count, block in _scored_chunks(chunks, ruleset, args.workers, options, args.delta_store, profile):
+            writer.write(block)
+            total += count
+            now = time.perf_counter()
+            if not args.quiet and now - last_report >= PROGRESS_INTERVAL_SECONDS:
+                _report(sys.stderr, total, started)
+                last_report = now
+    finally:
+        writer.close()
+        if handle is not None and handle is not sys.stdout:
+            handle.close()
+    if not args.quiet:
+        _report(sys.stderr, total, started, final=True)
+    if profile is not None:
+        _write_profile(args.profile, profile)
+    return 0
+
+
+def _write_profile(path: Path, profile: Counter[Stack]) -> None:
+    # pstats for .pstats/.prof files, collapsed stacks (flame graphs) otherwise.
+    if path.suffix in (".pstats", ".prof"):
+        path.write_bytes(pstats_dump(profile, DEFAULT_INTERVAL))
+    else:
+        path.write_text(collapsed_stacks(profile), encoding="utf-8")
+
+
+def _compile_rules_command(args: argparse.Namespace) -> int:
+    settings = _settings(args)
+    path = write_artifact(settings, args.output or artifact_path(settings))
+    if not args.quiet:
+        sys.stderr.write(f"Compiled {settings.rules_path} to {path} ({path.stat().st_size:,} bytes)\n")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="BVMW Typing Tool Segmenter")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    segment = subparsers.add_parser("segment", help="Segment members from a CSV, JSONL or Parquet file")
+    segment.add_argument("input", help="Input file ('-' for stdin)")
+    segment.add_argument("-o", "--output", default="-", help="Output file ('-' for stdout, default)")
+    segment.add_argument("--input-format", choices=FORMATS, help="Defaults to the input file extension")
+    segment.add_argument("--output-format", choices=FORMATS, help="Defaults to the output file extension or jsonl")
+    segment.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    segment.add_argument("--chunk-size", type=int, default=5000, help="Members per scoring chunk")
+    segment.add_argument("--id-field", help="Input field copied to each output row to identify the member")
+    segment.add_argument("--delimiter", default=",", help="CSV delimiter for input and output")
+    segment.add_argument("--pretty-scores", action="store_true", help="Round scores to 4 decimals")
+    segment.add_argument(
+        "--delta-store",
+        type=Path,
+        help="Fingerprint database; only members whose result changed since the last run are written",
+    )
+    segment.add_argument("--rules", type=Path, help="Rules file (defaults to SEGMENTER_RULES_PATH)")
+    segment.add_argument("--code-lists", type=Path, help="Code list file (defaults to SEGMENTER_CODE_LIST_PATH)")
+    segment.add_argument(
+        "--profile",
+        type=Path,
+        help="Sample the scoring and write the stacks to this file (pstats for .pstats/.prof, else collapsed stacks)",
+    )
+    segment.add_argument("-q", "--quiet", action="store_true", help="Do not report progress on stderr")
+    segment.set_defaults(handler=_segment_command)
+
+    compile_rules = subparsers.add_parser(
+        "compile-rules", help="Write the precompiled rules artifact that workers load at startup"
+    )
+    compile_rules.add_argument(
+        "-o", "--output", type=Path, help="Artifact path (defaults to SEGMENTER_RULES_ARTIFACT_PATH or <rules>.compiled)"
+    )
+    compile_rules.add_argument("--rules", type=Path, help="Rules file (defaults to SEGMENTER_RULES_PATH)")
+    compile_rules.add_argument(
+        "--code-lists", type=Path, help="Code list file (defaults to SEGMENTER_CODE_LIST_PATH)"
+    )
+    compile_rules.add_argument("-q", "--quiet", action="store_true", help="Do not report on stderr")
+    compile_rules.set_defaults(handler=_compile_rules_command)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    if getattr(args, "chunk_size", 1) < 1:
+        sys.stderr.write("error: --chunk-size must be positive\n")
+        return 2
+    try:
+        return args.handler(args)
+    except (CLIError, RulesLoaderError, OSError) as exc:
+        sys.stderr.write(f"error: {exc}\n")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import zlib
+from typing import Callable
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# zstd is optional; without the 'zstandard' package only gzip is offered. The
+# import is resolved once here, not per request.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+IDENTITY = "identity"
+
+# Bodies above this size are compressed on a worker thread instead of
+# blocking the event loop.
+_THREAD_MIN_BYTES = 256 * 1024
+# Request bodies are decoded into pieces of at most about this size.
+_DECODE_STEP_BYTES = 64 * 1024
+# zstd has no output limit per call, so compressed input is fed in slices
+# this small; even the densest frames then decode to a few MB per slice.
+_ZSTD_INPUT_BYTES = 256
+
+
+def supported_encodings() -> tuple[str, ...]:
+    return (ZSTD, GZIP) if zstandard is not None else (GZIP,)
+
+
+def _accepted(header: str) -> set[str]:
+    accepted = set()
+    for part in header.split(","):
+        name, _, parameters = part.partition(";")
+        quality = parameters.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    # The first supported encoding the client accepts, zstd before gzip.
+    accepted = _accepted(accept_encoding)
+    for encoding in supported_encodings():
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+class _Decoder:
+    # Decodes the compressed input fed to it in bounded pieces (read), and
+    # rejects bodies that decode to more than max_size bytes, so that a small
+    # compressed body cannot expand to gigabytes in memory.
+
+    def __init__(self, encoding: str, max_size: int) -> None:
+        self.max_size = max_size
+        self.size = 0
+        self._pending = b""
+        if encoding == GZIP:
+            # Also accepts concatenated gzip members, as produced by appending
+            # to a .gz file; see _read_gzip.
+            self._zlib = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            self._zstd = None
+            self._errors: tuple[type[Exception], ...] = (zlib.error,)
+        else:
+            self._zlib = None
+            self._zstd = zstandard.ZstdDecompressor().decompressobj()
+            self._errors = (zstandard.ZstdError,)
+
+    def feed(self, data: bytes) -> None:
+        self._pending += data
+
+    def read(self, size: int) -> bytes:
+        # Up to about size decoded bytes of the input fed so far; b"" once it
+        # is used up.
+        try:
+            decoded = self._read_zstd(size) if self._zstd is not None else self._read_gzip(size)
+        except self._errors as exc:
+            raise HTTPException(400, f"Invalid compressed request body: {exc}") from None
+        self.size += len(decoded)
+        if self.size > self.max_size:
+            raise HTTPException(413, f"Decompressed request body exceeds {self.max_size} bytes")
+        return decoded
+
+    def _read_gzip(self, size: int) -> bytes:
+        decoded: list[bytes] = []
+        remaining = size
+        while remaining > 0:
+            piece = self._zlib.decompress(self._pending, remaining)
+            self._pending = self._zlib.unconsumed_tail
+            if self._zlib.eof and self._zlib.unused_data:
+                self._pending = self._zlib.unused_data
+                self._zlib = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            elif not piece and not self._pending:
+                break
+            decoded.append(piece)
+            remaining -= len(piece)
+        return b"".join(decoded)
+
+    def _read_zstd(self, size: int) -> bytes:
+        decoded: list[bytes] = []
+        remaining = size
+        offset = 0
+        while remaining > 0 and offset < len(self._pending):
+            piece = self._zstd.decompress(self._pending[offset : offset + _ZSTD_INPUT_BYTES])
+            offset += _ZSTD_INPUT_BYTES
+            decoded.append(piece)
+            remaining -= len(piece)
+        self._pending = self._pending[offset:]
+        return b"".join(decoded)
+
+    def finish(self) -> None:
+        if self._zlib is not None and not self._zlib.eof:
+            raise HTTPException(400, "Invalid compressed request body: truncated gzip stream")
+
+
+class _Encoder:
+    def __init__(self, encoding: str, gzip_level: int, zstd_level: int) -> None:
+        if encoding == GZIP:
+            compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+            self._compress: Callable[[bytes], bytes] = compressor.compress
+            self._flush: Callable[[], bytes] = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._finish: Callable[[], bytes] = compressor.flush
+        else:
+            compressor = zstandard.ZstdCompressor(level=zstd_level).compressobj()
+            self._compress = compressor.compress
+            self._flush = lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+            self._finish = compressor.flush
+
+    def encode(self, data: bytes, last: bool) -> bytes:
+        # Every chunk is flushed, so streamed lines reach the client promptly.
+        return self._compress(data) + (self._finish() if last else self._flush())
+
+
+class CompressionMiddleware:
+    # Decompresses gzip/zstd request bodies (Content-Encoding) and compresses
+    # responses for clients that accept it (Accept-Encoding), chunk by chunk,
+    # so streamed requests and responses never have to be held in full.
+    # Decoded request bodies above max_decoded_size are rejected with 413.
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        compress_responses: bool = True,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        zstd_level: int = 3,
+        max_decoded_size: int = 256 * 1024 * 1024,
+    ) -> None:
+        self.app = app
+        self.max_decoded_size = max_decoded_size
+        self.compress_responses = compress_responses
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.zstd_level = zstd_level
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        content_encoding = headers.get("content-encoding", IDENTITY).strip().lower()
+        if content_encoding != IDENTITY:
+            if content_encoding not in supported_encodings():
+                supported = ", ".join(supported_encodings())
+                detail = f"Unsupported Content-Encoding '{content_encoding}', supported: {supported}"
+                response = JSONResponse({"detail": detail}, status_code=415)
+                await response(scope, receive, send)
+                return
+            scope = dict(scope)
+            # The app sees the decoded body, of unknown length.
+            scope["headers"] = [
+                (name, value)
+                for name, value in scope["headers"]
+                if name not in (b"content-encoding", b"content-length")
+            ]
+            receive = self._decoding_receive(receive, content_encoding)
+        encoding = choose_encoding(headers.get("accept-encoding", "")) if self.compress_responses else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+        else:
+            await self.app(scope, receive, self._encoding_send(send, encoding))
+
+    def _decoding_receive(self, receive: Receive, encoding: str) -> Receive:
+        decoder = _Decoder(encoding, self.max_decoded_size)
+        more_body = True
+        done = False
+
+        async def decoding_receive() -> Message:
+            # Each received message is passed on as one or more decoded pieces.
+            nonlocal more_body, done
+            if done:
+                return await receive()
+            while True:
+                body = decoder.read(_DECODE_STEP_BYTES)
+                if body:
+                    return {"type": "http.request", "body": body, "more_body": True}
+                if not more_body:
+                    decoder.finish()
+                    done = True
+                    return {"type": "http.request", "body": b"", "more_body": False}
+                message = await receive()
+                if message["type"] != "http.request":
+                    return message
+                decoder.feed(message.get("body", b""))
+                more_body = message.get("more_body", False)
+
+        return decoding_receive
+
+    def _encoding_send(self, send: Send, encoding: str) -> Send:
+        start: Message | None = None
+        encoder: _Encoder | None = None
+
+        async def encoding_send(message: Message) -> None:
+            nonlocal start, encoder
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                initial, start = start, None
+                headers = MutableHeaders(raw=initial["headers"])
+                if "content-encoding" in headers or (not more_body and len(body) < self.minimum_size):
+                    await send(initial)
+                    await send(message)
+                    return
+                encoder = _Encoder(encoding, self.gzip_level, self.zstd_level)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if "content-length" in headers:
+                    del headers["Content-Length"]
+                body = await self._encode(encoder, body, not more_body)
+                if not more_body:
+                    headers["Content-Length"] = str(len(body))
+                await send(initial)
+                await send({**message, "body": body})
+            elif encoder is not None:
+                await send({**message, "body": await self._encode(encoder, body, not more_body)})
+            else:
+                await send(message)
+
+        return encoding_send
+
+    async def _encode(self, encoder: _Encoder, body: bytes, last: bool) -> bytes:
+        if len(body) > _THREAD_MIN_BYTES:
+            return await anyio.to_thread.run_sync(encoder.encode, body, last)
+        return encoder.encode(body, last)
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -12,7 +12,36 @@ class Settings(BaseSettings):
 
     rules_path: Path = Field(default=Path("rules/bvmw_typing_tool_rules_v2.json"))
     code_list_path: Path = Field(default=Path("rules/code_lists.json"))
+    rules_dir: Optional[Path] = Field(default=None)
+    rules_glob: str = Field(default="*rules*.json")
+    rules_artifact_path: Optional[Path] = Field(default=None)
+    use_rules_artifact: bool = Field(default=True)
     case_insensitive: bool = Field(default=False)
+    reload_interval_seconds: float = Field(default=0.0)
+    admin_token: Optional[str] = Field(default=None)
+    cache_size: int = Field(default=10000)
+    metrics_enabled: bool = Field(default=False)
+    jobs_dir: Path = Field(default=Path("jobs"))
+    job_workers: int = Field(default=1)
+    job_chunk_size: int = Field(default=5000)
+    job_heartbeat_seconds: float = Field(default=5.0)
+    job_stale_seconds: float = Field(default=30.0)
+    delta_store_path: Path = Field(default=Path("delta/fingerprints.sqlite3"))
+    scoring_executor: Literal["thread", "process"] = Field(default="thread")
+    scoring_workers: int = Field(default=2)
+    scoring_max_pending: int = Field(default=16)
+    scoring_loop_max_bytes: int = Field(default=4096)
+    scoring_inline_max_bytes: int = Field(default=65536)
+    aggregate_max_groups: int = Field(default=1000)
+    ndjson_max_line_bytes: int = Field(default=1024 * 1024)
+    response_compression: bool = Field(default=True)
+    compression_min_bytes: int = Field(default=1024)
+    gzip_level: int = Field(default=6)
+    zstd_level: int = Field(default=3)
+    decompressed_max_bytes: int = Field(default=256 * 1024 * 1024)
+    warmup_members: int = Field(default=256)
+    profiler_enabled: bool = Field(default=False)
+    profiler_max_seconds: float = Field(default=60.0)
 
 
 class RuleSetMetadata(BaseModel):
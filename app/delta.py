@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterable
+
+import numpy as np
+
+from app.batch import SEGMENT_TYPES, _position_matrix, _rank_batch
+from app.metrics import metrics
+from app.rules_loader import RuleSet
+from app.segmenter import SegmentResult
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS member_fingerprints (
+    rule_set_key TEXT NOT NULL,
+    member_id TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    segment TEXT NOT NULL,
+    type TEXT NOT NULL,
+    scores TEXT NOT NULL,
+    PRIMARY KEY (rule_set_key, member_id)
+) WITHOUT ROWID
+"""
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+    signature: str
+    segment: str
+    type: str
+    scores: str
+
+
+@dataclass(frozen=True)
+class DeltaResult:
+    member_id: str
+    result: SegmentResult
+    previous_segment: str | None
+    previous_type: str | None
+
+
+class FingerprintStore:
+    # Last feature signature and result per member id, kept separately for each
+    # rule_set_version and rule set content (RuleSet.fingerprint), so that a new
+    # version, or any change to the rules, code lists, aliases or buckets under
+    # the same version, starts from an empty store.
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    with closing(sqlite3.connect(self.path)) as connection, connection:
+                        # WAL lets the bulk CLI's worker processes read while one of them writes.
+                        connection.execute("PRAGMA journal_mode=WAL")
+                        connection.execute(_SCHEMA)
+                    self._initialized = True
+        return sqlite3.connect(self.path, timeout=60)
+
+    def _select(self, rule_set_key: str, member_ids: Iterable[str], columns: str) -> list[Any]:
+        # Joining against a temporary id table is several times faster than
+        # batches of "IN (...)" lookups for large syncs.
+        with closing(self._connect()) as connection:
+            connection.execute("CREATE TEMP TABLE lookup_ids (member_id TEXT PRIMARY KEY) WITHOUT ROWID")
+            connection.executemany(
+                "INSERT OR IGNORE INTO lookup_ids (member_id) VALUES (?)", ((member_id,) for member_id in member_ids)
+            )
+            return connection.execute(
+                f"SELECT {columns} FROM lookup_ids AS l JOIN member_fingerprints AS f"
+                " ON f.rule_set_key = ? AND f.member_id = l.member_id",
+                (rule_set_key,),
+            ).fetchall()
+
+    def signatures(self, rule_set_key: str, member_ids: Iterable[str]) -> dict[str, str]:
+        return dict(self._select(rule_set_key, member_ids, "f.member_id, f.signature"))
+
+    def lookup(self, rule_set_key: str, member_ids: Iterable[str]) -> dict[str, Fingerprint]:
+        rows = self._select(rule_set_key, member_ids, "f.member_id, f.signature, f.segment, f.type, f.scores")
+        return {member_id: Fingerprint(*values) for member_id, *values in rows}
+
+    def save(self, rule_set_key: str, fingerprints: dict[str, Fingerprint]) -> None:
+        if not fingerprints:
+            return
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO member_fingerprints"
+                " (rule_set_key, member_id, signature, segment, type, scores) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (rule_set_key, member_id, fp.signature, fp.segment, fp.type, fp.scores)
+                    for member_id, fp in fingerprints.items()
+                ],
+            )
+
+    def prune(self, keep_keys: Iterable[str]) -> int:
+        # Deletes the rows of all other rule sets; they would never be read again.
+        keep = list(keep_keys)
+        placeholders = ",".join("?" * len(keep)) or "NULL"
+        with closing(self._connect()) as connection, connection:
+            cursor = connection.execute(
+                f"DELETE FROM member_fingerprints WHERE rule_set_key NOT IN ({placeholders})", keep
+            )
+        return cursor.rowcount
+
+
+def rule_set_key(ruleset: RuleSet) -> str:
+    return f"{ruleset.rule_set_version}:{ruleset.fingerprint}"
+
+
+def _member_id(member: dict[str, Any], id_field: str) -> str:
+    member_id = member.get(id_field)
+    if member_id is None or member_id == "":
+        raise ValueError(f"Member is missing the id field '{id_field}'")
+    return str(member_id)
+
+
+def segment_delta(
+    members: list[dict[str, Any]],
+    ruleset: RuleSet,
+    store: FingerprintStore,
+    id_field: str,
+    pretty_scores: bool = False,
+) -> tuple[list[DeltaResult], int]:
+    # Returns the members whose segment, type or scores changed since they were
+    # last seen under these rules, plus the number of unchanged ones.
+    # Members with an unchanged feature signature are skipped before scoring.
+    member_ids = [_member_id(member, id_field) for member in members]
+    if not members:
+        return [], 0
+    key = rule_set_key(ruleset)
+    sentinel = len(ruleset.compiled.coefficients)
+    with metrics.timer("batch_features"):
+        fields = ruleset.compiled.fields
+        columns = [[member.get(field.input_field) for member in members] for field in fields]
+        positions = _position_matrix(columns, len(members), ruleset)
+    # Rows are sorted, so the sentinel padding sits at the end of each row.
+    counts = (positions != sentinel).sum(axis=1).tolist()
+    signatures = [",".join(map(str, row[:count])) for row, count in zip(positions.tolist(), counts)]
+
+    # Only signatures are read for the whole batch; full previous results are
+    # fetched for the few members whose signature changed.
+    known_signatures = store.signatures(key, member_ids)
+    candidates = [
+        index
+        for index, (member_id, signature) in enumerate(zip(member_ids, signatures))
+        if known_signatures.get(member_id) != signature
+    ]
+    if not candidates:
+        return [], len(members)
+    known = store.lookup(key, (member_ids[index] for index in candidates if member_ids[index] in known_signatures))
+
+    scored = _rank_batch(positions[np.asarray(candidates)], ruleset)
+    segments = scored.segments
+    changed: list[int] = []
+    changed_rows: list[int] = []
+    previous_results: list[Fingerprint | None] = []
+    updates: dict[str, Fingerprint] = {}
+    rows = zip(scored.scores.tolist(), scored.best.tolist(), scored.types.tolist())
+    for row, (index, (scores, best, type_code)) in enumerate(zip(candidates, rows)):
+        member_id = member_ids[index]
+        fingerprint = Fingerprint(
+            signature=signatures[index],
+            segment=segments[best],
+            type=SEGMENT_TYPES[type_code],
+            scores=json.dumps(scores),
+        )
+        previous = known.get(member_id)
+        updates[member_id] = fingerprint
+        if previous is not None and (previous.segment, previous.type, previous.scores) == (
+            fingerprint.segment,
+            fingerprint.type,
+            fingerprint.scores,
+        ):
+            continue
+        changed.append(index)
+        changed_rows.append(row)
+        previous_results.append(previous)
+    store.save(key, updates)
+
+    # Only the changed members are materialized.
+    results = scored[np.asarray(changed_rows, dtype=np.intp)].results(pretty_scores)
+    delta = [
+        DeltaResult(
+            member_id=member_ids[index],
+            result=result,
+            previous_segment=previous.segment if previous is not None else None,
+            previous_type=previous.type if previous is not None else None,
+        )
+        for index, result, previous in zip(changed, results, previous_results)
+    ]
+    return delta, len(members) - len(delta)
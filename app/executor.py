@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import math
+import multiprocessing
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+
+from app.aggregate import Aggregator
+from app.batch import column_length, score_batch, score_batch_compact, score_columns, score_columns_compact
+from app.metrics import metrics
+from app.model import ColumnarBatchRequest
+from app.projection import member_parser
+from app.responses import encode_batch_response, encode_batch_scores_response, encode_compact_response
+from app.rules_loader import RuleSet
+
+THREAD = "thread"
+PROCESS = "process"
+
+# Rule sets a worker process keeps unpickled, most recently used last.
+_MAX_CACHED_RULESETS = 8
+_worker_rulesets: OrderedDict[str, RuleSet] = OrderedDict()
+
+
+def _worker_ruleset(token: str, payload: bytes) -> RuleSet:
+    ruleset = _worker_rulesets.get(token)
+    if ruleset is None:
+        ruleset = _worker_rulesets[token] = pickle.loads(payload)
+        if len(_worker_rulesets) > _MAX_CACHED_RULESETS:
+            _worker_rulesets.popitem(last=False)
+    else:
+        _worker_rulesets.move_to_end(token)
+    return ruleset
+
+
+class _RuleSetRef:
+    # Unpickles to the RuleSet itself; worker processes decode each rule set
+    # only once, so tasks just carry a token and the (pre-pickled) bytes.
+
+    def __init__(self, token: str, payload: bytes) -> None:
+        self.token = token
+        self.payload = payload
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return _worker_ruleset, (self.token, self.payload)
+
+
+class InvalidBatch(Exception):
+    def __init__(self, status_code: int, detail: Any) -> None:
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class ExecutorSaturated(Exception):
+    def __init__(self, status_code: int, retry_after: int) -> None:
+        super().__init__(status_code, retry_after)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class ScoredBatch:
+    body: bytes
+    size: int
+    # Members per (segment, type), for the metrics of the calling process.
+    counts: dict[tuple[str, str], int]
+
+
+def _validate(parse: Callable[[bytes], Any], body: bytes) -> Any:
+    try:
+        return parse(body)
+    except ValidationError as exc:
+        # Same locations as FastAPI's own body validation errors.
+        errors = [{**error, "loc": ("body", *error["loc"])} for error in exc.errors(include_url=False)]
+        raise InvalidBatch(422, jsonable_encoder(errors)) from None
+
+
+def score_batch_body(
+    body: bytes,
+    ruleset: RuleSet,
+    columnar: bool,
+    include_features: bool,
+    pretty_scores: bool,
+    explain: bool,
+    top_k: int = 0,
+    probabilities: bool = False,
+    compact: bool = False,
+) -> ScoredBatch:
+    # Parses, scores and encodes a /segment/batch (or columnar) request body,
+    # so that all of the CPU-heavy work runs on the scoring executor.
+    if columnar:
+        columns = _validate(ColumnarBatchRequest.model_validate_json, body).columns
+        try:
+            column_length(columns)
+        except ValueError as exc:
+            raise InvalidBatch(400, str(exc)) from None
+    else:
+        # Only the scored fields of each item are parsed into Python objects.
+        items = _validate(member_parser(ruleset).items, body)
+    version = ruleset.rule_set_version
+    if not (include_features or explain or top_k or probabilities):
+        # Plain results are encoded straight from the compact arrays.
+        batch = score_columns_compact(columns, ruleset) if columnar else score_batch_compact(items, ruleset)
+        with metrics.timer("serialize"):
+            if compact:
+                encoded = encode_compact_response(batch, version, pretty_scores)
+            else:
+                encoded = encode_batch_scores_response(batch, version, pretty_scores)
+        return ScoredBatch(encoded, len(batch), batch.counts())
+    options = (include_features, pretty_scores, explain, top_k, probabilities)
+    scored = score_columns(columns, ruleset, *options) if columnar else score_batch(items, ruleset, *options)
+    counts: dict[tuple[str, str], int] = {}
+    for result in scored:
+        key = (result.segment, result.type)
+        counts[key] = counts.get(key, 0) + 1
+    with metrics.timer("serialize"):
+        encoded = encode_batch_response(scored, version)
+    return ScoredBatch(encoded, len(scored), counts)
+
+
+def aggregate_batch_body(body: bytes, ruleset: RuleSet, aggregator: Aggregator, chunk_size: int = 10000) -> Aggregator:
+    # Scores a /segment/aggregate request body chunk by chunk, so that only
+    # one chunk of scores exists at a time next to the parsed items.
+    items = _validate(member_parser(ruleset, aggregator.group_by).items, body)
+    for start in range(0, len(items), chunk_size):
+        aggregator.add_members(items[start : start + chunk_size], ruleset)
+    return aggregator
+
+
+def _noop() -> None:
+    return None
+
+
+class ScoringExecutor:
+    # Runs CPU-heavy scoring on a dedicated thread or process pool. At most
+    # `workers` tasks run at once; up to `max_pending` more wait, smallest
+    # first, and further requests are rejected with a Retry-After estimate.
+    # Admission is tracked on the event loop, so run() must be awaited there.
+
+    def __init__(self, kind: str = THREAD, workers: int = 2, max_pending: int = 16) -> None:
+        if kind not in (THREAD, PROCESS):
+            raise ValueError(f"Unknown scoring executor '{kind}', expected '{THREAD}' or '{PROCESS}'")
+        self.kind = kind
+        self.workers = max(workers, 1)
+        self.max_pending = max(max_pending, 0)
+        self.rejected = 0
+        self._pool: Executor | None = None
+        self._pool_lock = threading.Lock()
+        self._running = 0
+        self._waiting: list[tuple[int, int, asyncio.Future[None]]] = []
+        self._sequence = itertools.count()
+        # Moving average of task durations, for Retry-After.
+        self._average_seconds = 0.1
+        self._refs: OrderedDict[int, tuple[RuleSet, _RuleSetRef]] = OrderedDict()
+
+    @property
+    def pending(self) -> int:
+        return sum(1 for _, _, waiter in self._waiting if not waiter.done())
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def start(self) -> Executor:
+        with self._pool_lock:
+            if self._pool is None:
+                if self.kind == PROCESS:
+                    # spawn: forking the threaded server process is not safe.
+                    self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+                    for _ in range(self.workers):
+                        self._pool.submit(_noop)
+                else:
+                    self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="scoring")
+            return self._pool
+
+    def shutdown(self) -> None:
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def ruleset_arg(self, ruleset: RuleSet) -> Any:
+        # What to pass for a RuleSet argument: the object itself for threads,
+        # a cached pickled reference for worker processes.
+        if self.kind == THREAD:
+            return ruleset
+        entry = self._refs.get(id(ruleset))
+        if entry is None or entry[0] is not ruleset:
+            entry = (ruleset, _RuleSetRef(uuid.uuid4().hex, pickle.dumps(ruleset, pickle.HIGHEST_PROTOCOL)))
+            self._refs[id(ruleset)] = entry
+            if len(self._refs) > _MAX_CACHED_RULESETS:
+                self._refs.popitem(last=False)
+        else:
+            self._refs.move_to_end(id(ruleset))
+        return entry[1]
+
+    def _retry_after(self) -> int:
+        backlog = self.pending + self._running + 1
+        return max(1, math.ceil(backlog * self._average_seconds / self.workers))
+
+    async def _acquire(self, size: int) -> None:
+        if self._running < self.workers and not self.pending:
+            self._running += 1
+            return
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ExecutorSaturated(429, self._retry_after())
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (size, next(self._sequence), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was already handed over; pass it on.
+                self._release()
+            else:
+                waiter.cancel()
+            raise
+
+    def _release(self) -> None:
+        while self._waiting:
+            _, _, waiter = heapq.heappop(self._waiting)
+            if not waiter.done():
+                # Hands the slot over; _running stays unchanged.
+                waiter.set_result(None)
+                return
+        self._running -= 1
+
+    async def run(self, size: int, function: Callable[..., Any], *args: Any) -> Any:
+        # size orders waiting tasks (e.g. the request body length), so small
+        # requests overtake bulk ones.
+        await self._acquire(size)
+        started = time.perf_counter()
+        try:
+            pool = self.start()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(pool, function, *args)
+            except BrokenProcessPool:
+                # A crashed worker breaks the whole pool; start a new one next time.
+                with self._pool_lock:
+                    if self._pool is pool:
+                        self._pool = None
+                raise ExecutorSaturated(503, self._retry_after()) from None
+        finally:
+            self._average_seconds = 0.8 * self._average_seconds + 0.2 * (time.perf_counter() - started)
+            self._release()
@@ -0,0 +1,393 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterator
+
+from app.rules_registry import RulesRegistry, UnknownRuleSetVersion
+from app.streaming import score_ndjson_lines
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    rule_set_version TEXT NOT NULL,
+    include_features INTEGER NOT NULL,
+    pretty_scores INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    processed INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    error TEXT,
+    owner TEXT,
+    heartbeat TEXT
+)
+"""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse_time(value: str | None) -> datetime | None:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _process_alive(owner: str) -> bool | None:
+    # None when that cannot be told from here (another host or no pid).
+    host, _, rest = owner.partition(":")
+    pid, _, _ = rest.partition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Alive, but owned by another user.
+        pass
+    return True
+
+
+class UnknownJob(KeyError):
+    pass
+
+
+@dataclass(frozen=True)
+class Job:
+    id: str
+    status: str
+    rule_set_version: str
+    include_features: bool
+    pretty_scores: bool
+    total: int
+    processed: int
+    created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    error: str | None = None
+
+    @property
+    def items_per_second(self) -> float | None:
+        if self.started_at is None or self.processed == 0:
+            return None
+        elapsed = ((self.finished_at or _now()) - self.started_at).total_seconds()
+        return self.processed / elapsed if elapsed > 0 else None
+
+
+class JobStore:
+    # Job state lives in a SQLite file next to the per-job input and result
+    # files, so jobs survive restarts without an external broker.
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self._database = directory / "jobs.sqlite3"
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self.directory.mkdir(parents=True, exist_ok=True)
+                    with closing(sqlite3.connect(self._database)) as connection, connection:
+                        connection.execute(_SCHEMA)
+                    self._initialized = True
+        connection = sqlite3.connect(self._database, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def job_dir(self, job_id: str) -> Path:
+        return self.directory / job_id
+
+    def input_path(self, job_id: str) -> Path:
+        return self.job_dir(job_id) / "input.ndjson"
+
+    def results_path(self, job_id: str) -> Path:
+        return self.job_dir(job_id) / "results.ndjson"
+
+    def create(
+        self,
+        job_id: str,
+        rule_set_version: str,
+        include_features: bool,
+        pretty_scores: bool,
+        total: int,
+        owner: str | None = None,
+    ) -> Job:
+        job = Job(
+            id=job_id,
+            status=QUEUED,
+            rule_set_version=rule_set_version,
+            include_features=include_features,
+            pretty_scores=pretty_scores,
+            total=total,
+            processed=0,
+            created_at=_now(),
+        )
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT INTO jobs (id, status, rule_set_version, include_features, pretty_scores, total, created_at,"
+                " owner, heartbeat) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    QUEUED,
+                    rule_set_version,
+                    include_features,
+                    pretty_scores,
+                    total,
+                    job.created_at.isoformat(),
+                    owner,
+                    job.created_at.isoformat(),
+                ),
+            )
+        return job
+
+    def get(self, job_id: str) -> Job:
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise UnknownJob(job_id)
+        return Job(
+            id=row["id"],
+            status=row["status"],
+            rule_set_version=row["rule_set_version"],
+            include_features=bool(row["include_features"]),
+            pretty_scores=bool(row["pretty_scores"]),
+            total=row["total"],
+            processed=row["processed"],
+            created_at=datetime.fromisoformat(row["created_at"]),
+            started_at=_parse_time(row["started_at"]),
+            finished_at=_parse_time(row["finished_at"]),
+            error=row["error"],
+        )
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        values = {name: value.isoformat() if isinstance(value, datetime) else value for name, value in fields.items()}
+        assignments = ", ".join(f"{name} = ?" for name in values)
+        with closing(self._connect()) as connection, connection:
+            connection.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*values.values(), job_id))
+
+    def update_owned(self, job_id: str, owner: str, **fields: Any) -> bool:
+        # Like update, but only while owner still holds the job.
+        values = {name: value.isoformat() if isinstance(value, datetime) else value for name, value in fields.items()}
+        assignments = ", ".join(f"{name} = ?" for name in values)
+        with closing(self._connect()) as connection, connection:
+            cursor = connection.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND owner = ?", (*values.values(), job_id, owner)
+            )
+        return cursor.rowcount == 1
+
+    def unfinished(self) -> list[tuple[str, str | None, datetime | None]]:
+        # (id, owner, heartbeat) of queued and running jobs.
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT id, owner, heartbeat FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+        return [(row["id"], row["owner"], _parse_time(row["heartbeat"])) for row in rows]
+
+    def claim(self, job_id: str, owner: str, previous_owner: str | None) -> bool:
+        # Takes over an unfinished job from previous_owner and queues it from
+        # the start. Of several processes claiming the same job, one wins.
+        with closing(self._connect()) as connection, connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET owner = ?, heartbeat = ?, status = ?, processed = 0, started_at = NULL"
+                " WHERE id = ? AND status IN (?, ?) AND owner IS ?",
+                (owner, _now().isoformat(), QUEUED, job_id, QUEUED, RUNNING, previous_owner),
+            )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, owner: str) -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status IN (?, ?)",
+                (_now().isoformat(), owner, QUEUED, RUNNING),
+            )
+
+    def release(self, owner: str) -> None:
+        # Leaves owner's unfinished jobs to whichever process recovers next.
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "UPDATE jobs SET owner = NULL WHERE owner = ? AND status IN (?, ?)", (owner, QUEUED, RUNNING)
+            )
+
+
+def count_members(path: Path) -> int:
+    with path.open("rb") as handle:
+        return sum(1 for line in handle if line.strip())
+
+
+def _read_lines(path: Path, chunk_size: int) -> Iterator[list[tuple[int, bytes]]]:
+    with path.open("rb") as handle:
+        lines: list[tuple[int, bytes]] = []
+        for line_number, line in enumerate(handle, start=1):
+            if not line.strip():
+                continue
+            lines.append((line_number, line))
+            if len(lines) >= chunk_size:
+                yield lines
+                lines = []
+        if lines:
+            yield lines
+
+
+def write_items(items: list[dict[str, Any]], path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as handle:
+        for item in items:
+            handle.write(json.dumps(item, ensure_ascii=False))
+            handle.write("\n")
+
+
+async def write_upload(chunks: AsyncIterator[bytes], path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("wb") as handle:
+        async for chunk in chunks:
+            handle.write(chunk)
+
+
+class JobManager:
+    # Each job row names the manager running it (host:pid:token) and carries
+    # a heartbeat, so that several uvicorn workers can share one jobs
+    # directory: recover() only takes over jobs whose owner is gone.
+
+    def __init__(
+        self,
+        store: JobStore,
+        registry: RulesRegistry,
+        workers: int = 1,
+        chunk_size: int = 5000,
+        heartbeat_seconds: float = 5.0,
+        stale_seconds: float = 30.0,
+    ) -> None:
+        self.store = store
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._registry = registry
+        self._workers = max(workers, 1)
+        self._chunk_size = chunk_size
+        self._heartbeat_seconds = heartbeat_seconds
+        self._stale_after = timedelta(seconds=stale_seconds)
+        self._executor: ThreadPoolExecutor | None = None
+        self._heartbeat: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def new_job_id(self) -> str:
+        return uuid.uuid4().hex
+
+    def submit(self, job_id: str, rule_set_version: str, include_features: bool, pretty_scores: bool) -> Job:
+        # The upload must already be in store.input_path(job_id).
+        total = count_members(self.store.input_path(job_id))
+        job = self.store.create(job_id, rule_set_version, include_features, pretty_scores, total, self.owner)
+        self._enqueue(job_id)
+        return job
+
+    def _enqueue(self, job_id: str) -> None:
+        with self._lock:
+            if self._executor is None:
+                self._stop.clear()
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="segment-job")
+                self._heartbeat = threading.Thread(target=self._beat, name="segment-job-heartbeat", daemon=True)
+                self._heartbeat.start()
+            self._executor.submit(self._run, job_id)
+
+    def _beat(self) -> None:
+        while not self._stop.wait(self._heartbeat_seconds):
+            try:
+                self.store.heartbeat(self.owner)
+            except sqlite3.Error:
+                logger.exception("Job heartbeat failed")
+
+    def _orphaned(self, owner: str | None, heartbeat: datetime | None) -> bool:
+        if owner is None:
+            return True
+        if owner == self.owner:
+            return False
+        # A pid can be reused (say, after a container restart), so a live one
+        # only counts as long as its heartbeat is fresh.
+        if _process_alive(owner) is False:
+            return True
+        return heartbeat is None or _now() - heartbeat > self._stale_after
+
+    def recover(self) -> None:
+        # Jobs whose owner shut down or died start over; their partial results
+        # are discarded. Jobs of live sibling processes are left alone.
+        for job_id, owner, heartbeat in self.store.unfinished():
+            if self._orphaned(owner, heartbeat) and self.store.claim(job_id, self.owner, owner):
+                self.store.results_path(job_id).unlink(missing_ok=True)
+                self._enqueue(job_id)
+
+    def shutdown(self, cancel: bool = True) -> None:
+        # With cancel, running jobs stop after their current chunk and queued
+        # jobs stay queued; both are picked up again by recover().
+        with self._lock:
+            executor, self._executor = self._executor, None
+            heartbeat, self._heartbeat = self._heartbeat, None
+        if executor is None:
+            return
+        if cancel:
+            self._stop.set()
+        executor.shutdown(wait=True, cancel_futures=cancel)
+        self._stop.set()
+        if heartbeat is not None:
+            heartbeat.join()
+        self.store.release(self.owner)
+
+    def _run(self, job_id: str) -> None:
+        if self._stop.is_set():
+            return
+        job = self.store.get(job_id)
+        try:
+            ruleset = self._registry.get(job.rule_set_version).ruleset
+        except Exception as exc:
+            # Also broken rules (RulesLoaderError): the job must not stay
+            # queued while this process keeps its heartbeat fresh.
+            error = "Rule set version is no longer loaded" if isinstance(exc, UnknownRuleSetVersion) else str(exc)
+            self.store.update_owned(job_id, self.owner, status=FAILED, finished_at=_now(), error=error)
+            return
+        if not self.store.update_owned(job_id, self.owner, status=RUNNING, started_at=_now()):
+            return
+        processed = 0
+        try:
+            with self.store.results_path(job_id).open("wb") as output:
+                for lines in _read_lines(self.store.input_path(job_id), self._chunk_size):
+                    if self._stop.is_set():
+                        # Left as running; recover() restarts it on the next start.
+                        return
+                    output.write(
+                        score_ndjson_lines(
+                            lines,
+                            ruleset,
+                            include_features=job.include_features,
+                            pretty_scores=job.pretty_scores,
+                            source="job",
+                        )
+                    )
+                    output.flush()
+                    processed += len(lines)
+                    if not self.store.update_owned(job_id, self.owner, processed=processed, heartbeat=_now()):
+                        logger.warning("Segmentation job %s was taken over by another process", job_id)
+                        return
+        except Exception as exc:
+            logger.exception("Segmentation job %s failed", job_id)
+            self.store.update_owned(job_id, self.owner, status=FAILED, finished_at=_now(), error=str(exc))
+            return
+        self.store.update_owned(job_id, self.owner, status=COMPLETED, finished_at=_now())
@@ -1,92 +1,677 @@
 from __future__ import annotations
 
+import asyncio
+import hmac
 import logging
-from typing import Any
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Literal, Optional
 
-from fastapi import Body, FastAPI, HTTPException, Query
+from fastapi import Body, FastAPI, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response
+from pydantic import BaseModel, ValidationError
 
+from app.aggregate import Aggregator
+from app.cache import ScoreCache
+from app.compression import CompressionMiddleware
 from app.config import Settings
-from app.model import BatchRequest, BatchResponse, HealthResponse, MetaResponse, SegmentResponse
-from app.rules_loader import RuleSet, RulesLoaderError, load_rules
-from app.segmenter import score_member
+from app.delta import FingerprintStore, rule_set_key, segment_delta
+from app.executor import (
+    PROCESS,
+    ExecutorSaturated,
+    InvalidBatch,
+    ScoringExecutor,
+    aggregate_batch_body,
+    score_batch_body,
+)
+from app.jobs import COMPLETED, Job, JobManager, JobStore, UnknownJob, write_items, write_upload
+from app.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from app.metrics import Collector, MetricsMiddleware, metrics
+from app.model import (
+    AggregateResponse,
+    BatchRequest,
+    BatchResponse,
+    CacheStats,
+    ColumnarBatchRequest,
+    CompareResponse,
+    DeltaItemResponse,
+    DeltaResponse,
+    HealthResponse,
+    JobResponse,
+    MetaResponse,
+    ReadyResponse,
+    ReloadResponse,
+    SegmentResponse,
+)
+from app.profiler import SamplingProfiler, collapsed_stacks, pstats_dump
+from app.projection import member_parser
+from app.responses import RawJSONResponse, encode_segment_result
+from app.rules_loader import RuleSet, RulesLoaderError
+from app.rules_registry import LoadedRuleSet, RulesRegistry, UnknownRuleSetVersion
+from app.segmenter import SegmentResult
+from app.startup import FAILED, Startup, warm_up, warm_up_body
+from app.streaming import (
+    NDJSON_MEDIA_TYPE,
+    NDJSONStreamingResponse,
+    compact_stream_header,
+    iter_ndjson_chunks,
+    parse_ndjson_lines,
+    score_ndjson_lines,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def create_app(ruleset: RuleSet | None = None) -> FastAPI:
-    app = FastAPI(title="BVMW Typing Tool Segmenter", version="1.0.0")
+def json_request_body(model: type[BaseModel]) -> dict[str, Any]:
+    # For endpoints that read the raw body themselves.
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": model.model_json_schema()}}}}
+
+
+def create_app(ruleset: RuleSet | None = None, settings: Settings | None = None) -> FastAPI:
+    if settings is None:
+        settings = Settings()
+    if ruleset is not None:
+        registry = RulesRegistry(ruleset=ruleset)
+    else:
+        # Loaded in the background by the lifespan (or on first access without
+        # one), so importing this module never fails on a broken rules file.
+        registry = RulesRegistry(settings=settings, lazy=True)
+    startup = Startup(ready=ruleset is not None)
+
+    cache = ScoreCache(settings.cache_size)
+    # Held while /debug/profile samples, one window at a time.
+    profiling = asyncio.Lock()
+
+    def warm_up_rulesets() -> None:
+        for version in registry.versions:
+            warm_up(registry.get(version).ruleset, settings.warmup_members)
+
+    # The lifespan's loop, for listeners called from other threads.
+    event_loop: asyncio.AbstractEventLoop | None = None
+
+    def rules_loaded(loaded: LoadedRuleSet) -> None:
+        cache.clear()
+        if startup.status == FAILED and event_loop is not None:
+            # The rules were fixed by a reload after a failed startup; the rest
+            # of the startup (warm-up, also of worker processes) runs again.
+            startup.retry()
+            asyncio.run_coroutine_threadsafe(start_up(load_rules=False), event_loop)
+
+    registry.add_listener(rules_loaded)
+    if settings.metrics_enabled:
+        # Recording is process-wide; another app in the process (e.g. in
+        # tests) never switches it off for this one.
+        metrics.configure(True)
+    fingerprints = FingerprintStore(settings.delta_store_path)
+    # Rule set keys the delta store was last pruned to.
+    delta_keys: frozenset[str] = frozenset()
+    jobs = JobManager(
+        JobStore(settings.jobs_dir),
+        registry,
+        settings.job_workers,
+        settings.job_chunk_size,
+        settings.job_heartbeat_seconds,
+        settings.job_stale_seconds,
+    )
+    scoring = ScoringExecutor(settings.scoring_executor, settings.scoring_workers, settings.scoring_max_pending)
+    # This app's own values, rendered by its /metrics endpoint.
+    collectors = [
+        Collector("segmenter_cache_hits_total", "Score cache hits", "counter", lambda: {(): cache.hits}),
+        Collector("segmenter_cache_misses_total", "Score cache misses", "counter", lambda: {(): cache.misses}),
+        Collector("segmenter_cache_size", "Score cache entries", "gauge", lambda: {(): len(cache)}),
+        Collector(
+            "segmenter_scoring_running", "Batches being scored on the executor", "gauge", lambda: {(): scoring.running}
+        ),
+        Collector(
+            "segmenter_scoring_pending", "Batches waiting for the executor", "gauge", lambda: {(): scoring.pending}
+        ),
+        Collector(
+            "segmenter_scoring_rejected_total",
+            "Batches rejected because the executor queue was full",
+            "counter",
+            lambda: {(): scoring.rejected},
+        ),
+    ]
+
+    async def warm_up_workers() -> None:
+        # Each worker process imports the app modules and unpickles the rule
+        # set on its first task.
+        ruleset = registry.current.ruleset
+        body = warm_up_body(ruleset, settings.warmup_members)
+        await asyncio.gather(
+            *(
+                scoring.run(0, score_batch_body, body, scoring.ruleset_arg(ruleset), False, False, False, False)
+                for _ in range(scoring.workers)
+            )
+        )
+
+    async def start_up(load_rules: bool = True) -> None:
+        # Liveness (/health) is served meanwhile; /ready only once this is done.
+        startup.started = True
+        try:
+            if load_rules:
+                with startup.stage("load_rules"):
+                    await run_in_threadpool(registry.load)
+            # Only with the rules loaded, so recovered jobs do not fail on them.
+            await run_in_threadpool(jobs.recover)
+            if settings.warmup_members > 0:
+                with startup.stage("warm_up"):
+                    await run_in_threadpool(warm_up_rulesets)
+                if scoring.kind == PROCESS:
+                    with startup.stage("warm_up_workers"):
+                        await warm_up_workers()
+        except Exception as exc:
+            if not isinstance(exc, RulesLoaderError):
+                logger.exception("Startup failed")
+            startup.fail(str(exc))
+            return
+        startup.finish()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+        nonlocal event_loop
+        event_loop = asyncio.get_running_loop()
+        registry.start_watching(settings.reload_interval_seconds)
+        if scoring.kind == PROCESS:
+            # Starts the worker processes now rather than on the first batch.
+            scoring.start()
+        task = asyncio.create_task(start_up())
+        try:
+            yield
+        finally:
+            event_loop = None
+            task.cancel()
+            await run_in_threadpool(jobs.shutdown)
+            await run_in_threadpool(scoring.shutdown)
+            registry.stop_watching()
+
+    app = FastAPI(title="BVMW Typing Tool Segmenter", version="1.0.0", lifespan=lifespan)
+    app.state.registry = registry
+    app.state.cache = cache
+    app.state.jobs = jobs
+    app.state.scoring = scoring
+    app.add_middleware(
+        CompressionMiddleware,
+        compress_responses=settings.response_compression,
+        minimum_size=settings.compression_min_bytes,
+        gzip_level=settings.gzip_level,
+        zstd_level=settings.zstd_level,
+        max_decoded_size=settings.decompressed_max_bytes,
+    )
     app.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    app.add_middleware(MetricsMiddleware, metrics=metrics, enabled=settings.metrics_enabled)
 
-    if ruleset is None:
-        settings = Settings()
+    @app.exception_handler(RulesLoaderError)
+    async def rules_not_loaded(request: Request, exc: RulesLoaderError) -> JSONResponse:
+        # Lazily loaded rules that fail to load (without a startup task).
+        return JSONResponse({"detail": f"Rules are not loaded: {exc}"}, status_code=503)
+
+    def resolve_loaded(version: str | None) -> LoadedRuleSet:
+        if not registry.loaded and startup.started:
+            # Not waiting on the startup task's load, which would block the event loop.
+            raise HTTPException(
+                status_code=503,
+                detail=f"Rules are not loaded: {startup.error}" if startup.error else "Rules are still loading",
+                headers={"Retry-After": "1"},
+            )
         try:
-            ruleset = load_rules(settings)
-        except RulesLoaderError as exc:
-            logger.error("Failed to load rules: %s", exc)
-            raise RuntimeError(str(exc)) from exc
+            return registry.get(version)
+        except UnknownRuleSetVersion:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Unknown rule_set_version '{version}', available: {registry.versions}",
+            ) from None
+
+    def require_admin(token: str | None) -> None:
+        if not settings.admin_token:
+            raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+        if token is None or not hmac.compare_digest(token.encode("utf-8"), settings.admin_token.encode("utf-8")):
+            raise HTTPException(status_code=401, detail="Invalid admin token")
+
+    def job_response(job: Job) -> JobResponse:
+        return JobResponse(
+            id=job.id,
+            status=job.status,
+            rule_set_version=job.rule_set_version,
+            total=job.total,
+            processed=job.processed,
+            items_per_second=job.items_per_second,
+            created_at=job.created_at,
+            started_at=job.started_at,
+            finished_at=job.finished_at,
+            error=job.error,
+        )
+
+    def result_fields(result: SegmentResult) -> dict[str, Any]:
+        # The optional parts stay unset, and with response_model_exclude_unset
+        # unrendered, unless they were requested.
+        fields = dict(result.__dict__)
+        for name in ("explanation", "ranking", "probabilities"):
+            if fields[name] is None:
+                del fields[name]
+        return fields
+
+    async def score_batch_request(
+        request: Request,
+        source: str,
+        columnar: bool,
+        options: tuple[Any, ...],
+        rule_set_version: str | None,
+    ) -> RawJSONResponse:
+        # The body is parsed, scored and encoded in one executor task. Small
+        # bodies are handled right away instead of queueing behind bulk batches.
+        # options are score_batch_body's arguments after columnar.
+        check_compact(*options)
+        body = await request.body()
+        ruleset = resolve_loaded(rule_set_version).ruleset
+        scored = await score_body(body, score_batch_body, ruleset, columnar, *options)
+        metrics.observe_batch(source, scored.size)
+        metrics.record_counts(scored.counts)
+        return RawJSONResponse(scored.body)
+
+    def check_compact(
+        include_features: bool, pretty_scores: bool, explain: bool, top_k: int, probabilities: bool, compact: bool
+    ) -> None:
+        if compact and (include_features or explain or top_k or probabilities):
+            raise HTTPException(
+                status_code=400,
+                detail="compact cannot be combined with include_features, explain, top_k or probabilities",
+            )
+
+    async def score_body(body: bytes, function: Callable[..., Any], ruleset: RuleSet, *args: Any) -> Any:
+        # Runs function(body, ruleset, *args) and maps its errors to responses.
+        # Only near-single payloads (well under a millisecond) are scored on the
+        # event loop; small batches go to the server's thread pool, so they
+        # neither block the loop nor queue behind bulk batches on the executor.
+        try:
+            if len(body) <= settings.scoring_loop_max_bytes:
+                return function(body, ruleset, *args)
+            if len(body) <= settings.scoring_inline_max_bytes:
+                return await run_in_threadpool(function, body, ruleset, *args)
+            return await scoring.run(len(body), function, body, scoring.ruleset_arg(ruleset), *args)
+        except InvalidBatch as exc:
+            if exc.status_code == 422:
+                raise RequestValidationError(exc.detail) from None
+            raise HTTPException(status_code=exc.status_code, detail=exc.detail) from None
+        except ExecutorSaturated as exc:
+            raise HTTPException(
+                status_code=exc.status_code,
+                detail="Scoring capacity exhausted, retry later",
+                headers={"Retry-After": str(exc.retry_after)},
+            ) from None
+
+    def resolve_job(job_id: str) -> Job:
+        try:
+            return jobs.store.get(job_id)
+        except UnknownJob:
+            raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'") from None
 
     @app.get("/health", response_model=HealthResponse)
-    def health() -> HealthResponse:
+    async def health() -> HealthResponse:
         return HealthResponse()
 
+    @app.get("/ready", response_model=ReadyResponse, responses={503: {"model": ReadyResponse}})
+    async def ready() -> JSONResponse:
+        # Readiness, unlike /health: rules loaded and the scoring paths warmed up.
+        response = ReadyResponse(status=startup.status, stages=startup.stages, error=startup.error)
+        return JSONResponse(response.model_dump(), status_code=200 if startup.ready else 503)
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def metrics_endpoint() -> PlainTextResponse:
+        if not settings.metrics_enabled:
+            raise HTTPException(status_code=404, detail="Metrics are disabled")
+        return PlainTextResponse(metrics.render(collectors), media_type=METRICS_CONTENT_TYPE)
+
     @app.get("/meta", response_model=MetaResponse)
-    def meta() -> MetaResponse:
+    def meta(rule_set_version: Optional[str] = Query(default=None)) -> MetaResponse:
+        loaded = resolve_loaded(rule_set_version)
+        ruleset = loaded.ruleset
         return MetaResponse(
             segments=ruleset.segments,
             thresholds=ruleset.thresholds,
             feature_count=len(ruleset.features),
             rule_set_version=ruleset.rule_set_version,
+            loaded_at=loaded.loaded_at,
+            available_versions=registry.versions,
+            cache=CacheStats(**cache.stats()),
         )
 
-    @app.post("/segment", response_model=SegmentResponse)
-    def segment(
-        payload: Any = Body(...),
+    @app.post("/rules/reload", response_model=ReloadResponse)
+    def reload_rules(
+        force: bool = Query(default=False),
+        x_admin_token: Optional[str] = Header(default=None),
+    ) -> ReloadResponse:
+        require_admin(x_admin_token)
+        if not registry.can_reload:
+            raise HTTPException(status_code=409, detail="Rules were provided directly and cannot be reloaded")
+        try:
+            reloaded = registry.reload(force=force)
+        except RulesLoaderError as exc:
+            raise HTTPException(status_code=422, detail=f"Failed to reload rules: {exc}") from exc
+        loaded = registry.current
+        return ReloadResponse(
+            reloaded=reloaded,
+            rule_set_version=loaded.ruleset.rule_set_version,
+            loaded_at=loaded.loaded_at,
+        )
+
+    @app.get(
+        "/debug/profile",
+        response_class=PlainTextResponse,
+        responses={200: {"content": {"application/octet-stream": {}}}},
+    )
+    async def debug_profile(
+        seconds: float = Query(default=10.0, gt=0),
+        interval_ms: float = Query(default=5.0, ge=1, le=1000),
+        format: Literal["collapsed", "pstats"] = Query(default="collapsed"),
+        idle: bool = Query(default=False),
+        x_admin_token: Optional[str] = Header(default=None),
+    ) -> Response:
+        # Samples this worker's threads for a bounded window; nothing runs
+        # outside a window. Process-pool scoring workers are not sampled.
+        if not settings.profiler_enabled:
+            raise HTTPException(status_code=404, detail="Profiler is disabled")
+        require_admin(x_admin_token)
+        if seconds > settings.profiler_max_seconds:
+            raise HTTPException(
+                status_code=400, detail=f"seconds must not exceed {settings.profiler_max_seconds:g}"
+            )
+        if profiling.locked():
+            raise HTTPException(status_code=409, detail="A profile is already running")
+        async with profiling:
+            profiler = SamplingProfiler(interval_ms / 1000, include_idle=idle)
+            profiler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                samples = profiler.stop()
+        if format == "pstats":
+            return Response(
+                pstats_dump(samples, profiler.interval),
+                media_type="application/octet-stream",
+                headers={"Content-Disposition": 'attachment; filename="profile.pstats"'},
+            )
+        return PlainTextResponse(collapsed_stacks(samples))
+
+    @app.post(
+        "/segment",
+        response_model=SegmentResponse,
+        openapi_extra={
+            "requestBody": {"required": True, "content": {"application/json": {"schema": {"type": "object"}}}}
+        },
+    )
+    async def segment(
+        request: Request,
         include_features: bool = Query(default=False),
         pretty_scores: bool = Query(default=False),
-    ) -> SegmentResponse:
-        if not isinstance(payload, dict):
-            raise HTTPException(status_code=400, detail="Request body must be a JSON object")
-        result = score_member(
+        explain: bool = Query(default=False),
+        top_k: Optional[int] = Query(default=None, ge=1),
+        probabilities: bool = Query(default=False),
+        rule_set_version: Optional[str] = Query(default=None),
+    ) -> RawJSONResponse:
+        ruleset = resolve_loaded(rule_set_version).ruleset
+        try:
+            # Only the fields the rule set scores are parsed into Python objects.
+            payload = member_parser(ruleset).member(await request.body())
+        except ValidationError as exc:
+            errors = exc.errors(include_url=False)
+            if errors[0]["type"] == "json_invalid":
+                raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in errors]) from None
+            raise HTTPException(status_code=400, detail="Request body must be a JSON object") from None
+        result = cache.score(
             payload,
             ruleset,
             include_features=include_features,
             pretty_scores=pretty_scores,
+            explain=explain,
+            top_k=top_k or 0,
+            probabilities=probabilities,
         )
-        return SegmentResponse(
-            **result.__dict__,
-            rule_set_version=ruleset.rule_set_version,
+        metrics.record_results((result,))
+        with metrics.timer("serialize"):
+            return RawJSONResponse(encode_segment_result(result, ruleset.rule_set_version))
+
+    @app.post("/segment/compare", response_model=CompareResponse, response_model_exclude_unset=True)
+    def segment_compare(
+        payload: Any = Body(...),
+        versions: Optional[list[str]] = Query(default=None),
+        pretty_scores: bool = Query(default=False),
+    ) -> CompareResponse:
+        if not isinstance(payload, dict):
+            raise HTTPException(status_code=400, detail="Request body must be a JSON object")
+        rulesets = [resolve_loaded(version).ruleset for version in versions or registry.versions]
+        results = {
+            ruleset.rule_set_version: SegmentResponse(
+                **result_fields(result), rule_set_version=ruleset.rule_set_version
+            )
+            for ruleset, result in zip(rulesets, cache.score_rulesets(payload, rulesets, pretty_scores))
+        }
+        outcomes = {(result.segment, result.type) for result in results.values()}
+        return CompareResponse(results=results, changed=len(outcomes) > 1)
+
+    @app.post("/segment/batch", response_model=BatchResponse, openapi_extra=json_request_body(BatchRequest))
+    async def segment_batch(
+        request: Request,
+        include_features: bool = Query(default=False),
+        pretty_scores: bool = Query(default=False),
+        explain: bool = Query(default=False),
+        top_k: Optional[int] = Query(default=None, ge=1),
+        probabilities: bool = Query(default=False),
+        compact: bool = Query(default=False),
+        rule_set_version: Optional[str] = Query(default=None),
+    ) -> RawJSONResponse:
+        # The results are encoded directly instead of being validated into
+        # response models; response_model above still documents the schema.
+        return await score_batch_request(
+            request,
+            "segment_batch",
+            False,
+            (include_features, pretty_scores, explain, top_k or 0, probabilities, compact),
+            rule_set_version,
         )
 
-    @app.post("/segment/batch", response_model=BatchResponse)
-    def segment_batch(
-        payload: BatchRequest,
+    @app.post(
+        "/segment/batch/columnar",
+        response_model=BatchResponse,
+        openapi_extra=json_request_body(ColumnarBatchRequest),
+    )
+    async def segment_batch_columnar(
+        request: Request,
         include_features: bool = Query(default=False),
         pretty_scores: bool = Query(default=False),
-    ) -> BatchResponse:
-        results = []
+        explain: bool = Query(default=False),
+        top_k: Optional[int] = Query(default=None, ge=1),
+        probabilities: bool = Query(default=False),
+        compact: bool = Query(default=False),
+        rule_set_version: Optional[str] = Query(default=None),
+    ) -> RawJSONResponse:
+        return await score_batch_request(
+            request,
+            "segment_batch_columnar",
+            True,
+            (include_features, pretty_scores, explain, top_k or 0, probabilities, compact),
+            rule_set_version,
+        )
+
+    @app.post(
+        "/segment/aggregate",
+        response_model=AggregateResponse,
+        openapi_extra={
+            "requestBody": {
+                "required": True,
+                "content": {
+                    "application/json": {"schema": BatchRequest.model_json_schema()},
+                    NDJSON_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}},
+                },
+            }
+        },
+    )
+    async def segment_aggregate(
+        request: Request,
+        group_by: list[str] = Query(default=[]),
+        score_bin_width: float = Query(default=50.0, gt=0),
+        difference_bin_width: float = Query(default=0.25, gt=0),
+        rule_set_version: Optional[str] = Query(default=None),
+    ) -> AggregateResponse:
+        ruleset = resolve_loaded(rule_set_version).ruleset
+        aggregator = Aggregator(
+            ruleset, group_by, score_bin_width, difference_bin_width, settings.aggregate_max_groups
+        )
+        if request.headers.get("content-type", "").startswith(NDJSON_MEDIA_TYPE):
+            # Scored chunk by chunk as the body arrives; invalid lines are only counted.
+            async for lines in iter_ndjson_chunks(request.stream(), settings.ndjson_max_line_bytes):
+                members, outcomes = parse_ndjson_lines(lines, ruleset, aggregator.group_by)
+                aggregator.invalid += len(outcomes) - len(members)
+                await run_in_threadpool(aggregator.add_members, members, ruleset)
+        else:
+            aggregator = await score_body(await request.body(), aggregate_batch_body, ruleset, aggregator)
+        metrics.observe_batch("segment_aggregate", aggregator.total)
+        metrics.record_counts(aggregator.counts())
+        return AggregateResponse.model_validate(aggregator.summary())
+
+    @app.post("/segment/delta", response_model=DeltaResponse, response_model_exclude_unset=True)
+    def segment_delta_endpoint(
+        payload: BatchRequest,
+        id_field: str = Query(default="Id"),
+        pretty_scores: bool = Query(default=False),
+        rule_set_version: Optional[str] = Query(default=None),
+    ) -> DeltaResponse:
         for item in payload.items:
             if not isinstance(item, dict):
                 raise HTTPException(status_code=400, detail="Each item must be a JSON object")
-            result = score_member(
-                item,
-                ruleset,
-                include_features=include_features,
-                pretty_scores=pretty_scores,
+        nonlocal delta_keys
+        ruleset = resolve_loaded(rule_set_version).ruleset
+        # After a reload, rows of rule sets that are no longer loaded are dropped.
+        keys = frozenset(rule_set_key(registry.get(version).ruleset) for version in registry.versions)
+        if keys != delta_keys:
+            fingerprints.prune(keys)
+            delta_keys = keys
+        metrics.observe_batch("segment_delta", len(payload.items))
+        try:
+            changed, unchanged = segment_delta(
+                payload.items, ruleset, fingerprints, id_field, pretty_scores=pretty_scores
             )
-            results.append(
-                SegmentResponse(
-                    **result.__dict__,
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+        metrics.record_results(delta.result for delta in changed)
+        return DeltaResponse(
+            results=[
+                DeltaItemResponse(
+                    **result_fields(delta.result),
+                    id=delta.member_id,
+                    previous_segment=delta.previous_segment,
+                    previous_type=delta.previous_type,
                     rule_set_version=ruleset.rule_set_version,
                 )
-            )
-        return BatchResponse(results=results, rule_set_version=ruleset.rule_set_version)
+                for delta in changed
+            ],
+            unchanged=unchanged,
+            rule_set_version=ruleset.rule_set_version,
+        )
+
+    @app.post(
+        "/segment/stream",
+        response_class=NDJSONStreamingResponse,
+        responses={200: {"content": {NDJSON_MEDIA_TYPE: {}}}},
+        openapi_extra={
+            "requestBody": {
+                "required": True,
+                "content": {NDJSON_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}}},
+            }
+        },
+    )
+    async def segment_stream(
+        request: Request,
+        include_features: bool = Query(default=False),
+        pretty_scores: bool = Query(default=False),
+        explain: bool = Query(default=False),
+        top_k: Optional[int] = Query(default=None, ge=1),
+        probabilities: bool = Query(default=False),
+        compact: bool = Query(default=False),
+        rule_set_version: Optional[str] = Query(default=None),
+    ) -> NDJSONStreamingResponse:
+        check_compact(include_features, pretty_scores, explain, top_k or 0, probabilities, compact)
+        ruleset = resolve_loaded(rule_set_version).ruleset
+
+        async def results() -> AsyncIterator[bytes]:
+            if compact:
+                yield compact_stream_header(ruleset)
+            async for lines in iter_ndjson_chunks(request.stream(), settings.ndjson_max_line_bytes):
+                yield await run_in_threadpool(
+                    score_ndjson_lines,
+                    lines,
+                    ruleset,
+                    include_features=include_features,
+                    pretty_scores=pretty_scores,
+                    explain=explain,
+                    top_k=top_k or 0,
+                    probabilities=probabilities,
+                    compact=compact,
+                )
+
+        return NDJSONStreamingResponse(results())
+
+    @app.post(
+        "/jobs/segment",
+        status_code=202,
+        response_model=JobResponse,
+        openapi_extra={
+            "requestBody": {
+                "required": True,
+                "content": {
+                    "application/json": {"schema": {"$ref": "#/components/schemas/BatchRequest"}},
+                    NDJSON_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}},
+                },
+            }
+        },
+    )
+    async def submit_job(
+        request: Request,
+        include_features: bool = Query(default=False),
+        pretty_scores: bool = Query(default=False),
+        rule_set_version: Optional[str] = Query(default=None),
+    ) -> JobResponse:
+        ruleset = resolve_loaded(rule_set_version).ruleset
+        job_id = jobs.new_job_id()
+        input_path = jobs.store.input_path(job_id)
+        if request.headers.get("content-type", "").startswith(NDJSON_MEDIA_TYPE):
+            # Uploads are spooled to disk unparsed; invalid lines are reported
+            # inline in the results, as with /segment/stream.
+            await write_upload(request.stream(), input_path)
+        else:
+            # Spooled projected onto the scored fields; the job keeps this rule set version.
+            try:
+                items = member_parser(ruleset).items(await request.body())
+            except ValidationError as exc:
+                raise RequestValidationError(exc.errors(include_url=False)) from exc
+            await run_in_threadpool(write_items, items, input_path)
+        job = await run_in_threadpool(
+            jobs.submit, job_id, ruleset.rule_set_version, include_features, pretty_scores
+        )
+        return job_response(job)
+
+    @app.get("/jobs/{job_id}", response_model=JobResponse)
+    def job_status(job_id: str) -> JobResponse:
+        return job_response(resolve_job(job_id))
+
+    @app.get(
+        "/jobs/{job_id}/results",
+        response_class=FileResponse,
+        responses={200: {"content": {NDJSON_MEDIA_TYPE: {}}}},
+    )
+    def job_results(job_id: str) -> FileResponse:
+        job = resolve_job(job_id)
+        if job.status != COMPLETED:
+            raise HTTPException(status_code=409, detail=f"Job '{job_id}' is {job.status}")
+        return FileResponse(jobs.store.results_path(job_id), media_type=NDJSON_MEDIA_TYPE)
 
     return app
 
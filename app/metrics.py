@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Iterable, Iterator, NamedTuple
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelKey = tuple[tuple[str, str], ...]
+
+_DISABLED = nullcontext()
+
+
+def _label_key(labels: dict[str, Any]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key: LabelKey, extra: tuple[str, str] | None = None) -> str:
+    pairs = list(key)
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self._values: dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(key)} {_format_number(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Iterable[float]) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._series: dict[LabelKey, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # One slot per bucket plus +Inf, followed by sum and count.
+                series = self._series[key] = [0.0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series_items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in series_items:
+            cumulative = 0.0
+            for bound, count in zip((*self.buckets, float("inf")), series):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(key, ('le', _format_number(float(bound))))} {int(cumulative)}"
+            yield f"{self.name}_sum{_format_labels(key)} {_format_number(series[-2])}"
+            yield f"{self.name}_count{_format_labels(key)} {int(series[-1])}"
+
+
+class Collector(NamedTuple):
+    # A value owned elsewhere (e.g. an app's score cache), read at scrape time.
+    name: str
+    documentation: str
+    metric_type: str
+    collect: Callable[[], dict[LabelKey, float]]
+
+
+class _StageTimer:
+    __slots__ = ("_histogram", "_stage", "_started")
+
+    def __init__(self, histogram: Histogram, stage: str) -> None:
+        self._histogram = histogram
+        self._stage = stage
+        self._started = 0.0
+
+    def __enter__(self) -> None:
+        self._started = time.perf_counter()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._histogram.observe(time.perf_counter() - self._started, stage=self._stage)
+
+
+class Metrics:
+    # Process-wide metrics. Every recording method returns immediately while
+    # disabled, and timer() hands out a shared no-op context manager, so the
+    # instrumented code paths cost one attribute check when metrics are off.
+    # Values owned by an app are passed to render() as Collectors, so that no
+    # app object is referenced from here.
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self) -> None:
+        self.request_duration = Histogram(
+            "segmenter_request_duration_seconds", "HTTP request latency by route", LATENCY_BUCKETS
+        )
+        self.batch_size = Histogram("segmenter_batch_size", "Members per scoring request", BATCH_SIZE_BUCKETS)
+        self.stage_duration = Histogram(
+            "segmenter_stage_duration_seconds", "Time spent per scoring stage", LATENCY_BUCKETS
+        )
+        self.items_scored = Counter("segmenter_items_scored_total", "Scored members by segment and type")
+        self.reloads = Counter("segmenter_rules_reloads_total", "Rule set reload attempts by outcome")
+
+    def configure(self, enabled: bool) -> None:
+        self.enabled = enabled
+
+    def timer(self, stage: str) -> ContextManager[None]:
+        if not self.enabled:
+            return _DISABLED
+        return _StageTimer(self.stage_duration, stage)
+
+    def observe_request(self, route: str, method: str, status: int, seconds: float) -> None:
+        if self.enabled:
+            self.request_duration.observe(seconds, route=route, method=method, status=status)
+
+    def observe_batch(self, endpoint: str, size: int) -> None:
+        if self.enabled:
+            self.batch_size.observe(size, endpoint=endpoint)
+
+    def record_results(self, results: Iterable[Any]) -> None:
+        if not self.enabled:
+            return
+        counts: dict[tuple[str, str], int] = {}
+        for result in results:
+            key = (result.segment, result.type)
+            counts[key] = counts.get(key, 0) + 1
+        self.record_counts(counts)
+
+    def record_counts(self, counts: dict[tuple[str, str], int]) -> None:
+        # Members per (segment, type), e.g. tallied by a scoring worker process.
+        if not self.enabled:
+            return
+        for (segment, segment_type), count in counts.items():
+            self.items_scored.inc(count, segment=segment, type=segment_type)
+
+    def record_reload(self, outcome: str) -> None:
+        if self.enabled:
+            self.reloads.inc(outcome=outcome)
+
+    def render(self, collectors: Iterable[Collector] = ()) -> str:
+        lines: list[str] = []
+        for metric in (self.request_duration, self.batch_size, self.stage_duration, self.items_scored, self.reloads):
+            lines.extend(metric.collect())
+        for collector in sorted(collectors, key=lambda collector: collector.name):
+            lines.append(f"# HELP {collector.name} {collector.documentation}")
+            lines.append(f"# TYPE {collector.name} {collector.metric_type}")
+            for key, value in sorted(collector.collect().items()):
+                lines.append(f"{collector.name}{_format_labels(key)} {_format_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp, metrics: Metrics, enabled: bool = True) -> None:
+        self.app = app
+        self.metrics = metrics
+        self.enabled = enabled
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not (self.enabled and self.metrics.enabled):
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            self.metrics.observe_request(path, scope["method"], status, time.perf_counter() - started)
+
+
+metrics = Metrics()
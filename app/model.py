@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from datetime import datetime
 from typing import Any, Optional
 
 from pydantic import BaseModel, Field
@@ -9,11 +10,52 @@ class HealthResponse(BaseModel):
     status: str = "ok"
 
 
+class ReadyResponse(BaseModel):
+    status: str
+    # Seconds per startup stage.
+    stages: dict[str, float]
+    error: Optional[str] = None
+
+
+class CacheStats(BaseModel):
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+
+
 class MetaResponse(BaseModel):
     segments: list[str]
     thresholds: dict[str, float]
     feature_count: int
     rule_set_version: str
+    loaded_at: datetime
+    available_versions: list[str]
+    cache: CacheStats
+
+
+class ReloadResponse(BaseModel):
+    reloaded: bool
+    rule_set_version: str
+    loaded_at: datetime
+
+
+class FeatureContribution(BaseModel):
+    feature_id: str
+    contributions: dict[str, float]
+    margin: float
+
+
+class Explanation(BaseModel):
+    intercept_margin: float
+    features: list[FeatureContribution]
+
+
+class RankedSegment(BaseModel):
+    segment: str
+    score: float
+    # Distance to the best score.
+    margin: float
 
 
 class SegmentResponse(BaseModel):
@@ -25,6 +67,10 @@ class SegmentResponse(BaseModel):
     second_best_score: Optional[float]
     scores: dict[str, float]
     matched_features: Optional[list[dict[str, Any]]] = None
+    # Only rendered when requested (explain, top_k, probabilities).
+    explanation: Optional[Explanation] = None
+    ranking: Optional[list[RankedSegment]] = None
+    probabilities: Optional[dict[str, float]] = None
     rule_set_version: str
 
 
@@ -32,6 +78,60 @@ class BatchRequest(BaseModel):
     items: list[dict[str, Any]] = Field(default_factory=list)
 
 
+class DeltaItemResponse(SegmentResponse):
+    id: str
+    previous_segment: Optional[str] = None
+    previous_type: Optional[str] = None
+
+
+class DeltaResponse(BaseModel):
+    results: list[DeltaItemResponse]
+    unchanged: int
+    rule_set_version: str
+
+
+class ColumnarBatchRequest(BaseModel):
+    columns: dict[str, list[Any]] = Field(default_factory=dict)
+
+
 class BatchResponse(BaseModel):
     results: list[SegmentResponse]
     rule_set_version: str
+
+
+class CompareResponse(BaseModel):
+    results: dict[str, SegmentResponse]
+    changed: bool
+
+
+class HistogramBin(BaseModel):
+    start: float
+    count: int
+
+
+class Histogram(BaseModel):
+    bin_width: float
+    bins: list[HistogramBin]
+
+
+class AggregateResponse(BaseModel):
+    total: int
+    invalid: int
+    # segment -> type -> members; groups: field -> value -> segment -> type -> members.
+    segments: dict[str, dict[str, int]]
+    groups: dict[str, dict[str, dict[str, dict[str, int]]]]
+    histograms: dict[str, Histogram]
+    rule_set_version: str
+
+
+class JobResponse(BaseModel):
+    id: str
+    status: str
+    rule_set_version: str
+    total: int
+    processed: int
+    items_per_second: Optional[float] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import marshal
+import os
+import sys
+import threading
+from collections import Counter
+from typing import Collection
+
+# (filename, first line, function), as in pstats.
+FrameKey = tuple[str, int, str]
+Stack = tuple[FrameKey, ...]
+
+DEFAULT_INTERVAL = 0.005
+
+# Leaf frames of threads that are blocked rather than working: the event
+# loop's select, idle thread pool workers, lock and queue waits.
+_IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+def _is_idle(frame: FrameKey) -> bool:
+    return (os.path.basename(frame[0]), frame[2]) in _IDLE_FRAMES
+
+
+class SamplingProfiler:
+    # Samples the Python stacks of other threads every `interval` seconds from
+    # a background thread (sys._current_frames), for a bounded window. Nothing
+    # is hooked into the profiled code, so there is no cost outside a window
+    # and little within one. thread_ids restricts sampling to those threads.
+
+    def __init__(
+        self,
+        interval: float = DEFAULT_INTERVAL,
+        thread_ids: Collection[int] | None = None,
+        include_idle: bool = False,
+    ) -> None:
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.include_idle = include_idle
+        self.samples: Counter[Stack] = Counter()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter[Stack]:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.samples
+
+    def __enter__(self) -> SamplingProfiler:
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.stop()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                stack: list[FrameKey] = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                if not stack or (not self.include_idle and _is_idle(stack[0])):
+                    continue
+                stack.reverse()
+                self.samples[tuple(stack)] += 1
+
+
+def _label(frame: FrameKey) -> str:
+    filename, line, function = frame
+    # Short enough for flame graphs; ';' separates frames in collapsed stacks.
+    path = "/".join(filename.replace("\\", "/").split("/")[-2:])
+    return f"{function} ({path}:{line})".replace(";", ",")
+
+
+def collapsed_stacks(samples: Counter[Stack]) -> str:
+    # One "root;...;leaf count" line per stack, as read by flamegraph.pl,
+    # speedscope and similar tools.
+    lines = [f"{';'.join(map(_label, stack))} {count}" for stack, count in samples.most_common()]
+    return "".join(f"{line}\n" for line in lines)
+
+
+def pstats_dump(samples: Counter[Stack], interval: float) -> bytes:
+    # The marshal format of cProfile/pstats (pstats.Stats, snakeviz), with
+    # samples standing in for calls and samples * interval for times.
+    # Recursive frames count once per sample, like cProfile's cumulative time.
+    total: Counter[FrameKey] = Counter()
+    own: Counter[FrameKey] = Counter()
+    edges: Counter[tuple[FrameKey, FrameKey]] = Counter()
+    own_edges: Counter[tuple[FrameKey, FrameKey]] = Counter()
+    for stack, count in samples.items():
+        own[stack[-1]] += count
+        if len(stack) > 1:
+            own_edges[stack[-2], stack[-1]] += count
+        for frame in set(stack):
+            total[frame] += count
+        for edge in set(zip(stack, stack[1:])):
+            edges[edge] += count
+    callers: dict[FrameKey, dict[FrameKey, tuple[int, int, float, float]]] = {}
+    for (caller, callee), count in edges.items():
+        callers.setdefault(callee, {})[caller] = (count, count, own_edges[caller, callee] * interval, count * interval)
+    return marshal.dumps(
+        {
+            frame: (count, count, own[frame] * interval, count * interval, callers.get(frame, {}))
+            for frame, count in total.items()
+        }
+    )
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Sequence
+
+from pydantic import TypeAdapter
+from typing_extensions import TypedDict
+
+from app.rules_loader import RuleSet
+
+# Parsers for the most recently used rule sets, by id() of the RuleSet and
+# the extra fields kept.
+_MAX_CACHED_PARSERS = 8
+_parsers: OrderedDict[tuple[int, tuple[str, ...]], tuple[RuleSet, MemberParser]] = OrderedDict()
+_parsers_lock = threading.Lock()
+
+
+class MemberParser:
+    # Parses request bodies straight from JSON bytes into dicts that hold only
+    # the fields the rule set scores. Other keys are skipped by the parser and
+    # never become Python objects, so CRM records with hundreds of unrelated
+    # fields cost little more than the fields that matter. Scoring only reads
+    # the compiled fields, so results are the same as for the full members.
+
+    def __init__(self, ruleset: RuleSet, extra_fields: tuple[str, ...] = ()) -> None:
+        fields = dict.fromkeys([*(field.input_field for field in ruleset.compiled.fields), *extra_fields])
+        member = TypedDict("ProjectedMember", {field: Any for field in fields}, total=False)  # type: ignore[misc]
+        self._member: TypeAdapter[dict[str, Any]] = TypeAdapter(member)
+        self._batch: TypeAdapter[dict[str, Any]] = TypeAdapter(
+            TypedDict("ProjectedBatch", {"items": list[member]}, total=False)  # type: ignore[misc,valid-type]
+        )
+
+    def member(self, body: bytes | str) -> dict[str, Any]:
+        return self._member.validate_json(body)
+
+    def items(self, body: bytes | str) -> list[dict[str, Any]]:
+        # A BatchRequest body; raises ValidationError with the same locations.
+        return self._batch.validate_json(body).get("items", [])
+
+
+def member_parser(ruleset: RuleSet, extra_fields: Sequence[str] = ()) -> MemberParser:
+    # extra_fields are kept as well, e.g. the group_by fields of an aggregation.
+    key = (id(ruleset), tuple(extra_fields))
+    with _parsers_lock:
+        entry = _parsers.get(key)
+        if entry is not None and entry[0] is ruleset:
+            _parsers.move_to_end(key)
+            return entry[1]
+    parser = MemberParser(ruleset, key[1])
+    with _parsers_lock:
+        _parsers[key] = (ruleset, parser)
+        if len(_parsers) > _MAX_CACHED_PARSERS:
+            _parsers.popitem(last=False)
+    return parser
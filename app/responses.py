@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import json
+import math
+from json.encoder import encode_basestring
+from typing import Any, Iterable, Iterator
+
+from starlette.responses import Response
+
+from app.batch import SEGMENT_TYPES, BatchScores
+from app.segmenter import SegmentResult
+
+# Matches the encoding of FastAPI's JSONResponse so the fast path is
+# byte-compatible with responses rendered through the pydantic models.
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode
+
+# Positions within each row of the compact encoding (compact=true).
+COMPACT_FIELDS = ("segment", "second_segment", "type", "difference", "best_score", "second_best_score", "scores")
+
+
+class RawJSONResponse(Response):
+    # Carries a body that was already encoded by the functions below.
+    media_type = "application/json"
+
+
+def _number(value: float) -> str:
+    # The response models declare these fields as float, so integers are
+    # rendered as floats; pydantic writes non-finite floats as null.
+    value = float(value)
+    return float.__repr__(value) if math.isfinite(value) else "null"
+
+
+class _ResultEncoder:
+    def __init__(self, rule_set_version: str) -> None:
+        self._strings: dict[str, str] = {}
+        self._features: dict[str, str] = {}
+        self._version = encode_basestring(rule_set_version)
+
+    def _string(self, value: str) -> str:
+        encoded = self._strings.get(value)
+        if encoded is None:
+            encoded = self._strings[value] = encode_basestring(value)
+        return encoded
+
+    def _feature(self, feature: dict[str, Any]) -> str:
+        # A feature's coefficients are fixed within a rule set version, so
+        # everything but the margin is encoded once per encoder.
+        feature_id = feature["feature_id"]
+        prefix = self._features.get(feature_id)
+        if prefix is None:
+            string = self._string
+            contributions = ",".join(
+                f"{string(segment)}:{_number(value)}" for segment, value in feature["contributions"].items()
+            )
+            prefix = self._features[feature_id] = (
+                f'{{"feature_id":{string(feature_id)},"contributions":{{{contributions}}},"margin":'
+            )
+        return f'{prefix}{_number(feature["margin"])}}}'
+
+    def _explanation(self, explanation: dict[str, Any]) -> str:
+        features = ",".join(map(self._feature, explanation["features"]))
+        return f'{{"intercept_margin":{_number(explanation["intercept_margin"])},"features":[{features}]}}'
+
+    def encode(self, result: SegmentResult) -> str:
+        string = self._string
+        second_segment = "null" if result.second_segment is None else string(result.second_segment)
+        second_best = "null" if result.second_best_score is None else _number(result.second_best_score)
+        scores = ",".join(f"{string(segment)}:{_number(score)}" for segment, score in result.scores.items())
+        features = "null" if result.matched_features is None else _dumps(result.matched_features)
+        # The optional parts are only present when requested, so the default
+        # output stays unchanged.
+        extra = ""
+        if result.explanation is not None:
+            extra += f',"explanation":{self._explanation(result.explanation)}'
+        if result.ranking is not None:
+            ranking = ",".join(
+                f'{{"segment":{string(entry["segment"])},"score":{_number(entry["score"])},'
+                f'"margin":{_number(entry["margin"])}}}'
+                for entry in result.ranking
+            )
+            extra += f',"ranking":[{ranking}]'
+        if result.probabilities is not None:
+            probabilities = ",".join(
+                f"{string(segment)}:{_number(value)}" for segment, value in result.probabilities.items()
+            )
+            extra += f',"probabilities":{{{probabilities}}}'
+        return (
+            f'{{"segment":{string(result.segment)},"second_segment":{second_segment},'
+            f'"type":{string(result.type)},"difference":{_number(result.difference)},'
+            f'"best_score":{_number(result.best_score)},"second_best_score":{second_best},'
+            f'"scores":{{{scores}}},"matched_features":{features}{extra},"rule_set_version":{self._version}}}'
+        )
+
+
+def encode_segment_result(result: SegmentResult, rule_set_version: str) -> bytes:
+    return _ResultEncoder(rule_set_version).encode(result).encode("utf-8")
+
+
+def encode_segment_results(results: Iterable[SegmentResult], rule_set_version: str) -> list[str]:
+    encoder = _ResultEncoder(rule_set_version)
+    return [encoder.encode(result) for result in results]
+
+
+def encode_batch_response(results: Iterable[SegmentResult], rule_set_version: str) -> bytes:
+    encoded = ",".join(encode_segment_results(results, rule_set_version))
+    return f'{{"results":[{encoded}],"rule_set_version":{encode_basestring(rule_set_version)}}}'.encode("utf-8")
+
+
+def _score_rows(
+    batch: BatchScores, pretty_scores: bool, chunk_size: int
+) -> Iterator[tuple[list[float], int, int | None, int, float, float, float | None]]:
+    # (scores, best, second, type code, best score, difference, second best
+    # score) per row, as Python numbers; converted one chunk at a time.
+    for start in range(0, len(batch), chunk_size):
+        chunk = batch[start : start + chunk_size]
+        seconds = chunk.second.tolist() if chunk.second is not None else [None] * len(chunk)
+        for row, best, second, code in zip(chunk.scores.tolist(), chunk.best.tolist(), seconds, chunk.types.tolist()):
+            best_score = row[best]
+            if second is None:
+                difference, second_best = 0.0, None
+            else:
+                difference, second_best = best_score - row[second], row[second]
+            if pretty_scores:
+                row = [round(score, 4) for score in row]
+                best_score = round(best_score, 4)
+                difference = round(difference, 4)
+                second_best = None if second_best is None else round(second_best, 4)
+            yield row, best, second, code, best_score, difference, second_best
+
+
+def encode_batch_scores(
+    batch: BatchScores,
+    rule_set_version: str,
+    pretty_scores: bool = False,
+    chunk_size: int = 10000,
+) -> Iterator[str]:
+    # Encodes compact batch results row by row, producing the same JSON as
+    # encode_segment_results on the materialized results.
+    names = [encode_basestring(segment) for segment in batch.segments]
+    types = [encode_basestring(segment_type) for segment_type in SEGMENT_TYPES]
+    suffix = f',"matched_features":null,"rule_set_version":{encode_basestring(rule_set_version)}}}'
+    for row, best, second, code, best_score, difference, second_best in _score_rows(batch, pretty_scores, chunk_size):
+        second_segment = "null" if second is None else names[second]
+        scores = ",".join(f"{name}:{_number(score)}" for name, score in zip(names, row))
+        yield (
+            f'{{"segment":{names[best]},"second_segment":{second_segment},"type":{types[code]},'
+            f'"difference":{_number(difference)},"best_score":{_number(best_score)},'
+            f'"second_best_score":{"null" if second_best is None else _number(second_best)},'
+            f'"scores":{{{scores}}}{suffix}'
+        )
+
+
+def encode_compact_rows(batch: BatchScores, pretty_scores: bool = False, chunk_size: int = 10000) -> Iterator[str]:
+    # The compact encoding: one array per member in COMPACT_FIELDS order.
+    # segment and second_segment are indices into the segment list that is
+    # sent once per response, and scores follow its order.
+    types = [encode_basestring(segment_type) for segment_type in SEGMENT_TYPES]
+    for row, best, second, code, best_score, difference, second_best in _score_rows(batch, pretty_scores, chunk_size):
+        scores = ",".join(map(_number, row))
+        yield (
+            f'[{best},{"null" if second is None else second},{types[code]},{_number(difference)},'
+            f'{_number(best_score)},{"null" if second_best is None else _number(second_best)},[{scores}]]'
+        )
+
+
+def encode_compact_header(segments: Iterable[str], rule_set_version: str) -> str:
+    names = ",".join(encode_basestring(segment) for segment in segments)
+    fields = ",".join(encode_basestring(field) for field in COMPACT_FIELDS)
+    return f'"segments":[{names}],"fields":[{fields}],"rule_set_version":{encode_basestring(rule_set_version)}'
+
+
+def encode_compact_response(batch: BatchScores, rule_set_version: str, pretty_scores: bool = False) -> bytes:
+    rows = ",".join(encode_compact_rows(batch, pretty_scores))
+    return f'{{{encode_compact_header(batch.segments, rule_set_version)},"results":[{rows}]}}'.encode("utf-8")
+
+
+def encode_batch_scores_response(batch: BatchScores, rule_set_version: str, pretty_scores: bool = False) -> bytes:
+    encoded = ",".join(encode_batch_scores(batch, rule_set_version, pretty_scores))
+    return f'{{"results":[{encoded}],"rule_set_version":{encode_basestring(rule_set_version)}}}'.encode("utf-8")
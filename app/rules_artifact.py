@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import marshal
+import os
+import struct
+from array import array
+from pathlib import Path
+from typing import Any
+
+from app.config import Settings
+from app.rules_loader import (
+    CompiledField,
+    CompiledRules,
+    FeatureRule,
+    NumericBuckets,
+    RuleSet,
+    load_rules,
+)
+from app.utils import sha256_file
+
+logger = logging.getLogger(__name__)
+
+# Layout: magic, format version, SHA-256 of the payload, marshal payload.
+MAGIC = b"SEGRULES"
+FORMAT_VERSION = 2
+_HEADER = struct.Struct(f">{len(MAGIC)}sH32s")
+ARTIFACT_SUFFIX = ".compiled"
+
+
+class StaleArtifact(Exception):
+    pass
+
+
+def artifact_path(settings: Settings) -> Path:
+    if settings.rules_artifact_path is not None:
+        return settings.rules_artifact_path
+    return settings.rules_path.with_suffix(ARTIFACT_SUFFIX)
+
+
+def _source_signature(settings: Settings) -> dict[str, Any]:
+    # Everything load_rules reads; the artifact is only valid for the same inputs.
+    code_list_path = settings.code_list_path
+    return {
+        "rules": sha256_file(settings.rules_path),
+        "code_lists": sha256_file(code_list_path) if code_list_path.exists() else None,
+        "case_insensitive": settings.case_insensitive,
+    }
+
+
+def _payload(ruleset: RuleSet, source: dict[str, Any]) -> dict[str, Any]:
+    compiled = ruleset.compiled
+    coefficients = array("d")
+    for row in compiled.coefficients:
+        coefficients.extend(row)
+    return {
+        "source": source,
+        "rule_set_version": ruleset.rule_set_version,
+        "case_insensitive": ruleset.case_insensitive,
+        "segments": list(ruleset.segments),
+        "segment_order": list(compiled.segments),
+        "intercepts": list(compiled.intercepts),
+        "thresholds": dict(ruleset.thresholds),
+        "features": [(feature.feature_id, feature.input_field, feature.match_value) for feature in ruleset.features],
+        "coefficients": coefficients.tobytes(),
+        "code_mappings": ruleset.code_mappings,
+        "value_aliases": ruleset.value_aliases,
+        "numeric_buckets": {
+            name: (buckets.lower, buckets.upper, buckets.values) for name, buckets in ruleset.numeric_buckets.items()
+        },
+        "fields": [(field.input_field, field.index, field.lookup) for field in compiled.fields],
+    }
+
+
+def write_artifact(settings: Settings, output: Path | None = None) -> Path:
+    ruleset = load_rules(settings)
+    # marshal stores repeated strings (field names, segment names) only once.
+    payload = marshal.dumps(_payload(ruleset, _source_signature(settings)))
+    path = output or artifact_path(settings)
+    temporary = path.with_name(f"{path.name}.tmp")
+    with temporary.open("wb") as handle:
+        handle.write(_HEADER.pack(MAGIC, FORMAT_VERSION, hashlib.sha256(payload).digest()))
+        handle.write(payload)
+    # Replace atomically so workers starting meanwhile never see a partial file.
+    os.replace(temporary, path)
+    return path
+
+
+def _restore(payload: dict[str, Any]) -> RuleSet:
+    segment_order = tuple(payload["segment_order"])
+    width = len(segment_order)
+    flat = array("d")
+    flat.frombytes(payload["coefficients"])
+    coefficients = tuple(tuple(flat[start : start + width]) for start in range(0, len(flat), width))
+    features = [
+        FeatureRule(
+            feature_id=feature_id,
+            input_field=input_field,
+            match_value=match_value,
+            coefficients=dict(zip(segment_order, row)),
+        )
+        for (feature_id, input_field, match_value), row in zip(payload["features"], coefficients)
+    ]
+    code_mappings = payload["code_mappings"]
+    value_aliases = payload["value_aliases"]
+    numeric_buckets = {name: NumericBuckets(*buckets) for name, buckets in payload["numeric_buckets"].items()}
+    compiled = CompiledRules(
+        segments=segment_order,
+        intercepts=tuple(payload["intercepts"]),
+        coefficients=coefficients,
+        fields=tuple(
+            CompiledField(
+                input_field=input_field,
+                index=index,
+                lookup=lookup,
+                buckets=numeric_buckets.get(input_field),
+            )
+            for input_field, index, lookup in payload["fields"]
+        ),
+    )
+    # The indexes are already built, so the RuleSet is assembled without
+    # running __post_init__ (which would compile the rules again).
+    ruleset = object.__new__(RuleSet)
+    values = {
+        "segments": payload["segments"],
+        "intercepts": dict(zip(segment_order, compiled.intercepts)),
+        "thresholds": payload["thresholds"],
+        "features": features,
+        "rule_set_version": payload["rule_set_version"],
+        "case_insensitive": payload["case_insensitive"],
+        "code_mappings": code_mappings,
+        "value_aliases": value_aliases,
+        "numeric_buckets": numeric_buckets,
+        "compiled": compiled,
+    }
+    for name, value in values.items():
+        object.__setattr__(ruleset, name, value)
+    return ruleset
+
+
+def read_artifact(path: Path, settings: Settings) -> RuleSet:
+    data = path.read_bytes()
+    if len(data) < _HEADER.size:
+        raise StaleArtifact("truncated header")
+    magic, version, digest = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise StaleArtifact(f"unsupported format {magic!r} v{version}")
+    payload_bytes = data[_HEADER.size :]
+    if hashlib.sha256(payload_bytes).digest() != digest:
+        raise StaleArtifact("checksum mismatch")
+    try:
+        payload = marshal.loads(payload_bytes)
+    except (EOFError, ValueError, TypeError) as exc:
+        raise StaleArtifact(f"unreadable payload: {exc}") from exc
+    if payload.get("source") != _source_signature(settings):
+        raise StaleArtifact("rules or code lists changed since it was compiled")
+    return _restore(payload)
+
+
+def load_ruleset(settings: Settings) -> RuleSet:
+    # Prefers the compiled artifact and falls back to parsing the JSON rules
+    # when it is missing, stale or unreadable.
+    path = artifact_path(settings)
+    if settings.use_rules_artifact and path.exists():
+        try:
+            return read_artifact(path, settings)
+        except (StaleArtifact, OSError) as exc:
+            logger.warning("Ignoring rules artifact %s: %s", path, exc)
+    return load_rules(settings)
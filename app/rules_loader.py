@@ -1,12 +1,38 @@
 from __future__ import annotations
 
+import hashlib
 import json
-from dataclasses import dataclass
+import math
+from bisect import bisect_right
+from dataclasses import astuple, dataclass, field
+from functools import cached_property
 from pathlib import Path
 from typing import Any
 
 from app.config import RuleSetMetadata, Settings
-from app.utils import sha256_file
+from app.utils import normalize_value, sha256_file
+
+MEMBERSHIP_DURATION_FIELD = "Mitgliedsdauer_Jahre"
+
+# Used when the rules file declares no "value_aliases" / "numeric_buckets".
+DEFAULT_VALUE_ALIASES: dict[str, dict[str, str]] = {
+    "Anrede": {
+        "weiblich": "female",
+    },
+    "Gesetzlicher_Vertreter": {
+        "ja": (
+            "Sind Sie in Ihrem Unternehmen (mit-)verantwortlich für Mitgliedschaften in "
+            "beispielsweise Unternehmens- oder Handelsverbänden, Interessenvertretungen etc.?"
+        ),
+    },
+}
+DEFAULT_NUMERIC_BUCKETS: dict[str, list[dict[str, Any]]] = {
+    MEMBERSHIP_DURATION_FIELD: [
+        {"max": 1, "value": "Mitgliedsdauer bis zu 1 Jahr"},
+        {"min": 2, "max": 4, "value": "Mitgliedsdauer 2 bis 4 Jahre"},
+        {"min": 5, "max": 9, "value": "Mitgliedsdauer 5 bis 9 Jahre"},
+    ],
+}
 
 
 @dataclass(frozen=True)
@@ -17,6 +43,62 @@ class FeatureRule:
     coefficients: dict[str, float]
 
 
+@dataclass(frozen=True)
+class NumericBuckets:
+    # Inclusive [lower, upper] ranges sorted by lower bound; numbers between
+    # ranges fall into no bucket.
+    lower: tuple[float, ...]
+    upper: tuple[float, ...]
+    values: tuple[str, ...]
+
+    def bucket(self, number: float) -> str | None:
+        index = bisect_right(self.lower, number) - 1
+        if index >= 0 and number <= self.upper[index]:
+            return self.values[index]
+        return None
+
+    def bucket_text(self, text: str) -> str | None:
+        number = parse_number(text)
+        return self.bucket(number) if number is not None else None
+
+
+def parse_number(text: str) -> float | None:
+    # Accepts decimal commas ("2,5") like the CRM export does.
+    try:
+        return float(text.replace(",", "."))
+    except ValueError:
+        return None
+
+
+@dataclass(frozen=True)
+class CompiledField:
+    input_field: str
+    index: dict[str, tuple[int, ...]]
+    lookup: dict[str, tuple[int, ...]]
+    buckets: NumericBuckets | None = None
+
+
+@dataclass(frozen=True)
+class CompiledRules:
+    """Scoring plan derived from a RuleSet.
+
+    Features are grouped by input field and indexed by their normalized match
+    value, so a member is scored with one lookup per field instead of one
+    comparison per feature. Feature positions refer to ``RuleSet.features`` and
+    are kept in rule order, which keeps the summation order (and therefore the
+    scores) identical to a sequential scan over all features.
+
+    ``CompiledField.lookup`` resolves every known code, alias and match value
+    of a field in one step. Only values missing from it still go through the
+    field's numeric buckets, if it has any.
+    """
+
+    segments: tuple[str, ...]
+    intercepts: tuple[float, ...]
+    coefficients: tuple[tuple[float, ...], ...]
+    fields: tuple[CompiledField, ...]
+
+
 @dataclass(frozen=True)
 class RuleSet:
     segments: list[str]
@@ -25,8 +107,33 @@ class RuleSet:
     features: list[FeatureRule]
     rule_set_version: str
     case_insensitive: bool
-    code_mappings: dict[str, dict[str, str]]
-    value_aliases: dict[str, dict[str, str]]
+    code_mappings: dict[str, dict[str, str]] = field(default_factory=dict)
+    value_aliases: dict[str, dict[str, str]] = field(default_factory=dict)
+    numeric_buckets: dict[str, NumericBuckets] = field(default_factory=dict)
+    compiled: CompiledRules = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "compiled", compile_rules(self))
+
+    @cached_property
+    def fingerprint(self) -> str:
+        # Hash of everything results depend on, including the code lists,
+        # aliases and buckets folded into the compiled lookups. Unlike
+        # rule_set_version, it changes whenever any of them does.
+        compiled = self.compiled
+        content = [
+            compiled.segments,
+            compiled.intercepts,
+            compiled.coefficients,
+            [
+                [item.input_field, item.index, item.lookup, astuple(item.buckets) if item.buckets else None]
+                for item in compiled.fields
+            ],
+            self.thresholds,
+            self.case_insensitive,
+            [feature.feature_id for feature in self.features],
+        ]
+        return hashlib.sha256(json.dumps(content, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
 
 
 class RulesLoaderError(ValueError):
@@ -100,26 +207,106 @@ def _load_code_mappings(path: Path, case_insensitive: bool) -> dict[str, dict[st
     return normalized
 
 
-def _build_value_aliases(case_insensitive: bool) -> dict[str, dict[str, str]]:
-    aliases = {
-        "Anrede": {
-            "weiblich": "female",
-        },
-        "Gesetzlicher_Vertreter": {
-            "ja": (
-                "Sind Sie in Ihrem Unternehmen (mit-)verantwortlich für Mitgliedschaften in "
-                "beispielsweise Unternehmens- oder Handelsverbänden, Interessenvertretungen etc.?"
-            ),
-        },
-    }
-    if not case_insensitive:
-        return aliases
+def _load_value_aliases(raw: Any, case_insensitive: bool) -> dict[str, dict[str, str]]:
+    aliases = _ensure_mapping(raw, "value_aliases")
     normalized: dict[str, dict[str, str]] = {}
-    for field, mapping in aliases.items():
-        normalized[field] = {key.lower(): value.lower() for key, value in mapping.items()}
+    for field_name, mapping in aliases.items():
+        mapping = _ensure_mapping(mapping, f"value_aliases.{field_name}")
+        normalized[field_name] = {}
+        for alias, value in mapping.items():
+            if not isinstance(value, str):
+                raise RulesLoaderError(f"Alias '{alias}' for '{field_name}' must map to a string")
+            normalized[field_name][normalize_value(alias, case_insensitive)] = normalize_value(value, case_insensitive)
     return normalized
 
 
+def _bound(bucket: dict[str, Any], key: str, default: float, field_name: str) -> float:
+    value = bucket.get(key, default)
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        raise RulesLoaderError(f"Bucket '{key}' for '{field_name}' must be a number")
+    return float(value)
+
+
+def _load_numeric_buckets(raw: Any, case_insensitive: bool) -> dict[str, NumericBuckets]:
+    declared = _ensure_mapping(raw, "numeric_buckets")
+    compiled: dict[str, NumericBuckets] = {}
+    for field_name, buckets in declared.items():
+        ranges: list[tuple[float, float, str]] = []
+        for bucket in _ensure_list(buckets, f"numeric_buckets.{field_name}"):
+            bucket = _ensure_mapping(bucket, f"numeric_buckets.{field_name}")
+            value = bucket.get("value")
+            if not isinstance(value, str):
+                raise RulesLoaderError(f"Each bucket for '{field_name}' needs a string 'value'")
+            lower = _bound(bucket, "min", -math.inf, field_name)
+            upper = _bound(bucket, "max", math.inf, field_name)
+            if lower > upper:
+                raise RulesLoaderError(f"Bucket '{value}' for '{field_name}' has min greater than max")
+            ranges.append((lower, upper, normalize_value(value, case_insensitive) or ""))
+        ranges.sort()
+        for previous, current in zip(ranges, ranges[1:]):
+            if current[0] <= previous[1]:
+                raise RulesLoaderError(f"Buckets '{previous[2]}' and '{current[2]}' for '{field_name}' overlap")
+        compiled[field_name] = NumericBuckets(
+            lower=tuple(lower for lower, _, _ in ranges),
+            upper=tuple(upper for _, upper, _ in ranges),
+            values=tuple(value for _, _, value in ranges),
+        )
+    return compiled
+
+
+def _canonicalize(
+    value: str,
+    code_mapping: dict[str, str],
+    alias_mapping: dict[str, str],
+    buckets: NumericBuckets | None,
+) -> str:
+    # The full chain for one normalized value: code list, then alias, then
+    # numeric bucket. compile_rules runs it once per known value.
+    value = code_mapping.get(value, value)
+    value = alias_mapping.get(value, value)
+    if buckets is not None:
+        bucketed = buckets.bucket_text(value)
+        if bucketed is not None:
+            value = bucketed
+    return value
+
+
+def compile_rules(ruleset: RuleSet) -> CompiledRules:
+    segment_order = tuple(ruleset.intercepts.keys())
+    coefficients: list[tuple[float, ...]] = []
+    field_indexes: dict[str, dict[str, list[int]]] = {}
+    for position, feature in enumerate(ruleset.features):
+        if set(feature.coefficients) - set(segment_order):
+            raise RulesLoaderError(
+                f"Coefficients for '{feature.feature_id}' reference unknown segments"
+            )
+        coefficients.append(tuple(feature.coefficients.get(segment, 0.0) for segment in segment_order))
+        match_value = normalize_value(feature.match_value, ruleset.case_insensitive)
+        field_index = field_indexes.setdefault(feature.input_field, {})
+        field_index.setdefault(match_value, []).append(position)
+
+    fields: list[CompiledField] = []
+    for input_field, positions_by_value in field_indexes.items():
+        index = {value: tuple(positions) for value, positions in positions_by_value.items()}
+        code_mapping = ruleset.code_mappings.get(input_field, {})
+        alias_mapping = ruleset.value_aliases.get(input_field, {})
+        buckets = ruleset.numeric_buckets.get(input_field)
+        # Every value with a known outcome is resolved up front, including the
+        # codes and aliases that resolve to nothing: those must not fall
+        # through to the numeric buckets at lookup time.
+        lookup = {
+            value: index.get(_canonicalize(value, code_mapping, alias_mapping, buckets), ())
+            for value in (*code_mapping, *alias_mapping, *index)
+        }
+        fields.append(CompiledField(input_field=input_field, index=index, lookup=lookup, buckets=buckets))
+    return CompiledRules(
+        segments=segment_order,
+        intercepts=tuple(ruleset.intercepts[segment] for segment in segment_order),
+        coefficients=tuple(coefficients),
+        fields=tuple(fields),
+    )
+
+
 def load_rules(settings: Settings) -> RuleSet:
     path = settings.rules_path
     try:
@@ -142,7 +329,10 @@ def load_rules(settings: Settings) -> RuleSet:
         case_insensitive = settings.case_insensitive
 
     code_mappings = _load_code_mappings(settings.code_list_path, case_insensitive)
-    value_aliases = _build_value_aliases(case_insensitive)
+    value_aliases = _load_value_aliases(payload.get("value_aliases", DEFAULT_VALUE_ALIASES), case_insensitive)
+    numeric_buckets = _load_numeric_buckets(
+        payload.get("numeric_buckets", DEFAULT_NUMERIC_BUCKETS), case_insensitive
+    )
 
     intercepts_raw = _ensure_mapping(payload.get("intercepts"), "intercepts")
     intercept_keys = list(intercepts_raw.keys())
@@ -203,4 +393,5 @@ def load_rules(settings: Settings) -> RuleSet:
         case_insensitive=case_insensitive,
         code_mappings=code_mappings,
         value_aliases=value_aliases,
+        numeric_buckets=numeric_buckets,
     )
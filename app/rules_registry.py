@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+from app.config import Settings
+from app.metrics import metrics
+from app.rules_artifact import load_ruleset
+from app.rules_loader import RuleSet, RulesLoaderError
+from app.utils import sha256_file
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class LoadedRuleSet:
+    ruleset: RuleSet
+    loaded_at: datetime
+    source: Path | None = None
+
+
+@dataclass(frozen=True)
+class _Snapshot:
+    default_version: str
+    entries: dict[str, LoadedRuleSet]
+    fingerprint: str | None = None
+
+
+def _stat_signature(paths: list[Path]) -> tuple[tuple[int, int] | None, ...]:
+    signature: list[tuple[int, int] | None] = []
+    for path in paths:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            signature.append(None)
+            continue
+        signature.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def _fingerprint(paths: list[Path]) -> str:
+    return ":".join(sha256_file(path) if path.exists() else "-" for path in paths)
+
+
+class UnknownRuleSetVersion(KeyError):
+    pass
+
+
+class RulesRegistry:
+    # With lazy, the rules are only loaded by load() or on first access, so
+    # that a server can start (and report liveness) before they are compiled.
+
+    def __init__(self, settings: Settings | None = None, ruleset: RuleSet | None = None, lazy: bool = False) -> None:
+        if settings is None and ruleset is None:
+            raise ValueError("RulesRegistry needs settings or a ruleset")
+        self._settings = settings
+        self._lock = threading.Lock()
+        self._listeners: list[Callable[[LoadedRuleSet], None]] = []
+        self._stop = threading.Event()
+        self._watcher: threading.Thread | None = None
+        self._stat: tuple[tuple[int, int] | None, ...] = ()
+        self._snapshot: _Snapshot | None = None
+        if ruleset is not None:
+            loaded = LoadedRuleSet(ruleset=ruleset, loaded_at=datetime.now(timezone.utc))
+            self._snapshot = _Snapshot(
+                default_version=ruleset.rule_set_version,
+                entries={ruleset.rule_set_version: loaded},
+            )
+        elif not lazy:
+            self._snapshot = self._load()
+
+    @property
+    def loaded(self) -> bool:
+        return self._snapshot is not None
+
+    def load(self) -> None:
+        self._loaded_snapshot()
+
+    def _loaded_snapshot(self) -> _Snapshot:
+        # A single attribute read once loaded: requests keep using the
+        # snapshot they started with even if a reload swaps in a new one.
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None:
+                # Raises RulesLoaderError again on the next access if the rules are broken.
+                snapshot = self._snapshot = self._load()
+                logger.info("Loaded rule sets %s (default %s)", ", ".join(snapshot.entries), snapshot.default_version)
+            else:
+                return snapshot
+        for listener in self._listeners:
+            listener(snapshot.entries[snapshot.default_version])
+        return snapshot
+
+    @property
+    def current(self) -> LoadedRuleSet:
+        snapshot = self._loaded_snapshot()
+        return snapshot.entries[snapshot.default_version]
+
+    @property
+    def versions(self) -> list[str]:
+        return list(self._loaded_snapshot().entries)
+
+    def get(self, version: str | None = None) -> LoadedRuleSet:
+        snapshot = self._loaded_snapshot()
+        if version is None:
+            return snapshot.entries[snapshot.default_version]
+        try:
+            return snapshot.entries[version]
+        except KeyError:
+            raise UnknownRuleSetVersion(version) from None
+
+    @property
+    def can_reload(self) -> bool:
+        return self._settings is not None
+
+    def _additional_rule_paths(self) -> list[Path]:
+        assert self._settings is not None
+        rules_dir = self._settings.rules_dir
+        if rules_dir is None or not rules_dir.is_dir():
+            return []
+        excluded = {self._settings.rules_path.resolve(), self._settings.code_list_path.resolve()}
+        return sorted(path for path in rules_dir.glob(self._settings.rules_glob) if path.resolve() not in excluded)
+
+    def _watched_paths(self) -> list[Path]:
+        assert self._settings is not None
+        return [self._settings.rules_path, self._settings.code_list_path, *self._additional_rule_paths()]
+
+    def _load(self) -> _Snapshot:
+        assert self._settings is not None
+        paths = self._watched_paths()
+        stat = _stat_signature(paths)
+        loaded_at = datetime.now(timezone.utc)
+        default = load_ruleset(self._settings)
+        entries = {
+            default.rule_set_version: LoadedRuleSet(
+                ruleset=default, loaded_at=loaded_at, source=self._settings.rules_path
+            )
+        }
+        for path in paths[2:]:
+            ruleset = load_ruleset(
+                self._settings.model_copy(update={"rules_path": path, "rules_artifact_path": None})
+            )
+            if ruleset.rule_set_version in entries:
+                raise RulesLoaderError(
+                    f"Rule set version '{ruleset.rule_set_version}' in {path} is already loaded "
+                    f"from {entries[ruleset.rule_set_version].source}"
+                )
+            entries[ruleset.rule_set_version] = LoadedRuleSet(ruleset=ruleset, loaded_at=loaded_at, source=path)
+        self._stat = stat
+        return _Snapshot(
+            default_version=default.rule_set_version,
+            entries=entries,
+            fingerprint=_fingerprint(paths),
+        )
+
+    def add_listener(self, listener: Callable[[LoadedRuleSet], None]) -> None:
+        self._listeners.append(listener)
+
+    def reload(self, force: bool = False) -> bool:
+        if self._settings is None:
+            raise RulesLoaderError("Rules were provided directly and cannot be reloaded")
+        with self._lock:
+            previous = self._snapshot
+            if not force and previous is not None and previous.fingerprint == _fingerprint(self._watched_paths()):
+                self._stat = _stat_signature(self._watched_paths())
+                metrics.record_reload("unchanged")
+                return False
+            try:
+                snapshot = self._load()
+            except RulesLoaderError:
+                metrics.record_reload("failed")
+                raise
+            self._snapshot = snapshot
+        metrics.record_reload("reloaded")
+        logger.info(
+            "Loaded rule sets %s (default %s, previous default %s)",
+            ", ".join(snapshot.entries),
+            snapshot.default_version,
+            previous.default_version if previous is not None else None,
+        )
+        for listener in self._listeners:
+            listener(snapshot.entries[snapshot.default_version])
+        return True
+
+    def _changed_on_disk(self) -> bool:
+        return _stat_signature(self._watched_paths()) != self._stat
+
+    def _watch(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            if not self._changed_on_disk():
+                continue
+            try:
+                self.reload()
+            except RulesLoaderError as exc:
+                # Keep serving the last good rule set; retry once the files change again.
+                self._stat = _stat_signature(self._watched_paths())
+                logger.error("Failed to reload rules: %s", exc)
+
+    def start_watching(self, interval: float) -> None:
+        if self._settings is None or interval <= 0 or self._watcher is not None:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="rules-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self) -> None:
+        if self._watcher is None:
+            return
+        self._stop.set()
+        self._watcher.join()
+        self._watcher = None
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+import heapq
+import math
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Sequence
 
-from app.rules_loader import FeatureRule, RuleSet
+from app.metrics import metrics
+from app.rules_loader import CompiledField, RuleSet, parse_number
 from app.utils import normalize_value
 
 
@@ -17,86 +20,212 @@ class SegmentResult:
     second_best_score: float | None
     scores: dict[str, float]
     matched_features: list[dict[str, Any]] | None
+    explanation: dict[str, Any] | None = None
+    ranking: list[dict[str, Any]] | None = None
+    probabilities: dict[str, float] | None = None
 
 
-def _compute_feature_value(
-    member: dict[str, Any],
-    rule: FeatureRule,
-    case_insensitive: bool,
-    ruleset: RuleSet,
-) -> int:
-    raw_value = member.get(rule.input_field)
-    normalized = normalize_value(raw_value, case_insensitive)
-    if normalized is None:
-        return 0
-    code_mapping = ruleset.code_mappings.get(rule.input_field)
-    if code_mapping:
-        mapped_value = code_mapping.get(normalized)
-        if mapped_value is not None:
-            normalized = mapped_value
-    alias_mapping = ruleset.value_aliases.get(rule.input_field)
-    if alias_mapping:
-        aliased_value = alias_mapping.get(normalized)
-        if aliased_value is not None:
-            normalized = aliased_value
-    if rule.input_field == "Mitgliedsdauer_Jahre":
-        normalized_duration = _normalize_membership_duration(normalized, case_insensitive)
-        if normalized_duration is not None:
-            normalized = normalized_duration
-    match_value = normalize_value(rule.match_value, case_insensitive)
-    return 1 if normalized == match_value else 0
-
-
-def _normalize_membership_duration(value: str, case_insensitive: bool) -> str | None:
-    try:
-        years = float(value.replace(",", "."))
-    except ValueError:
-        return None
-    if years <= 1:
-        label = "Mitgliedsdauer bis zu 1 Jahr"
-    elif 2 <= years <= 4:
-        label = "Mitgliedsdauer 2 bis 4 Jahre"
-    elif 5 <= years <= 9:
-        label = "Mitgliedsdauer 5 bis 9 Jahre"
-    else:
-        return None
-    return normalize_value(label, case_insensitive)
+def _lookup_field(raw_value: Any, field: CompiledField, case_insensitive: bool) -> tuple[int, ...]:
+    value = normalize_value(raw_value, case_insensitive)
+    if value is None:
+        return ()
+    matches = field.lookup.get(value)
+    if matches is not None:
+        return matches
+    if field.buckets is not None:
+        bucketed = field.buckets.bucket_text(value)
+        if bucketed is not None:
+            return field.index.get(bucketed, ())
+    return ()
+
+
+def _matched_positions(member: dict[str, Any], ruleset: RuleSet) -> list[int]:
+    case_insensitive = ruleset.case_insensitive
+    positions: list[int] = []
+    for field in ruleset.compiled.fields:
+        matches = _lookup_field(member.get(field.input_field), field, case_insensitive)
+        if matches:
+            positions.extend(matches)
+    positions.sort()
+    return positions
+
+
+def _matched_positions_per_ruleset(member: dict[str, Any], rulesets: Sequence[RuleSet]) -> list[list[int]]:
+    # _matched_positions for several rule sets in one pass over the member:
+    # each input value is normalized once (per case mode) and parsed as a
+    # number at most once, however many rule sets read it.
+    normalized: dict[bool, dict[str, str | None]] = {}
+    numbers: dict[str, float | None] = {}
+    matched: list[list[int]] = []
+    for ruleset in rulesets:
+        case_insensitive = ruleset.case_insensitive
+        values = normalized.get(case_insensitive)
+        if values is None:
+            values = normalized[case_insensitive] = {}
+        positions: list[int] = []
+        for field in ruleset.compiled.fields:
+            name = field.input_field
+            if name in values:
+                value = values[name]
+            else:
+                value = values[name] = normalize_value(member.get(name), case_insensitive)
+            if value is None:
+                continue
+            matches = field.lookup.get(value)
+            if matches is None and field.buckets is not None:
+                if value not in numbers:
+                    numbers[value] = parse_number(value)
+                number = numbers[value]
+                bucketed = field.buckets.bucket(number) if number is not None else None
+                matches = field.index.get(bucketed, ()) if bucketed is not None else ()
+            if matches:
+                positions.extend(matches)
+        positions.sort()
+        matched.append(positions)
+    return matched
 
 
 def _round_scores(scores: dict[str, float], decimals: int = 4) -> dict[str, float]:
     return {segment: round(value, decimals) for segment, value in scores.items()}
 
 
+def _top_two(totals: list[float], segments: tuple[str, ...]) -> tuple[int, int | None]:
+    # One pass instead of sorting: highest score first, ties broken by name.
+    best, second = 0, None
+    for index in range(1, len(totals)):
+        score = totals[index]
+        if score > totals[best] or (score == totals[best] and segments[index] < segments[best]):
+            best, second = index, best
+        elif (
+            second is None
+            or score > totals[second]
+            or (score == totals[second] and segments[index] < segments[second])
+        ):
+            second = index
+    return best, second
+
+
+def _ranking_key(item: tuple[str, float]) -> tuple[float, str]:
+    return -item[1], item[0]
+
+
+def rank_segments(scores: dict[str, float], top_k: int, pretty_scores: bool = False) -> list[dict[str, Any]]:
+    # The top_k segments with their distance to the best score, selected with
+    # a bounded heap (O(n log k)) rather than a full sort.
+    top = heapq.nsmallest(top_k, scores.items(), key=_ranking_key)
+    best_score = top[0][1]
+    return [
+        {
+            "segment": segment,
+            "score": round(score, 4) if pretty_scores else score,
+            "margin": round(best_score - score, 4) if pretty_scores else best_score - score,
+        }
+        for segment, score in top
+    ]
+
+
+def segment_probabilities(scores: dict[str, float], pretty_scores: bool = False) -> dict[str, float]:
+    # Softmax over the segment scores, shifted by the maximum for stability.
+    peak = max(scores.values())
+    weights = {segment: math.exp(score - peak) for segment, score in scores.items()}
+    total = sum(weights.values())
+    if pretty_scores:
+        return {segment: round(weight / total, 4) for segment, weight in weights.items()}
+    return {segment: weight / total for segment, weight in weights.items()}
+
+
+def explain_positions(
+    positions: Sequence[int],
+    ruleset: RuleSet,
+    best_index: int,
+    second_index: int | None,
+    pretty_scores: bool = False,
+    contributions: dict[int, dict[str, float]] | None = None,
+) -> dict[str, Any]:
+    # Only the matched features, with their coefficients per segment and their
+    # share of the best-vs-second difference that decides Core/Mid/Rest. The
+    # margins plus intercept_margin add up to the difference (up to float
+    # rounding). contributions lets batch callers share the per-feature dicts, so
+    # one cache must not mix pretty_scores settings.
+    compiled = ruleset.compiled
+    segments = compiled.segments
+
+    def margin(values: tuple[float, ...]) -> float:
+        value = values[best_index] - values[second_index] if second_index is not None else 0.0
+        return round(value, 4) if pretty_scores else value
+
+    if contributions is None:
+        contributions = {}
+    features = ruleset.features
+    for position in positions:
+        if position not in contributions:
+            values = dict(zip(segments, compiled.coefficients[position]))
+            contributions[position] = _round_scores(values) if pretty_scores else values
+    return {
+        "intercept_margin": margin(compiled.intercepts),
+        "features": [
+            {
+                "feature_id": features[position].feature_id,
+                "contributions": contributions[position],
+                "margin": margin(compiled.coefficients[position]),
+            }
+            for position in positions
+        ],
+    }
+
+
 def score_member(
     member: dict[str, Any],
     ruleset: RuleSet,
     include_features: bool = False,
     pretty_scores: bool = False,
+    explain: bool = False,
+    top_k: int = 0,
+    probabilities: bool = False,
 ) -> SegmentResult:
-    scores = dict(ruleset.intercepts)
-    matched_features: list[dict[str, Any]] = []
+    with metrics.timer("features"):
+        positions = _matched_positions(member, ruleset)
+    with metrics.timer("score"):
+        return _score_positions(
+            positions, ruleset, include_features, pretty_scores, explain, top_k, probabilities
+        )
+
 
-    for feature in ruleset.features:
-        value = _compute_feature_value(member, feature, ruleset.case_insensitive, ruleset)
-        if value == 1:
-            for segment, coeff in feature.coefficients.items():
-                scores[segment] += coeff
-        if include_features:
+def _score_positions(
+    positions: list[int],
+    ruleset: RuleSet,
+    include_features: bool,
+    pretty_scores: bool,
+    explain: bool = False,
+    top_k: int = 0,
+    probabilities: bool = False,
+) -> SegmentResult:
+    compiled = ruleset.compiled
+    totals = list(compiled.intercepts)
+    for position in positions:
+        for segment_index, coeff in enumerate(compiled.coefficients[position]):
+            totals[segment_index] += coeff
+    scores = dict(zip(compiled.segments, totals))
+
+    matched_features: list[dict[str, Any]] = []
+    if include_features:
+        matched = set(positions)
+        for position, feature in enumerate(ruleset.features):
             matched_features.append(
                 {
                     "feature_id": feature.feature_id,
                     "input_field": feature.input_field,
                     "match_value": feature.match_value,
-                    "value": value,
+                    "value": 1 if position in matched else 0,
                 }
             )
 
-    sorted_segments = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
-    best_segment, best_score = sorted_segments[0]
+    best_index, second_index = _top_two(totals, compiled.segments)
+    best_segment, best_score = compiled.segments[best_index], totals[best_index]
     second_segment = None
     second_best_score = None
-    if len(sorted_segments) > 1:
-        second_segment, second_best_score = sorted_segments[1]
+    if second_index is not None:
+        second_segment, second_best_score = compiled.segments[second_index], totals[second_index]
 
     difference = best_score - second_best_score if second_best_score is not None else 0.0
     core_threshold = ruleset.thresholds["core_threshold"]
@@ -109,6 +238,12 @@ def score_member(
     else:
         segment_type = "Rest"
 
+    explanation = None
+    if explain:
+        explanation = explain_positions(positions, ruleset, best_index, second_index, pretty_scores)
+    ranking = rank_segments(scores, top_k, pretty_scores) if top_k > 0 else None
+    membership = segment_probabilities(scores, pretty_scores) if probabilities else None
+
     if pretty_scores:
         scores = _round_scores(scores)
         best_score = round(best_score, 4)
@@ -125,4 +260,7 @@ def score_member(
         second_best_score=second_best_score,
         scores=scores,
         matched_features=matched_features if include_features else None,
+        explanation=explanation,
+        ranking=ranking,
+        probabilities=membership,
     )
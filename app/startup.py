@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from app.executor import score_batch_body
+from app.responses import encode_segment_result
+from app.rules_loader import RuleSet
+from app.segmenter import score_member
+from app.synthetic import SyntheticMembers
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+
+
+class Startup:
+    # Progress of the background startup (loading rules, warm-up), with the
+    # duration of each stage in seconds, for the /ready endpoint.
+
+    def __init__(self, ready: bool = False) -> None:
+        self.status = READY if ready else STARTING
+        # Set once the lifespan's startup task runs.
+        self.started = False
+        self.stages: dict[str, float] = {}
+        self.error: str | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status == READY
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        yield
+        self.stages[name] = round(time.perf_counter() - started, 4)
+        logger.info("Startup stage %s took %.3fs", name, self.stages[name])
+
+    def finish(self) -> None:
+        self.status = READY
+        self.error = None
+        logger.info("Ready after %.3fs (%s)", sum(self.stages.values()), ", ".join(self.stages))
+
+    def retry(self) -> None:
+        self.status = STARTING
+        self.error = None
+
+    def fail(self, error: str) -> None:
+        self.status = FAILED
+        self.error = error
+        logger.error("Startup failed: %s", error)
+
+
+def warm_up_body(ruleset: RuleSet, members: int) -> bytes:
+    return json.dumps({"items": SyntheticMembers(ruleset).members(members)}).encode("utf-8")
+
+
+def warm_up(ruleset: RuleSet, members: int) -> None:
+    # Runs synthetic members through the single and batch paths once, so that
+    # the first real requests find the request parsers built, the per-field
+    # lookups and encoders exercised and numpy's kernels loaded.
+    score_batch_body(warm_up_body(ruleset, members), ruleset, False, False, False, False)
+    for member in SyntheticMembers(ruleset, seed=1).members(min(members, 32)):
+        encode_segment_result(score_member(member, ruleset), ruleset.rule_set_version)
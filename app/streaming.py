@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import json
+from typing import Any, AsyncIterator, Sequence
+
+import anyio
+from pydantic import ValidationError
+from starlette.responses import StreamingResponse
+from starlette.types import Receive
+
+from app.batch import score_batch, score_batch_compact
+from app.metrics import metrics
+from app.projection import member_parser
+from app.responses import encode_batch_scores, encode_compact_header, encode_compact_rows, encode_segment_results
+from app.rules_loader import RuleSet
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    media_type = NDJSON_MEDIA_TYPE
+
+    async def listen_for_disconnect(self, receive: Receive) -> None:
+        # The request body is still being read while the response streams, so
+        # the disconnect listener must not compete for receive() messages.
+        # Request.stream() raises ClientDisconnect on its own.
+        await anyio.sleep_forever()
+
+
+def _encode_line(payload: dict[str, Any]) -> bytes:
+    return (json.dumps(payload, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+async def iter_ndjson_chunks(
+    chunks: AsyncIterator[bytes], max_line_bytes: int = 1024 * 1024
+) -> AsyncIterator[list[tuple[int, bytes | None]]]:
+    # Yields the complete lines of each received chunk (with 1-based line
+    # numbers) so callers can score them together without buffering the body.
+    # Only each new chunk is split; an unfinished line is kept as its pieces.
+    # Lines longer than max_line_bytes are dropped while they arrive and
+    # yielded as None, which parse_ndjson_lines reports as an inline error.
+    partial: list[bytes] = []
+    partial_size = 0
+    too_long = False
+    line_number = 0
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        *complete, rest = chunk.split(b"\n")
+        lines: list[tuple[int, bytes | None]] = []
+        for piece in complete:
+            line_number += 1
+            line: bytes | None = piece
+            if too_long or partial_size + len(piece) > max_line_bytes:
+                line = None
+            elif partial:
+                line = b"".join((*partial, piece))
+            partial, partial_size, too_long = [], 0, False
+            if line is None or line.strip():
+                lines.append((line_number, line))
+        if rest and not too_long:
+            partial.append(rest)
+            partial_size += len(rest)
+            if partial_size > max_line_bytes:
+                partial, partial_size, too_long = [], 0, True
+        if lines:
+            yield lines
+    if too_long:
+        yield [(line_number + 1, None)]
+    elif partial:
+        last = b"".join(partial)
+        if last.strip():
+            yield [(line_number + 1, last)]
+
+
+def parse_ndjson_lines(
+    lines: Sequence[tuple[int, bytes | None]], ruleset: RuleSet, extra_fields: Sequence[str] = ()
+) -> tuple[list[dict[str, Any]], list[dict[str, Any] | None]]:
+    # Returns the members, projected onto the fields the rule set scores (and
+    # extra_fields), and per line None for a member or its error. A line of
+    # None was too long to be read (see iter_ndjson_chunks).
+    parser = member_parser(ruleset, extra_fields)
+    members: list[dict[str, Any]] = []
+    outcomes: list[dict[str, Any] | None] = []
+    for line_number, line in lines:
+        if line is None:
+            outcomes.append({"line": line_number, "error": "Line is too long"})
+            continue
+        try:
+            member = parser.member(line)
+        except ValidationError as exc:
+            error = exc.errors()[0]
+            if error["type"] == "json_invalid":
+                outcomes.append({"line": line_number, "error": error["msg"]})
+            else:
+                outcomes.append({"line": line_number, "error": "Each line must be a JSON object"})
+            continue
+        members.append(member)
+        outcomes.append(None)
+    return members, outcomes
+
+
+def score_ndjson_lines(
+    lines: Sequence[tuple[int, bytes | None]],
+    ruleset: RuleSet,
+    include_features: bool = False,
+    pretty_scores: bool = False,
+    source: str = "segment_stream",
+    explain: bool = False,
+    top_k: int = 0,
+    probabilities: bool = False,
+    compact: bool = False,
+) -> bytes:
+    # With compact, member lines are arrays as in encode_compact_rows; the
+    # caller sends compact_stream_header first.
+    members, outcomes = parse_ndjson_lines(lines, ruleset)
+    metrics.observe_batch(source, len(members))
+    if include_features or explain or top_k or probabilities:
+        scored = score_batch(members, ruleset, include_features, pretty_scores, explain, top_k, probabilities)
+        metrics.record_results(scored)
+        results = iter(encode_segment_results(scored, ruleset.rule_set_version))
+    else:
+        batch = score_batch_compact(members, ruleset)
+        metrics.record_counts(batch.counts())
+        if compact:
+            results = encode_compact_rows(batch, pretty_scores)
+        else:
+            results = encode_batch_scores(batch, ruleset.rule_set_version, pretty_scores)
+    encoded: list[bytes] = []
+    for outcome in outcomes:
+        if outcome is None:
+            encoded.append((next(results) + "\n").encode("utf-8"))
+        else:
+            encoded.append(_encode_line(outcome))
+    return b"".join(encoded)
+
+
+def compact_stream_header(ruleset: RuleSet) -> bytes:
+    return f"{{{encode_compact_header(ruleset.compiled.segments, ruleset.rule_set_version)}}}\n".encode("utf-8")
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import random
+from typing import Any, Iterator
+
+from app.rules_loader import RuleSet
+
+UNMATCHED_VALUES = ("unbekannt", "k.A.", "n/a", "")
+EXTRA_FIELDS = {
+    "Id": None,
+    "Firmenname": ("Muster GmbH", "Beispiel AG", "Mittelstand KG"),
+    "Ort": ("Berlin", "München", "Köln", "Leipzig"),
+}
+
+
+def _field_domains(ruleset: RuleSet) -> dict[str, list[str]]:
+    domains: dict[str, list[str]] = {}
+    for feature in ruleset.features:
+        domains.setdefault(feature.input_field, []).append(feature.match_value)
+    for field, mapping in ruleset.code_mappings.items():
+        if field in domains:
+            domains[field].extend(mapping)
+    for field, mapping in ruleset.value_aliases.items():
+        if field in domains:
+            domains[field].extend(mapping)
+    return domains
+
+
+class SyntheticMembers:
+    # Generates CRM-like members from the value domains of a rule set: match
+    # values, raw codes and aliases, with wrong case, stray whitespace, numeric
+    # durations, unmatched values, missing fields and unscored extra fields.
+
+    def __init__(
+        self,
+        ruleset: RuleSet,
+        seed: int = 0,
+        missing_rate: float = 0.15,
+        noise_rate: float = 0.2,
+        unmatched_rate: float = 0.05,
+    ) -> None:
+        self._random = random.Random(seed)
+        self._domains = _field_domains(ruleset)
+        self._numeric_fields = set(ruleset.numeric_buckets)
+        self._missing_rate = missing_rate
+        self._noise_rate = noise_rate
+        self._unmatched_rate = unmatched_rate
+        self._counter = 0
+
+    def _value(self, field: str) -> Any:
+        rng = self._random
+        if rng.random() < self._unmatched_rate:
+            return rng.choice(UNMATCHED_VALUES)
+        if field in self._numeric_fields and rng.random() < 0.7:
+            years = rng.choice((rng.randint(0, 15), round(rng.uniform(0, 12), 1)))
+            return str(years).replace(".", ",") if rng.random() < 0.3 else years
+        value = rng.choice(self._domains[field])
+        if rng.random() < self._noise_rate:
+            value = rng.choice((value.upper(), value.lower(), f"  {value} ", f"{value}\t"))
+        return value
+
+    def member(self) -> dict[str, Any]:
+        rng = self._random
+        self._counter += 1
+        member: dict[str, Any] = {"Id": f"SYN-{self._counter:08d}"}
+        for field in self._domains:
+            if rng.random() >= self._missing_rate:
+                member[field] = self._value(field)
+        for field, values in EXTRA_FIELDS.items():
+            if values is not None:
+                member[field] = rng.choice(values)
+        return member
+
+    def members(self, count: int) -> list[dict[str, Any]]:
+        return [self.member() for _ in range(count)]
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        while True:
+            yield self.member()
@@ -0,0 +1,420 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from itertools import cycle
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterator
+
+import httpx
+
+from app.config import Settings
+from app.rules_loader import load_rules
+from app.synthetic import SyntheticMembers
+from benchmarks.run import RULES_DIR, percentile
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+SCENARIOS = ("single", "burst", "stream")
+JSON_HEADERS = {"Content-Type": "application/json"}
+NDJSON_HEADERS = {"Content-Type": "application/x-ndjson"}
+
+
+@dataclass(frozen=True)
+class LoadProfile:
+    duration: float = 30.0
+    # single: n8n-style callers, each posting one member to /segment at a time.
+    concurrency: int = 32
+    # burst: every burst_interval seconds, burst_size parallel /segment/batch
+    # requests with sizes drawn log-uniformly from [batch_min, batch_max].
+    burst_size: int = 4
+    burst_interval: float = 2.0
+    batch_min: int = 50
+    batch_max: int = 5000
+    # stream: back-to-back NDJSON uploads to /segment/stream.
+    stream_uploads: int = 1
+    stream_members: int = 20000
+    stream_chunk: int = 1000
+
+
+@dataclass
+class ScenarioStats:
+    latencies: list[float] = field(default_factory=list)
+    members: int = 0
+    errors: int = 0
+    statuses: Counter[str] = field(default_factory=Counter)
+
+    def summary(self, elapsed: float) -> dict[str, Any]:
+        requests = len(self.latencies) + self.errors
+        latencies = self.latencies or [0.0]
+        return {
+            "requests": requests,
+            "requests_per_s": requests / elapsed if elapsed > 0 else 0.0,
+            "members_per_s": self.members / elapsed if elapsed > 0 else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p90_ms": percentile(latencies, 90) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": max(latencies) * 1000,
+            "error_rate": self.errors / requests if requests else 0.0,
+            "statuses": dict(sorted(self.statuses.items())),
+        }
+
+
+async def _timed(stats: ScenarioStats, members: int, request: Any) -> None:
+    # Latencies cover the full response body; failed requests count as errors
+    # (including 429/503 from overload protection) and not towards latency.
+    started = time.perf_counter()
+    try:
+        response = await request
+    except httpx.HTTPError as exc:
+        stats.errors += 1
+        stats.statuses[type(exc).__name__] += 1
+        return
+    stats.statuses[str(response.status_code)] += 1
+    if response.status_code >= 400:
+        stats.errors += 1
+        return
+    stats.latencies.append(time.perf_counter() - started)
+    stats.members += members
+
+
+def encode_members(members: list[dict[str, Any]]) -> list[bytes]:
+    # Members are encoded once up front so that the client spends its CPU on
+    # sending requests rather than on JSON encoding.
+    return [json.dumps(member, ensure_ascii=False).encode("utf-8") for member in members]
+
+
+async def _single_caller(
+    client: httpx.AsyncClient,
+    members: Iterator[bytes],
+    stats: ScenarioStats,
+    deadline: float,
+) -> None:
+    while time.perf_counter() < deadline:
+        await _timed(stats, 1, client.post("/segment", content=next(members), headers=JSON_HEADERS))
+        # In-process transports may complete a request without suspending.
+        await asyncio.sleep(0)
+
+
+def _batch_body(members: Iterator[bytes], size: int) -> bytes:
+    return b'{"items":[' + b",".join(next(members) for _ in range(size)) + b"]}"
+
+
+async def _bursts(
+    client: httpx.AsyncClient,
+    members: Iterator[bytes],
+    stats: ScenarioStats,
+    deadline: float,
+    profile: LoadProfile,
+    rng: random.Random,
+) -> None:
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        sizes = [
+            round(profile.batch_min * (profile.batch_max / profile.batch_min) ** rng.random())
+            for _ in range(profile.burst_size)
+        ]
+        requests = [
+            _timed(stats, size, client.post("/segment/batch", content=_batch_body(members, size), headers=JSON_HEADERS))
+            for size in sizes
+        ]
+        await asyncio.gather(*requests)
+        pause = min(profile.burst_interval - (time.perf_counter() - started), deadline - time.perf_counter())
+        await asyncio.sleep(max(0.0, pause))
+
+
+async def _ndjson_body(members: list[bytes], chunk: int) -> AsyncIterator[bytes]:
+    for start in range(0, len(members), chunk):
+        yield b"\n".join(members[start : start + chunk]) + b"\n"
+
+
+async def _streamer(
+    client: httpx.AsyncClient,
+    members: Iterator[bytes],
+    stats: ScenarioStats,
+    deadline: float,
+    profile: LoadProfile,
+) -> None:
+    while time.perf_counter() < deadline:
+        upload = [next(members) for _ in range(profile.stream_members)]
+        body = _ndjson_body(upload, profile.stream_chunk)
+        await _timed(stats, len(upload), client.post("/segment/stream", content=body, headers=NDJSON_HEADERS))
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    members: list[bytes],
+    scenarios: tuple[str, ...],
+    profile: LoadProfile,
+    seed: int = 0,
+) -> dict[str, dict[str, Any]]:
+    # All selected scenarios run concurrently, as they would hit a deployment;
+    # run a single scenario to measure it in isolation.
+    rng = random.Random(seed)
+    stats = {scenario: ScenarioStats() for scenario in scenarios}
+    deadline = time.perf_counter() + profile.duration
+    tasks = []
+    if "single" in stats:
+        tasks += [
+            _single_caller(client, cycle(rng.sample(members, len(members))), stats["single"], deadline)
+            for _ in range(profile.concurrency)
+        ]
+    if "burst" in stats:
+        tasks.append(_bursts(client, cycle(members), stats["burst"], deadline, profile, rng))
+    if "stream" in stats:
+        tasks += [
+            _streamer(client, cycle(members), stats["stream"], deadline, profile) for _ in range(profile.stream_uploads)
+        ]
+    started = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    return {scenario: scenario_stats.summary(elapsed) for scenario, scenario_stats in stats.items()}
+
+
+def _cpu_seconds(pid: int) -> float | None:
+    # CPU time of a process and its descendants (the uvicorn workers), read
+    # from /proc; None where that is not available.
+    proc = Path("/proc")
+    if not (proc / str(pid) / "stat").exists():
+        return None
+    parents: dict[int, int] = {}
+    times: dict[int, float] = {}
+    ticks = os.sysconf("SC_CLK_TCK")
+    for stat_path in proc.glob("[0-9]*/stat"):
+        try:
+            stat = stat_path.read_text()
+        except OSError:
+            continue
+        # The command name may contain spaces; the remaining fields follow ")".
+        fields = stat[stat.rindex(")") + 2 :].split()
+        process_id = int(stat_path.parent.name)
+        parents[process_id] = int(fields[1])
+        times[process_id] = (int(fields[11]) + int(fields[12])) / ticks
+    tree = {pid}
+    changed = True
+    while changed:
+        children = {process_id for process_id, parent in parents.items() if parent in tree} - tree
+        tree |= children
+        changed = bool(children)
+    return sum(times.get(process_id, 0.0) for process_id in tree)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def local_server(workers: int, env: dict[str, str], startup_timeout: float = 60.0) -> Iterator[tuple[str, int]]:
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+            "--no-access-log",
+        ],
+        cwd=ROOT_DIR,
+        env={**os.environ, **env},
+    )
+    try:
+        deadline = time.monotonic() + startup_timeout
+        # Rules load and warm up after the server accepts connections, so the
+        # run waits for /ready. Each check opens a new connection and may reach
+        # another worker; several in a row make it likely all of them are ready.
+        ready_checks = 0
+        while ready_checks < 3 * workers:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode} during startup")
+            try:
+                response = httpx.get(f"{url}/ready", timeout=1)
+            except httpx.HTTPError:
+                response = None
+            if response is not None and response.status_code == 200:
+                ready_checks += 1
+                continue
+            ready_checks = 0
+            if response is not None and response.json().get("status") == "failed":
+                raise RuntimeError(f"Server startup failed: {response.json().get('error')}")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Server did not become ready within {startup_timeout:.0f}s")
+            time.sleep(0.2)
+        yield url, process.pid
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+async def _measure(
+    url: str,
+    members: list[bytes],
+    scenarios: tuple[str, ...],
+    profile: LoadProfile,
+    warmup: float,
+    seed: int,
+    server_pid: int | None,
+) -> dict[str, Any]:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+        if warmup > 0:
+            await run_load(client, members, scenarios, LoadProfile(**{**asdict(profile), "duration": warmup}), seed)
+        server_cpu = _cpu_seconds(server_pid) if server_pid is not None else None
+        client_cpu = time.process_time()
+        started = time.perf_counter()
+        results = await run_load(client, members, scenarios, profile, seed)
+        elapsed = time.perf_counter() - started
+    run: dict[str, Any] = {
+        # 100 % is one fully used core. A saturated client (client_cpu_percent
+        # near 100) limits the numbers, not the server.
+        "client_cpu_percent": (time.process_time() - client_cpu) / elapsed * 100,
+        "scenarios": results,
+    }
+    if server_cpu is not None:
+        run["server_cpu_percent"] = ((_cpu_seconds(server_pid) or 0.0) - server_cpu) / elapsed * 100
+    return run
+
+
+def _parse_variant(value: str) -> tuple[str, dict[str, str]]:
+    name, _, assignments = value.partition(":")
+    env: dict[str, str] = {}
+    for assignment in filter(None, assignments.split(",")):
+        key, separator, setting = assignment.partition("=")
+        if not separator:
+            raise argparse.ArgumentTypeError(f"Expected KEY=VALUE in variant '{value}'")
+        env[key.strip()] = setting
+    return name, env
+
+
+def _print_table(report: dict[str, Any]) -> None:
+    sys.stderr.write(
+        f"{'run':<24}{'scenario':<9}{'req/s':>9}{'members/s':>12}{'p50 ms':>9}{'p90 ms':>9}"
+        f"{'p99 ms':>9}{'errors':>8}{'srv CPU':>9}\n"
+    )
+    for run in report["runs"]:
+        label = f"{run['variant']} x{run['workers']}" if "workers" in run else run["variant"]
+        cpu = run.get("server_cpu_percent")
+        for scenario, result in run["scenarios"].items():
+            sys.stderr.write(
+                f"{label:<24}{scenario:<9}{result['requests_per_s']:>9,.1f}{result['members_per_s']:>12,.0f}"
+                f"{result['p50_ms']:>9.1f}{result['p90_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+                f"{result['error_rate']:>8.1%}{'' if cpu is None else f'{cpu:.0f}%':>9}\n"
+            )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    defaults = LoadProfile()
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.load",
+        description="Load test against local uvicorn servers with n8n/Salesforce-like traffic",
+    )
+    parser.add_argument("-o", "--output", type=Path, help="Write the JSON report to this file")
+    parser.add_argument("--url", help="Target an already running server instead of starting local ones")
+    parser.add_argument("--workers", default="1", help="Comma-separated uvicorn worker counts to compare")
+    parser.add_argument(
+        "--variant",
+        action="append",
+        type=_parse_variant,
+        help="Server configuration NAME[:KEY=VALUE,...] (environment, e.g. SEGMENTER_ settings); repeatable",
+    )
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run together")
+    parser.add_argument("--duration", type=float, default=defaults.duration, help="Measured seconds per run")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Unmeasured seconds before each run")
+    parser.add_argument("--concurrency", type=int, default=defaults.concurrency, help="Parallel single-member callers")
+    parser.add_argument("--burst-size", type=int, default=defaults.burst_size, help="Parallel batch requests per burst")
+    parser.add_argument("--burst-interval", type=float, default=defaults.burst_interval, help="Seconds between bursts")
+    parser.add_argument("--batch-min", type=int, default=defaults.batch_min, help="Smallest batch size")
+    parser.add_argument("--batch-max", type=int, default=defaults.batch_max, help="Largest batch size")
+    parser.add_argument("--stream-uploads", type=int, default=defaults.stream_uploads, help="Parallel NDJSON uploads")
+    parser.add_argument("--stream-members", type=int, default=defaults.stream_members, help="Members per upload")
+    parser.add_argument("--stream-chunk", type=int, default=defaults.stream_chunk, help="Members per upload chunk")
+    parser.add_argument("--pool", type=int, default=20000, help="Distinct synthetic members to replay")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rules", type=Path, default=RULES_DIR / "bvmw_typing_tool_rules_v2.json")
+    parser.add_argument("--code-lists", type=Path, default=RULES_DIR / "code_lists.json")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    scenarios = tuple(scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip())
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown or not scenarios:
+        parser.error(f"Unknown scenarios {sorted(unknown)}, choose from {list(SCENARIOS)}")
+    profile = LoadProfile(
+        duration=args.duration,
+        concurrency=args.concurrency,
+        burst_size=args.burst_size,
+        burst_interval=args.burst_interval,
+        batch_min=max(args.batch_min, 1),
+        batch_max=max(args.batch_max, args.batch_min, 1),
+        stream_uploads=args.stream_uploads,
+        stream_members=args.stream_members,
+        stream_chunk=max(args.stream_chunk, 1),
+    )
+    # The members come from the same rules the server scores with, by default
+    # the bundled ones; use --rules for a server running other rules.
+    ruleset = load_rules(Settings(rules_path=args.rules, code_list_path=args.code_lists))
+    members = encode_members(SyntheticMembers(ruleset, seed=args.seed).members(max(args.pool, 1)))
+
+    runs: list[dict[str, Any]] = []
+    if args.url:
+        run = asyncio.run(_measure(args.url, members, scenarios, profile, args.warmup, args.seed, None))
+        runs.append({"variant": args.url, **run})
+    else:
+        variants = args.variant or [("default", {})]
+        for workers in (int(value) for value in args.workers.split(",") if value.strip()):
+            for name, env in variants:
+                sys.stderr.write(f"Running {name} with {workers} worker(s)...\n")
+                with local_server(workers, env) as (url, pid):
+                    run = asyncio.run(_measure(url, members, scenarios, profile, args.warmup, args.seed, pid))
+                runs.append({"variant": name, "workers": workers, "env": env, **run})
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "rule_set_version": ruleset.rule_set_version,
+        },
+        "profile": {**asdict(profile), "scenarios": list(scenarios)},
+        "runs": runs,
+    }
+    _print_table(report)
+    encoded = json.dumps(report, indent=2) + "\n"
+    if args.output:
+        args.output.write_text(encoded, encoding="utf-8")
+    else:
+        sys.stdout.write(encoded)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable
+
+import httpx
+
+from app.batch import score_batch
+from app.config import Settings
+from app.main import create_app
+from app.rules_artifact import read_artifact, write_artifact
+from app.rules_loader import RuleSet, load_rules
+from app.segmenter import score_member
+from app.synthetic import SyntheticMembers
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+DEFAULT_BASELINE = BENCHMARK_DIR / "baseline.json"
+RULES_DIR = BENCHMARK_DIR.parent / "rules"
+DEFAULT_TOLERANCE = 0.5
+
+# Metrics where larger is better; everything else (latencies, memory) is
+# compared as smaller-is-better. p99 is reported but too noisy on shared
+# machines to gate on by default.
+HIGHER_IS_BETTER = {"items_per_s"}
+DEFAULT_GATED_METRICS = ("p50_ms", "items_per_s", "peak_memory_kb")
+
+
+def percentile(samples: list[float], percentile: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(percentile / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _summary(latencies: list[float], items: int, elapsed: float, peak_bytes: int) -> dict[str, float]:
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "items_per_s": items / elapsed if elapsed > 0 else 0.0,
+        "peak_memory_kb": peak_bytes / 1024,
+    }
+
+
+def _peak_memory(call: Callable[[], Any]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        call()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _measure(call: Callable[[], Any], repeat: int, items_per_call: int) -> dict[str, float]:
+    call()
+    latencies: list[float] = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        call_started = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    return _summary(latencies, items_per_call * repeat, elapsed, _peak_memory(call))
+
+
+def bench_load_rules(settings: Settings, repeat: int) -> dict[str, float]:
+    return _measure(lambda: load_rules(settings), repeat, 1)
+
+
+def bench_load_artifact(settings: Settings, repeat: int) -> dict[str, float]:
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_artifact(settings, Path(directory) / "rules.compiled")
+        return _measure(lambda: read_artifact(path, settings), repeat, 1)
+
+
+def bench_score_member(ruleset: RuleSet, members: list[dict[str, Any]]) -> dict[str, float]:
+    iterator = iter(members * 2)
+    return _measure(lambda: score_member(next(iterator), ruleset), len(members) - 1, 1)
+
+
+def bench_score_batch(ruleset: RuleSet, members: list[dict[str, Any]], repeat: int) -> dict[str, float]:
+    return _measure(lambda: score_batch(members, ruleset), repeat, len(members))
+
+
+async def _bench_http(
+    ruleset: RuleSet,
+    path: str,
+    payloads: list[Any],
+    items_per_request: int,
+) -> dict[str, float]:
+    app = create_app(ruleset, Settings(cache_size=0))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        (await client.post(path, json=payloads[0])).raise_for_status()
+        latencies: list[float] = []
+        started = time.perf_counter()
+        for payload in payloads:
+            call_started = time.perf_counter()
+            response = await client.post(path, json=payload)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - call_started)
+        elapsed = time.perf_counter() - started
+
+        async def _single() -> None:
+            (await client.post(path, json=payloads[0])).raise_for_status()
+
+        gc.collect()
+        tracemalloc.start()
+        try:
+            await _single()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return _summary(latencies, items_per_request * len(payloads), elapsed, peak)
+
+
+def _best_of(rounds: list[dict[str, float]]) -> dict[str, float]:
+    # Taking the best round filters out scheduler noise; regressions in the code
+    # slow down every round.
+    best: dict[str, float] = {}
+    for metric in rounds[0]:
+        values = [measured[metric] for measured in rounds]
+        best[metric] = max(values) if metric in HIGHER_IS_BETTER else min(values)
+    return best
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    settings = Settings(rules_path=args.rules, code_list_path=args.code_lists)
+    ruleset = load_rules(settings)
+    generator = SyntheticMembers(ruleset, seed=args.seed)
+    members = generator.members(args.members)
+    batch = generator.members(args.batch_size)
+    http_batches = [{"items": generator.members(args.http_batch_size)} for _ in range(args.http_requests // 10 or 1)]
+
+    benchmarks: dict[str, Callable[[], dict[str, float]]] = {
+        "load_rules": lambda: bench_load_rules(settings, args.repeat),
+        "load_rules_artifact": lambda: bench_load_artifact(settings, args.repeat),
+        "score_member": lambda: bench_score_member(ruleset, members),
+        f"score_batch_{args.batch_size}": lambda: bench_score_batch(ruleset, batch, args.repeat),
+        "http_segment": lambda: asyncio.run(_bench_http(ruleset, "/segment", members[: args.http_requests], 1)),
+        f"http_segment_batch_{args.http_batch_size}": lambda: asyncio.run(
+            _bench_http(ruleset, "/segment/batch", http_batches, args.http_batch_size)
+        ),
+    }
+    results = {
+        name: _best_of([benchmark() for _ in range(max(args.rounds, 1))])
+        for name, benchmark in benchmarks.items()
+    }
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "rule_set_version": ruleset.rule_set_version,
+        },
+        "benchmarks": results,
+    }
+
+
+def compare(
+    current: dict[str, Any],
+    baseline: dict[str, Any],
+    tolerance: float,
+    metrics: tuple[str, ...] = DEFAULT_GATED_METRICS,
+) -> list[str]:
+    regressions: list[str] = []
+    for name, expected_metrics in baseline.get("benchmarks", {}).items():
+        measured = current["benchmarks"].get(name)
+        if measured is None:
+            continue
+        for metric, expected in expected_metrics.items():
+            if metric not in metrics:
+                continue
+            actual = measured.get(metric)
+            if actual is None or expected <= 0:
+                continue
+            if metric in HIGHER_IS_BETTER:
+                regressed = actual < expected * (1 - tolerance)
+            else:
+                regressed = actual > expected * (1 + tolerance)
+            if regressed:
+                regressions.append(f"{name}.{metric}: {actual:.3f} vs baseline {expected:.3f}")
+    return regressions
+
+
+def _print_table(report: dict[str, Any]) -> None:
+    sys.stderr.write(f"{'benchmark':<28}{'p50 ms':>10}{'p99 ms':>10}{'items/s':>14}{'peak KiB':>12}\n")
+    for name, metrics in report["benchmarks"].items():
+        sys.stderr.write(
+            f"{name:<28}{metrics['p50_ms']:>10.3f}{metrics['p99_ms']:>10.3f}"
+            f"{metrics['items_per_s']:>14,.0f}{metrics['peak_memory_kb']:>12,.0f}\n"
+        )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Segmenter benchmarks")
+    parser.add_argument("-o", "--output", type=Path, help="Write the JSON report to this file")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="Baseline report to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed relative regression")
+    parser.add_argument(
+        "--metrics",
+        default=",".join(DEFAULT_GATED_METRICS),
+        help="Comma-separated metrics that fail the run on regression",
+    )
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--members", type=int, default=5000, help="Members for single-member scoring")
+    parser.add_argument("--batch-size", type=int, default=10000, help="Members per batch-scoring call")
+    parser.add_argument("--http-requests", type=int, default=500, help="Requests against /segment")
+    parser.add_argument("--http-batch-size", type=int, default=1000, help="Members per /segment/batch request")
+    parser.add_argument("--repeat", type=int, default=10, help="Repetitions for load and batch benchmarks")
+    parser.add_argument("--rounds", type=int, default=3, help="Rounds per benchmark; the best round is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rules", type=Path, default=RULES_DIR / "bvmw_typing_tool_rules_v2.json")
+    parser.add_argument("--code-lists", type=Path, default=RULES_DIR / "code_lists.json")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    report = run(args)
+    _print_table(report)
+    encoded = json.dumps(report, indent=2, sort_keys=True) + "\n"
+    if args.output:
+        args.output.write_text(encoded, encoding="utf-8")
+    else:
+        sys.stdout.write(encoded)
+
+    if args.update_baseline:
+        args.baseline.write_text(encoded, encoding="utf-8")
+        sys.stderr.write(f"Baseline written to {args.baseline}\n")
+        return 0
+    if not args.baseline.exists():
+        sys.stderr.write(f"No baseline at {args.baseline}, skipping regression check\n")
+        return 0
+    regressions = compare(
+        report,
+        json.loads(args.baseline.read_text(encoding="utf-8")),
+        args.tolerance,
+        tuple(metric.strip() for metric in args.metrics.split(",") if metric.strip()),
+    )
+    for regression in regressions:
+        sys.stderr.write(f"REGRESSION {regression}\n")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
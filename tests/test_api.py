@@ -1,8 +1,15 @@
 from __future__ import annotations
 
+import json
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from fastapi.testclient import TestClient
 
+from app.batch import score_batch
+from app.config import Settings
 from app.main import create_app
+from app.model import BatchResponse, SegmentResponse
 from app.rules_loader import FeatureRule, RuleSet
 
 
@@ -39,3 +46,179 @@ def test_segment_endpoint_schema() -> None:
     assert payload["segment"] == "Alpha"
     assert "scores" in payload
     assert payload["rule_set_version"] == "test"
+
+
+def test_segment_stream_scores_lines_and_reports_errors_inline() -> None:
+    client = TestClient(create_app(_ruleset()))
+    body = '{"status": "Active"}\n\nnot json\n[1, 2]\n{"status": "Inactive"}'
+    response = client.post(
+        "/segment/stream",
+        content=body.encode("utf-8"),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 4
+    assert lines[0]["segment"] == "Alpha"
+    assert lines[0]["rule_set_version"] == "test"
+    assert lines[1]["line"] == 3 and "Invalid JSON" in lines[1]["error"]
+    assert lines[2] == {"line": 4, "error": "Each line must be a JSON object"}
+    assert lines[3]["type"] == "Rest"
+
+
+def test_segment_stream_joins_split_lines_and_rejects_overlong_ones() -> None:
+    client = TestClient(create_app(_ruleset(), Settings(ndjson_max_line_bytes=64)))
+    long_line = json.dumps({"status": "Active", "note": "x" * 100})
+    body = f'{{"status": "Active"}}\n{long_line}\n{{"status": "Inactive"}}\n{long_line}'.encode("utf-8")
+    # Lines arrive split over many small chunks.
+    response = client.post(
+        "/segment/stream",
+        content=(body[start : start + 7] for start in range(0, len(body), 7)),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line.get("segment") for line in lines] == ["Alpha", None, "Alpha", None]
+    assert lines[1] == {"line": 2, "error": "Line is too long"}
+    assert lines[2]["type"] == "Rest"
+    assert lines[3] == {"line": 4, "error": "Line is too long"}
+
+
+def test_batch_fast_path_matches_pydantic_rendering() -> None:
+    ruleset = RuleSet(
+        segments=["Wachstum", "Größe"],
+        intercepts={"Wachstum": 0, "Größe": 0.1},
+        thresholds={"core_threshold": 1.0, "mid_threshold": 0.5},
+        features=[
+            FeatureRule(
+                feature_id="status==Aktiv",
+                input_field="status",
+                match_value="Aktiv",
+                coefficients={"Wachstum": 1.0 / 3, "Größe": 0.2},
+            )
+        ],
+        rule_set_version="v-ä",
+        case_insensitive=False,
+    )
+    items = [{"status": "Aktiv"}, {"status": "Passiv"}, {}]
+    client = TestClient(create_app(ruleset))
+
+    for params in (
+        {},
+        {"include_features": True, "pretty_scores": True},
+        {"explain": True},
+        {"top_k": 2, "probabilities": True},
+    ):
+        response = client.post("/segment/batch", json={"items": items}, params=params)
+        scored = score_batch(items, ruleset, **params)
+        expected = BatchResponse(
+            results=[
+                SegmentResponse(
+                    **{
+                        key: value
+                        for key, value in result.__dict__.items()
+                        if value is not None or key not in ("explanation", "ranking", "probabilities")
+                    },
+                    rule_set_version="v-ä",
+                )
+                for result in scored
+            ],
+            rule_set_version="v-ä",
+        )
+        assert response.headers["content-type"] == "application/json"
+        # The optional parts are only rendered when requested, i.e. when set.
+        assert response.content == JSONResponse(jsonable_encoder(expected, exclude_unset=True)).body
+
+    schema = client.get("/openapi.json").json()
+    batch_schema = schema["paths"]["/segment/batch"]["post"]["responses"]["200"]["content"]["application/json"]
+    assert batch_schema["schema"] == {"$ref": "#/components/schemas/BatchResponse"}
+
+
+def test_explain_lists_matched_features_and_margins() -> None:
+    client = TestClient(create_app(_ruleset()))
+    plain = client.post("/segment", json={"status": "Active"}).json()
+    assert "explanation" not in plain
+
+    payload = client.post("/segment", json={"status": "Active"}, params={"explain": "true"}).json()
+    assert payload["explanation"] == {
+        "intercept_margin": 0.0,
+        "features": [{"feature_id": "status==Active", "contributions": {"Alpha": 1.0, "Beta": 0.2}, "margin": 0.8}],
+    }
+    margins = sum(feature["margin"] for feature in payload["explanation"]["features"])
+    assert margins + payload["explanation"]["intercept_margin"] == payload["difference"]
+
+    batch = client.post("/segment/batch", json={"items": [{"status": "Active"}, {}]}, params={"explain": "true"})
+    results = batch.json()["results"]
+    assert results[0]["explanation"] == payload["explanation"]
+    assert results[1]["explanation"] == {"intercept_margin": 0.0, "features": []}
+
+    compare = client.post("/segment/compare", json={"status": "Active"}).json()
+    assert "explanation" not in compare["results"]["test"]
+    assert "matched_features" in compare["results"]["test"]
+
+    ruleset = RuleSet(
+        segments=["Alpha", "Beta"],
+        intercepts={"Alpha": 0.0, "Beta": 0.0},
+        thresholds={"core_threshold": 1.0, "mid_threshold": 0.5},
+        features=[
+            FeatureRule(
+                feature_id="status==Active",
+                input_field="status",
+                match_value="Active",
+                coefficients={"Alpha": 1.0 / 3, "Beta": 0.2},
+            )
+        ],
+        rule_set_version="test",
+        case_insensitive=False,
+    )
+    params = {"explain": "true", "pretty_scores": "true"}
+    pretty = TestClient(create_app(ruleset)).post("/segment", json={"status": "Active"}, params=params).json()
+    assert pretty["explanation"]["features"][0] == {
+        "feature_id": "status==Active",
+        "contributions": {"Alpha": 0.3333, "Beta": 0.2},
+        "margin": 0.1333,
+    }
+
+
+def test_aggregate_counts_groups_and_histograms() -> None:
+    client = TestClient(create_app(_ruleset()))
+    items = [
+        {"status": "Active", "region": "Nord"},
+        {"status": "Active", "region": "Süd"},
+        {"status": "Inactive", "region": "Nord"},
+        {"status": "Active"},
+    ]
+    params = {"group_by": ["region"], "score_bin_width": 0.5, "difference_bin_width": 0.5}
+    response = client.post("/segment/aggregate", json={"items": items}, params=params)
+    assert response.status_code == 200
+    payload = response.json()
+    assert payload["total"] == 4
+    assert payload["segments"] == {"Alpha": {"Core": 0, "Mid": 3, "Rest": 1}, "Beta": {"Core": 0, "Mid": 0, "Rest": 0}}
+    assert payload["groups"]["region"] == {
+        "": {"Alpha": {"Core": 0, "Mid": 1, "Rest": 0}},
+        "Nord": {"Alpha": {"Core": 0, "Mid": 1, "Rest": 1}},
+        "Süd": {"Alpha": {"Core": 0, "Mid": 1, "Rest": 0}},
+    }
+    assert payload["histograms"]["best_score"]["bins"] == [{"start": 0.0, "count": 1}, {"start": 1.0, "count": 3}]
+    assert payload["histograms"]["difference"]["bins"] == [{"start": 0.0, "count": 1}, {"start": 0.5, "count": 3}]
+
+    body = "\n".join(json.dumps(item) for item in items) + "\nnot json\n"
+    streamed = client.post(
+        "/segment/aggregate",
+        content=body.encode("utf-8"),
+        headers={"Content-Type": "application/x-ndjson"},
+        params=params,
+    ).json()
+    assert streamed["invalid"] == 1
+    assert {**streamed, "invalid": 0} == payload
+
+
+def test_columnar_batch_endpoint() -> None:
+    client = TestClient(create_app(_ruleset()))
+    rows = client.post("/segment/batch", json={"items": [{"status": "Active"}, {}]})
+    columns = client.post("/segment/batch/columnar", json={"columns": {"status": ["Active", None]}})
+    assert columns.status_code == 200
+    assert columns.content == rows.content
+
+    ragged = client.post("/segment/batch/columnar", json={"columns": {"status": ["Active"], "x": []}})
+    assert ragged.status_code == 400
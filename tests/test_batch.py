@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from app.batch import score_batch, score_batch_compact, score_columns
+from app.config import Settings
+from app.responses import encode_batch_response, encode_batch_scores_response
+from app.rules_loader import FeatureRule, RuleSet, load_rules
+from app.segmenter import score_member
+from app.synthetic import SyntheticMembers
+
+RULES_DIR = Path(__file__).resolve().parents[1] / "rules"
+
+
+def _ruleset() -> RuleSet:
+    return RuleSet(
+        segments=["Beta", "Alpha"],
+        intercepts={"Beta": 0.0, "Alpha": 0.0},
+        thresholds={"core_threshold": 1.0, "mid_threshold": 0.5},
+        features=[
+            FeatureRule(
+                feature_id="status==Active",
+                input_field="status",
+                match_value="Active",
+                coefficients={"Beta": 1.0, "Alpha": 1.0},
+            ),
+            FeatureRule(
+                feature_id="tier==Gold",
+                input_field="tier",
+                match_value="Gold",
+                coefficients={"Beta": 0.0, "Alpha": 0.7},
+            ),
+        ],
+        rule_set_version="test",
+        case_insensitive=False,
+    )
+
+
+def test_batch_matches_single_scoring_including_tie_break() -> None:
+    ruleset = _ruleset()
+    members = [{"status": "Active"}, {"status": "Active", "tier": "Gold"}, {}, {"tier": 5}]
+    for include_features in (False, True):
+        expected = [score_member(member, ruleset, include_features=include_features) for member in members]
+        assert score_batch(members, ruleset, include_features=include_features) == expected
+    assert score_batch(members, ruleset)[0].segment == "Alpha"
+
+
+def test_batch_matches_single_scoring_on_shipped_rules() -> None:
+    ruleset = load_rules(
+        Settings(
+            rules_path=RULES_DIR / "bvmw_typing_tool_rules_v2.json",
+            code_list_path=RULES_DIR / "code_lists.json",
+        )
+    )
+    members = [
+        {"Status_ Mitgliedschaft": "1", "Wirtschaftsregion": "Bayern Nord", "Mitgliedsdauer_Jahre": "3"},
+        {"Bundesland": "Berlin", "Position": "2", "Anrede": "weiblich", "Gesetzlicher_Vertreter": "1"},
+        {"Mitarbeiter oder BD Mitarbeiterstaffel": "10-24", "Mitgliedsdauer_Jahre": "0,5"},
+        {"unrelated": "value"},
+    ]
+    expected = [score_member(member, ruleset, pretty_scores=True) for member in members]
+    assert score_batch(members, ruleset, pretty_scores=True) == expected
+    expected = [score_member(member, ruleset, probabilities=True) for member in members]
+    assert score_batch(members, ruleset, probabilities=True) == expected
+
+
+def test_empty_batch() -> None:
+    assert score_batch([], _ruleset()) == []
+
+
+def test_columnar_scoring_matches_row_scoring() -> None:
+    ruleset = _ruleset()
+    members = [{"status": "Active"}, {"status": "Active", "tier": "Gold"}, {}, {"tier": 5}]
+    columns = {
+        "status": ["Active", "Active", None, None],
+        "tier": [None, "Gold", None, 5],
+        "unscored": ["a", "b", "c", "d"],
+    }
+    assert score_columns(columns, ruleset, include_features=True) == score_batch(
+        members, ruleset, include_features=True
+    )
+    assert score_columns({}, ruleset) == []
+
+
+def test_columnar_scoring_rejects_ragged_columns() -> None:
+    with pytest.raises(ValueError, match="same length"):
+        score_columns({"status": ["Active"], "tier": []}, _ruleset())
+
+
+def test_top_k_ranking_matches_single_scoring_with_ties() -> None:
+    segments = ["Echo", "Delta", "Charlie", "Bravo", "Alpha", "Foxtrot"]
+    coefficients = [
+        {"Echo": 1.0, "Delta": 1.0, "Charlie": 0.5, "Bravo": 1.0, "Alpha": 0.0, "Foxtrot": 0.5},
+        {"Echo": 0.0, "Delta": 0.5, "Charlie": 0.5, "Bravo": 0.0, "Alpha": 0.5, "Foxtrot": 0.5},
+    ]
+    ruleset = RuleSet(
+        segments=segments,
+        intercepts={segment: 0.0 for segment in segments},
+        thresholds={"core_threshold": 1.0, "mid_threshold": 0.5},
+        features=[
+            FeatureRule(feature_id=f"f{index}==x", input_field=f"f{index}", match_value="x", coefficients=row)
+            for index, row in enumerate(coefficients)
+        ],
+        rule_set_version="test",
+        case_insensitive=False,
+    )
+    members = [{}, {"f0": "x"}, {"f1": "x"}, {"f0": "x", "f1": "x"}]
+
+    for top_k in (1, 2, 3, 6, 10):
+        batch = score_batch(members, ruleset, top_k=top_k, probabilities=True)
+        for member, result in zip(members, batch):
+            single = score_member(member, ruleset, top_k=top_k, probabilities=True)
+            assert result.ranking == single.ranking
+            assert result.probabilities == single.probabilities
+
+    ranking = score_member({"f0": "x", "f1": "x"}, ruleset, top_k=3).ranking
+    assert ranking == [
+        {"segment": "Delta", "score": 1.5, "margin": 0.0},
+        {"segment": "Bravo", "score": 1.0, "margin": 0.5},
+        {"segment": "Charlie", "score": 1.0, "margin": 0.5},
+    ]
+
+
+def test_compact_batch_matches_materialized_results() -> None:
+    ruleset = load_rules(
+        Settings(
+            rules_path=RULES_DIR / "bvmw_typing_tool_rules_v2.json",
+            code_list_path=RULES_DIR / "code_lists.json",
+        )
+    )
+    members = SyntheticMembers(ruleset, seed=11).members(300)
+
+    batch = score_batch_compact(members, ruleset)
+
+    assert len(batch) == len(members)
+    assert batch.best.dtype == np.uint8 and batch.types.dtype == np.uint8
+    for pretty_scores in (False, True):
+        results = score_batch(members, ruleset, pretty_scores=pretty_scores)
+        assert batch.results(pretty_scores) == results
+        assert encode_batch_scores_response(batch, "v", pretty_scores) == encode_batch_response(results, "v")
+    expected_counts: dict[tuple[str, str], int] = {}
+    for result in results:
+        expected_counts[(result.segment, result.type)] = expected_counts.get((result.segment, result.type), 0) + 1
+    assert batch.counts() == expected_counts
+    assert len(score_batch_compact([], ruleset)) == 0
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+from app.config import Settings
+from app.main import create_app
+from app.rules_loader import load_rules
+from app.segmenter import score_member
+from app.synthetic import SyntheticMembers
+from benchmarks.load import SCENARIOS, LoadProfile, encode_members, run_load
+from benchmarks.run import compare
+
+RULES_DIR = Path(__file__).resolve().parents[1] / "rules"
+
+
+def test_synthetic_members_are_deterministic_and_scoreable() -> None:
+    ruleset = load_rules(
+        Settings(
+            rules_path=RULES_DIR / "bvmw_typing_tool_rules_v2.json",
+            code_list_path=RULES_DIR / "code_lists.json",
+        )
+    )
+    members = SyntheticMembers(ruleset, seed=7).members(200)
+
+    assert members == SyntheticMembers(ruleset, seed=7).members(200)
+    assert {"Bundesland", "Mitgliedsdauer_Jahre", "Ort"} <= {field for member in members for field in member}
+    assert any("Bundesland" not in member for member in members)
+    segments = {score_member(member, ruleset).segment for member in members}
+    assert len(segments) > 1
+
+
+def test_compare_flags_regressions_beyond_tolerance() -> None:
+    baseline = {"benchmarks": {"batch": {"p50_ms": 10.0, "items_per_s": 1000.0, "p99_ms": 20.0}}}
+    current = {"benchmarks": {"batch": {"p50_ms": 12.0, "items_per_s": 600.0, "p99_ms": 90.0}}}
+
+    regressions = compare(current, baseline, tolerance=0.3)
+
+    assert len(regressions) == 1
+    assert regressions[0].startswith("batch.items_per_s")
+    assert compare(current, baseline, tolerance=0.3, metrics=("p99_ms",)) == [
+        "batch.p99_ms: 90.000 vs baseline 20.000"
+    ]
+
+
+def test_load_harness_reports_each_scenario() -> None:
+    ruleset = load_rules(
+        Settings(
+            rules_path=RULES_DIR / "bvmw_typing_tool_rules_v2.json",
+            code_list_path=RULES_DIR / "code_lists.json",
+        )
+    )
+    members = encode_members(SyntheticMembers(ruleset, seed=3).members(50))
+    profile = LoadProfile(duration=0.3, concurrency=2, batch_min=5, batch_max=20, stream_members=30, stream_chunk=7)
+
+    async def _run() -> dict[str, dict[str, Any]]:
+        transport = httpx.ASGITransport(app=create_app(ruleset))
+        async with httpx.AsyncClient(transport=transport, base_url="http://load") as client:
+            return await run_load(client, members, SCENARIOS, profile)
+
+    report = asyncio.run(_run())
+
+    assert set(report) == set(SCENARIOS)
+    for scenario in report.values():
+        assert scenario["requests"] > 0
+        assert scenario["error_rate"] == 0.0
+        assert set(scenario["statuses"]) == {"200"}
+    assert report["stream"]["members_per_s"] > report["stream"]["requests_per_s"]
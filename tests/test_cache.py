@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+from fastapi.testclient import TestClient
+
+from app.cache import ScoreCache
+from app.main import create_app
+from app.rules_loader import FeatureRule, RuleSet
+from app.segmenter import score_member
+
+
+def _ruleset(version: str = "test", active_alpha: float = 1.0) -> RuleSet:
+    return RuleSet(
+        segments=["Alpha", "Beta"],
+        intercepts={"Alpha": 0.0, "Beta": 0.0},
+        thresholds={"core_threshold": 1.0, "mid_threshold": 0.5},
+        features=[
+            FeatureRule(
+                feature_id="status==Active",
+                input_field="status",
+                match_value="Active",
+                coefficients={"Alpha": active_alpha, "Beta": 0.2},
+            )
+        ],
+        rule_set_version=version,
+        case_insensitive=False,
+        code_mappings={"status": {"1": "Active"}},
+    )
+
+
+def test_cache_hits_ignore_unscored_fields_and_raw_codes() -> None:
+    cache = ScoreCache(max_size=10)
+    ruleset = _ruleset()
+
+    first = cache.score({"status": "Active", "name": "A"}, ruleset)
+    second = cache.score({"status": " 1 ", "name": "B", "extra": 3}, ruleset)
+
+    assert second is first
+    assert first == score_member({"status": "Active"}, ruleset)
+    assert cache.stats() == {"size": 1, "max_size": 10, "hits": 1, "misses": 1}
+
+
+def test_cache_keys_include_version_and_options() -> None:
+    cache = ScoreCache(max_size=10)
+    cache.score({"status": "Active"}, _ruleset("v1"))
+    cache.score({"status": "Active"}, _ruleset("v2"))
+    cache.score({"status": "Active"}, _ruleset("v1"), pretty_scores=True)
+    assert cache.stats()["misses"] == 3
+
+    # Same version string, edited rules.
+    edited = _ruleset("v1", active_alpha=0.1)
+    assert cache.score({"status": "Active"}, edited) == score_member({"status": "Active"}, edited)
+    assert cache.stats()["misses"] == 4
+
+
+def test_cache_evicts_least_recently_used() -> None:
+    cache = ScoreCache(max_size=2)
+    ruleset = _ruleset()
+    cache.score({"status": "Active"}, ruleset)
+    cache.score({}, ruleset)
+    cache.score({"status": "Active"}, ruleset)
+    cache.score({"status": "Active"}, ruleset, include_features=True)
+
+    assert len(cache) == 2
+    cache.score({}, ruleset)
+    assert cache.stats()["hits"] == 1
+
+
+def test_meta_reports_cache_stats() -> None:
+    client = TestClient(create_app(_ruleset()))
+    client.post("/segment", json={"status": "Active"})
+    client.post("/segment", json={"status": "1"})
+    stats = client.get("/meta").json()["cache"]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import csv
+import json
+from pathlib import Path
+
+import pytest
+
+from app.cli import main
+from app.config import Settings
+from app.delta import Fingerprint, FingerprintStore
+from app.rules_loader import load_rules
+from app.segmenter import score_member
+
+RULES_DIR = Path(__file__).resolve().parents[1] / "rules"
+RULES_ARGS = [
+    "--rules",
+    str(RULES_DIR / "bvmw_typing_tool_rules_v2.json"),
+    "--code-lists",
+    str(RULES_DIR / "code_lists.json"),
+]
+MEMBERS = [
+    {"Id": "a", "Status_ Mitgliedschaft": "1", "Wirtschaftsregion": "Bayern Nord"},
+    {"Id": "b", "Bundesland": "Berlin", "Position": "Vorstand", "Mitgliedsdauer_Jahre": "3"},
+    {"Id": "c", "Branche_Oberkategorie": "Baugewerbe"},
+]
+
+
+def _expected() -> list:
+    ruleset = load_rules(
+        Settings(rules_path=RULES_DIR / "bvmw_typing_tool_rules_v2.json", code_list_path=RULES_DIR / "code_lists.json")
+    )
+    return [score_member(member, ruleset) for member in MEMBERS]
+
+
+@pytest.mark.parametrize("workers", ["1", "2"])
+def test_cli_segments_jsonl_in_order(tmp_path: Path, workers: str) -> None:
+    source = tmp_path / "members.jsonl"
+    source.write_text("\n".join(json.dumps(member) for member in MEMBERS), encoding="utf-8")
+    target = tmp_path / "results.jsonl"
+
+    exit_code = main(
+        ["segment", str(source), "-o", str(target), "--workers", workers, "--chunk-size", "1", "--id-field", "Id", "-q"]
+        + RULES_ARGS
+    )
+
+    assert exit_code == 0
+    rows = [json.loads(line) for line in target.read_text(encoding="utf-8").splitlines()]
+    assert [row["Id"] for row in rows] == ["a", "b", "c"]
+    for row, expected in zip(rows, _expected()):
+        assert row["segment"] == expected.segment
+        assert row["scores"] == expected.scores
+
+
+def test_cli_segments_csv(tmp_path: Path) -> None:
+    source = tmp_path / "members.csv"
+    fieldnames = sorted({key for member in MEMBERS for key in member})
+    with source.open("w", encoding="utf-8", newline="") as handle:
+        writer = csv.DictWriter(handle, fieldnames=fieldnames, delimiter=";")
+        writer.writeheader()
+        writer.writerows(MEMBERS)
+    target = tmp_path / "results.csv"
+
+    exit_code = main(["segment", str(source), "-o", str(target), "--workers", "1", "--delimiter", ";", "-q"] + RULES_ARGS)
+
+    assert exit_code == 0
+    with target.open(encoding="utf-8", newline="") as handle:
+        rows = list(csv.DictReader(handle, delimiter=";"))
+    assert [row["segment"] for row in rows] == [expected.segment for expected in _expected()]
+    assert "score_Aufstrebende Wissensnetzwerker" in rows[0]
+
+
+def test_cli_reports_invalid_input(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    source = tmp_path / "members.jsonl"
+    source.write_text('{"Id": "a"}\nnot json\n', encoding="utf-8")
+
+    exit_code = main(["segment", str(source), "-o", str(tmp_path / "out.jsonl"), "--workers", "1"] + RULES_ARGS)
+
+    assert exit_code == 1
+    assert ":2: invalid JSON" in capsys.readouterr().err
+
+
+def test_cli_delta_mode_writes_only_changed_members(tmp_path: Path) -> None:
+    source = tmp_path / "members.jsonl"
+    target = tmp_path / "results.csv"
+    argv = ["segment", str(source), "-o", str(target), "--id-field", "Id", "--workers", "1", "-q"]
+    argv += ["--delta-store", str(tmp_path / "delta.sqlite3"), *RULES_ARGS]
+
+    source.write_text("\n".join(json.dumps(member) for member in MEMBERS), encoding="utf-8")
+    assert main(argv) == 0
+    assert len(list(csv.DictReader(target.open(encoding="utf-8")))) == 3
+
+    store = FingerprintStore(tmp_path / "delta.sqlite3")
+    store.save("v0:old", {"a": Fingerprint("0", "Alpha", "Core", "[]")})
+    changed = [*MEMBERS[:2], {**MEMBERS[2], "Branche_Oberkategorie": "Handel"}]
+    source.write_text("\n".join(json.dumps(member) for member in changed), encoding="utf-8")
+    assert main(argv) == 0
+    rows = list(csv.DictReader(target.open(encoding="utf-8")))
+    assert [row["Id"] for row in rows] == ["c"]
+    assert rows[0]["previous_segment"] == _expected()[2].segment
+    assert store.signatures("v0:old", ["a"]) == {}
+
+
+def test_cli_parquet_schema_does_not_depend_on_the_first_chunk(tmp_path: Path) -> None:
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    source = tmp_path / "members.jsonl"
+    # The first chunk has no id and matches nothing.
+    members = [{}, *MEMBERS, {"Id": 7}]
+    source.write_text("\n".join(json.dumps(member) for member in members), encoding="utf-8")
+    target = tmp_path / "results.parquet"
+
+    argv = ["segment", str(source), "-o", str(target), "--workers", "1", "--chunk-size", "1", "--id-field", "Id", "-q"]
+    assert main(argv + RULES_ARGS) == 0
+
+    table = pyarrow_parquet.read_table(target)
+    assert table.column("Id").to_pylist() == [None, "a", "b", "c", "7"]
+    assert str(table.schema.field("best_score").type) == "double"
+    assert table.column("segment").to_pylist()[1:4] == [expected.segment for expected in _expected()]
+
+
+def test_cli_rejects_json_documents(tmp_path: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    source = tmp_path / "members.json"
+    source.write_text(json.dumps(MEMBERS), encoding="utf-8")
+
+    assert main(["segment", str(source), "-o", str(tmp_path / "out.jsonl"), "-q"] + RULES_ARGS) == 1
+    assert ".json files are not read or written as JSON Lines" in capsys.readouterr().err
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import gzip
+import json
+from typing import Iterator
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import compression
+from app.compression import choose_encoding
+from app.config import Settings
+from app.main import create_app
+from app.rules_loader import FeatureRule, RuleSet
+
+
+def _ruleset() -> RuleSet:
+    return RuleSet(
+        segments=["Alpha", "Beta"],
+        intercepts={"Alpha": 0.0, "Beta": 0.0},
+        thresholds={"core_threshold": 1.0, "mid_threshold": 0.5},
+        features=[
+            FeatureRule(
+                feature_id="status==Active",
+                input_field="status",
+                match_value="Active",
+                coefficients={"Alpha": 1.0, "Beta": 0.2},
+            )
+        ],
+        rule_set_version="test",
+        case_insensitive=False,
+    )
+
+
+def _chunks(data: bytes, size: int = 100) -> Iterator[bytes]:
+    for start in range(0, len(data), size):
+        yield data[start : start + size]
+
+
+def test_gzip_requests_and_responses_match_uncompressed() -> None:
+    client = TestClient(create_app(_ruleset()))
+    items = [{"status": "Active" if index % 3 else "Passive"} for index in range(200)]
+    body = json.dumps({"items": items}).encode("utf-8")
+    plain = client.post("/segment/batch", content=body, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+
+    with client.stream(
+        "POST",
+        "/segment/batch",
+        content=_chunks(gzip.compress(body)),
+        headers={"Content-Encoding": "gzip", "Accept-Encoding": "gzip"},
+    ) as response:
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        wire = b"".join(response.iter_raw())
+    assert gzip.decompress(wire) == plain.content
+    assert len(wire) < len(plain.content) / 5
+
+    lines = "\n".join(json.dumps(item) for item in items).encode("utf-8")
+    streamed = client.post(
+        "/segment/stream",
+        content=_chunks(gzip.compress(lines)),
+        headers={"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"},
+    )
+    assert [json.loads(line) for line in streamed.text.splitlines()] == plain.json()["results"]
+
+    truncated = client.post("/segment/batch", content=gzip.compress(body)[:-8], headers={"Content-Encoding": "gzip"})
+    assert truncated.status_code == 400
+    assert client.post("/segment/batch", content=body, headers={"Content-Encoding": "br"}).status_code == 415
+
+
+def test_decompressed_size_is_limited() -> None:
+    client = TestClient(create_app(_ruleset(), Settings(decompressed_max_bytes=1_000_000)))
+    body = json.dumps({"items": [{"status": "Active"}] * 20_000}).encode("utf-8")
+    assert len(body) > 300_000
+    accepted = client.post("/segment/batch", content=gzip.compress(body), headers={"Content-Encoding": "gzip"})
+    assert len(accepted.json()["results"]) == 20_000
+
+    bomb = gzip.compress(b" " * 50_000_000)
+    response = client.post("/segment/batch", content=bomb, headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 413
+
+
+def test_zstd_round_trip() -> None:
+    zstandard = pytest.importorskip("zstandard")
+    client = TestClient(create_app(_ruleset()))
+    body = json.dumps({"items": [{"status": "Active"}] * 100}).encode("utf-8")
+    with client.stream(
+        "POST",
+        "/segment/batch",
+        content=zstandard.ZstdCompressor().compress(body),
+        headers={"Content-Encoding": "zstd", "Accept-Encoding": "gzip, zstd"},
+    ) as response:
+        assert response.headers["content-encoding"] == "zstd"
+        wire = b"".join(response.iter_raw())
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(wire) == client.post(
+        "/segment/batch", content=body
+    ).content
+
+
+def test_choose_encoding_honours_quality_values() -> None:
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("gzip;q=0, deflate") is None
+    assert choose_encoding("") is None
+    assert choose_encoding("*") in ("zstd", "gzip")
+
+
+def test_without_zstandard_only_gzip_is_negotiated(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(compression, "zstandard", None)
+    assert choose_encoding("zstd, gzip;q=0.5") == "gzip"
+    assert choose_encoding("zstd") is None
+    assert choose_encoding("*") == "gzip"
+
+    client = TestClient(create_app(_ruleset()))
+    body = json.dumps({"items": [{"status": "Active"}] * 100}).encode("utf-8")
+    response = client.post("/segment/batch", content=body, headers={"Accept-Encoding": "zstd"})
+    assert "content-encoding" not in response.headers
+    rejected = client.post("/segment/batch", content=body, headers={"Content-Encoding": "zstd"})
+    assert rejected.status_code == 415
+    assert rejected.json()["detail"] == "Unsupported Content-Encoding 'zstd', supported: gzip"
+
+
+def test_compact_encoding_sends_segment_names_once() -> None:
+    client = TestClient(create_app(_ruleset()))
+    items = [{"status": "Active"}, {"status": "Passive"}]
+    full = client.post("/segment/batch", json={"items": items}, params={"pretty_scores": "true"}).json()
+    compact = client.post(
+        "/segment/batch", json={"items": items}, params={"pretty_scores": "true", "compact": "true"}
+    ).json()
+    assert compact["segments"] == ["Alpha", "Beta"]
+    assert compact["rule_set_version"] == "test"
+    for result, row in zip(full["results"], compact["results"]):
+        values = dict(zip(compact["fields"], row))
+        assert compact["segments"][values["segment"]] == result["segment"]
+        assert compact["segments"][values["second_segment"]] == result["second_segment"]
+        assert dict(zip(compact["segments"], values["scores"])) == result["scores"]
+        for name in ("type", "difference", "best_score", "second_best_score"):
+            assert values[name] == result[name]
+
+    columnar = client.post(
+        "/segment/batch/columnar",
+        json={"columns": {"status": ["Active", "Passive"]}},
+        params={"pretty_scores": "true", "compact": "true"},
+    ).json()
+    assert columnar == compact
+    lines = client.post(
+        "/segment/stream",
+        content=b'{"status": "Active"}\nnot json\n{"status": "Passive"}',
+        headers={"Content-Type": "application/x-ndjson"},
+        params={"pretty_scores": "true", "compact": "true"},
+    ).text.splitlines()
+    header, first, error, second = map(json.loads, lines)
+    assert header == {key: compact[key] for key in ("segments", "fields", "rule_set_version")}
+    assert [first, second] == compact["results"]
+    assert error["line"] == 2
+    rejected = client.post("/segment/batch", json={"items": items}, params={"compact": "true", "top_k": 2})
+    assert rejected.status_code == 400
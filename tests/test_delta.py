@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from app.config import Settings
+from app.delta import Fingerprint, FingerprintStore, rule_set_key, segment_delta
+from app.main import create_app
+from app.rules_loader import FeatureRule, RuleSet
+
+
+def _ruleset(version: str = "v1", active_beta: float = 0.2) -> RuleSet:
+    return RuleSet(
+        segments=["Alpha", "Beta"],
+        intercepts={"Alpha": 0.0, "Beta": 0.0},
+        thresholds={"core_threshold": 1.0, "mid_threshold": 0.5},
+        features=[
+            FeatureRule(
+                feature_id="status==Active",
+                input_field="status",
+                match_value="Active",
+                coefficients={"Alpha": 1.5, "Beta": active_beta},
+            ),
+            FeatureRule(
+                feature_id="tier==Gold",
+                input_field="tier",
+                match_value="Gold",
+                coefficients={"Alpha": 0.0, "Beta": 2.0},
+            ),
+        ],
+        rule_set_version=version,
+        case_insensitive=False,
+    )
+
+
+def test_only_changed_members_are_returned(tmp_path: Path) -> None:
+    store = FingerprintStore(tmp_path / "fingerprints.sqlite3")
+    members = [
+        {"Id": 1, "status": "Active"},
+        {"Id": 2, "tier": "Gold"},
+        {"Id": 3, "status": "Other"},
+    ]
+
+    first, unchanged = segment_delta(members, _ruleset(), store, "Id")
+    assert [delta.member_id for delta in first] == ["1", "2", "3"]
+    assert unchanged == 0 and first[0].previous_segment is None
+
+    updated = [
+        {"Id": 1, "status": " Active ", "name": "renamed"},  # same signature after normalization
+        {"Id": 2, "status": "Active"},
+        {"Id": 3, "status": "Unknown"},  # different raw value, still matches nothing
+    ]
+    second, unchanged = segment_delta(updated, _ruleset(), store, "Id", pretty_scores=True)
+    assert [delta.member_id for delta in second] == ["2"]
+    assert unchanged == 2
+    assert (second[0].previous_segment, second[0].previous_type) == ("Beta", "Core")
+    assert second[0].result.segment == "Alpha"
+
+    rescored, unchanged = segment_delta(updated, _ruleset("v2"), store, "Id")
+    assert len(rescored) == 3 and unchanged == 0
+
+    # Edited coefficients under the same version string are not skipped.
+    edited, unchanged = segment_delta(updated, _ruleset("v2", active_beta=3.0), store, "Id")
+    assert [(delta.member_id, delta.result.segment) for delta in edited][:2] == [("1", "Beta"), ("2", "Beta")]
+    assert edited[0].previous_segment is None
+
+
+def test_delta_endpoint(tmp_path: Path) -> None:
+    store = FingerprintStore(tmp_path / "delta.sqlite3")
+    store.save("v0:old", {"a": Fingerprint("0", "Alpha", "Core", "[1.5, 0.2]")})
+    client = TestClient(create_app(_ruleset(), Settings(delta_store_path=store.path)))
+    payload = {"items": [{"Id": "a", "status": "Active"}, {"Id": "b"}]}
+
+    first = client.post("/segment/delta", json=payload).json()
+    second = client.post("/segment/delta", json=payload).json()
+
+    assert [item["id"] for item in first["results"]] == ["a", "b"]
+    assert first["results"][0]["segment"] == "Alpha"
+    assert second == {"results": [], "unchanged": 2, "rule_set_version": "v1"}
+    assert client.post("/segment/delta", json={"items": [{"status": "Active"}]}).status_code == 400
+    # Rows of rule sets that are no longer loaded are pruned.
+    assert store.signatures("v0:old", ["a"]) == {}
+    assert set(store.signatures(rule_set_key(_ruleset()), ["a", "b"])) == {"a", "b"}
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.config import Settings
+from app.executor import ExecutorSaturated, ScoringExecutor
+from app.main import create_app
+from app.rules_loader import FeatureRule, RuleSet
+
+
+def _ruleset() -> RuleSet:
+    return RuleSet(
+        segments=["Alpha", "Beta"],
+        intercepts={"Alpha": 0.0, "Beta": 0.0},
+        thresholds={"core_threshold": 1.0, "mid_threshold": 0.5},
+        features=[
+            FeatureRule(
+                feature_id="status==Active",
+                input_field="status",
+                match_value="Active",
+                coefficients={"Alpha": 1.0, "Beta": 0.2},
+            )
+        ],
+        rule_set_version="test",
+        case_insensitive=False,
+    )
+
+
+def test_waiting_tasks_run_smallest_first_and_overflow_is_rejected() -> None:
+    executor = ScoringExecutor(workers=1, max_pending=3)
+    release = threading.Event()
+    order: list[int] = []
+
+    async def scenario() -> None:
+        blocker = asyncio.create_task(executor.run(1000, release.wait))
+        await asyncio.sleep(0.05)
+        waiting = [asyncio.create_task(executor.run(size, order.append, size)) for size in (500, 5, 50)]
+        await asyncio.sleep(0.05)
+        assert (executor.running, executor.pending) == (1, 3)
+        with pytest.raises(ExecutorSaturated) as rejected:
+            await executor.run(1, order.append, 1)
+        assert rejected.value.status_code == 429
+        assert rejected.value.retry_after >= 1
+        release.set()
+        await asyncio.gather(blocker, *waiting)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        executor.shutdown()
+    assert order == [5, 50, 500]
+    assert (executor.running, executor.pending, executor.rejected) == (0, 0, 1)
+
+
+def test_batches_are_scored_on_worker_processes(tmp_path: Path) -> None:
+    items = [{"status": "Active"}, {"status": "Passive"}, {}]
+    inline = TestClient(create_app(_ruleset()))
+    settings = Settings(
+        scoring_executor="process",
+        scoring_workers=1,
+        scoring_loop_max_bytes=0,
+        scoring_inline_max_bytes=0,
+        jobs_dir=tmp_path,
+    )
+    with TestClient(create_app(_ruleset(), settings)) as client:
+        for path, payload in (
+            ("/segment/batch", {"items": items}),
+            ("/segment/batch/columnar", {"columns": {"status": ["Active", "Passive", None]}}),
+        ):
+            response = client.post(path, json=payload, params={"explain": "true"})
+            assert response.status_code == 200
+            assert response.content == inline.post(path, json=payload, params={"explain": "true"}).content
+
+        invalid = client.post("/segment/batch", json={"items": "nope"})
+        assert invalid.status_code == 422
+        assert invalid.json()["detail"][0]["loc"] == ["body", "items"]
+        ragged = client.post("/segment/batch/columnar", json={"columns": {"status": ["Active"], "x": []}})
+        assert ragged.status_code == 400
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import json
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+from fastapi.testclient import TestClient
+
+from app.config import Settings
+from app.jobs import COMPLETED, FAILED, QUEUED, RUNNING, JobManager, JobStore
+from app.main import create_app
+from app.rules_loader import FeatureRule, RuleSet
+from app.rules_registry import RulesRegistry
+
+
+def _ruleset() -> RuleSet:
+    return RuleSet(
+        segments=["Alpha", "Beta"],
+        intercepts={"Alpha": 0.0, "Beta": 0.0},
+        thresholds={"core_threshold": 1.0, "mid_threshold": 0.5},
+        features=[
+            FeatureRule(
+                feature_id="status==Active",
+                input_field="status",
+                match_value="Active",
+                coefficients={"Alpha": 1.5, "Beta": 0.2},
+            )
+        ],
+        rule_set_version="test",
+        case_insensitive=False,
+    )
+
+
+def _wait_for(client: TestClient, job_id: str) -> dict[str, Any]:
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        status = client.get(f"/jobs/{job_id}").json()
+        if status["status"] not in (QUEUED, RUNNING):
+            return status
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_json_job_runs_in_background_and_streams_results(tmp_path: Path) -> None:
+    settings = Settings(jobs_dir=tmp_path, job_chunk_size=2)
+    items = [{"status": "Active"}, {"status": "Inactive"}, {}, {"status": "Active"}, {"status": "Active"}]
+    with TestClient(create_app(_ruleset(), settings)) as client:
+        response = client.post("/jobs/segment", json={"items": items}, params={"pretty_scores": "true"})
+        assert response.status_code == 202
+        job = response.json()
+        assert job["total"] == 5 and job["rule_set_version"] == "test"
+
+        status = _wait_for(client, job["id"])
+        assert status["status"] == COMPLETED
+        assert status["processed"] == 5
+        assert status["items_per_second"] > 0
+
+        results = client.get(f"/jobs/{job['id']}/results")
+        assert results.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in results.text.splitlines()]
+        assert [line["segment"] for line in lines] == ["Alpha", "Alpha", "Alpha", "Alpha", "Alpha"]
+        assert [line["type"] for line in lines] == ["Core", "Rest", "Rest", "Core", "Core"]
+
+
+def test_ndjson_job_reports_invalid_lines_inline(tmp_path: Path) -> None:
+    with TestClient(create_app(_ruleset(), Settings(jobs_dir=tmp_path))) as client:
+        body = b'{"status": "Active"}\n\nnot json\n{"status": "Inactive"}\n'
+        response = client.post("/jobs/segment", content=body, headers={"Content-Type": "application/x-ndjson"})
+        job_id = response.json()["id"]
+        assert response.json()["total"] == 3
+
+        assert _wait_for(client, job_id)["status"] == COMPLETED
+        lines = [json.loads(line) for line in client.get(f"/jobs/{job_id}/results").text.splitlines()]
+
+    assert lines[0]["segment"] == "Alpha"
+    assert lines[1] == {"line": 3, "error": lines[1]["error"]}
+    assert "Invalid JSON" in lines[1]["error"]
+    assert lines[2]["type"] == "Rest"
+
+
+def test_job_errors(tmp_path: Path) -> None:
+    client = TestClient(create_app(_ruleset(), Settings(jobs_dir=tmp_path)))
+
+    assert client.get("/jobs/missing").status_code == 404
+    assert client.post("/jobs/segment", json={"items": [1]}).status_code == 422
+    assert client.post("/jobs/segment", json={"items": []}, params={"rule_set_version": "nope"}).status_code == 404
+
+
+def test_unfinished_jobs_are_restarted(tmp_path: Path) -> None:
+    store = JobStore(tmp_path)
+    store.input_path("job1").parent.mkdir(parents=True)
+    store.input_path("job1").write_text('{"status": "Active"}\n', encoding="utf-8")
+    store.create("job1", "test", False, False, 1)
+    store.update("job1", status=RUNNING, processed=1)
+    store.results_path("job1").write_text("partial", encoding="utf-8")
+
+    manager = JobManager(store, RulesRegistry(ruleset=_ruleset()))
+    manager.recover()
+    manager.shutdown(cancel=False)
+
+    job = store.get("job1")
+    assert job.status == COMPLETED
+    assert job.processed == 1
+    assert json.loads(store.results_path("job1").read_text(encoding="utf-8"))["segment"] == "Alpha"
+
+
+def test_recover_leaves_jobs_of_live_owners_alone(tmp_path: Path) -> None:
+    store = JobStore(tmp_path)
+    sibling = JobManager(store, RulesRegistry(ruleset=_ruleset()))
+    exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    dead_owner = f"{socket.gethostname()}:{exited.stdout.strip()}:gone"
+    for job_id, owner in (("live", sibling.owner), ("dead", dead_owner)):
+        store.input_path(job_id).parent.mkdir(parents=True)
+        store.input_path(job_id).write_text('{"status": "Active"}\n', encoding="utf-8")
+        store.create(job_id, "test", False, False, 1, owner)
+        store.update(job_id, status=RUNNING)
+
+    manager = JobManager(store, RulesRegistry(ruleset=_ruleset()))
+    manager.recover()
+    manager.shutdown(cancel=False)
+
+    assert store.get("live").status == RUNNING
+    assert store.get("dead").status == COMPLETED
+    # Whoever claims first wins; a stale view of the owner claims nothing.
+    assert store.claim("live", manager.owner, sibling.owner)
+    assert not store.claim("live", "another", sibling.owner)
+
+
+def test_job_fails_when_its_rules_cannot_be_loaded(tmp_path: Path) -> None:
+    (tmp_path / "rules.json").write_text("not json", encoding="utf-8")
+    settings = Settings(rules_path=tmp_path / "rules.json", code_list_path=tmp_path / "codes.json")
+    store = JobStore(tmp_path / "jobs")
+    store.input_path("job1").parent.mkdir(parents=True)
+    store.input_path("job1").write_text('{"status": "Active"}\n', encoding="utf-8")
+    store.create("job1", "test", False, False, 1)
+
+    manager = JobManager(store, RulesRegistry(settings=settings, lazy=True))
+    manager.recover()
+    manager.shutdown(cancel=False)
+
+    job = store.get("job1")
+    assert job.status == FAILED
+    assert job.error
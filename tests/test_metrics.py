@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+from typing import Iterator
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.config import Settings
+from app.main import create_app
+from app.metrics import Histogram, metrics
+from app.rules_loader import FeatureRule, RuleSet
+
+
+def _ruleset() -> RuleSet:
+    return RuleSet(
+        segments=["Alpha", "Beta"],
+        intercepts={"Alpha": 0.0, "Beta": 0.0},
+        thresholds={"core_threshold": 1.0, "mid_threshold": 0.5},
+        features=[
+            FeatureRule(
+                feature_id="status==Active",
+                input_field="status",
+                match_value="Active",
+                coefficients={"Alpha": 1.5, "Beta": 0.2},
+            )
+        ],
+        rule_set_version="test",
+        case_insensitive=False,
+    )
+
+
+@pytest.fixture(autouse=True)
+def _reset_metrics() -> Iterator[None]:
+    metrics.reset()
+    yield
+    metrics.configure(False)
+    metrics.reset()
+
+
+def test_histogram_buckets_are_cumulative() -> None:
+    histogram = Histogram("latency", "doc", (0.1, 1.0))
+    histogram.observe(0.05, route="/a")
+    histogram.observe(0.5, route="/a")
+    histogram.observe(5.0, route="/a")
+
+    lines = list(histogram.collect())
+
+    assert 'latency_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'latency_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'latency_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'latency_count{route="/a"} 3' in lines
+
+
+def test_metrics_endpoint_reports_requests_and_results() -> None:
+    client = TestClient(create_app(_ruleset(), Settings(metrics_enabled=True)))
+    client.post("/segment", json={"status": "Active"})
+    client.post("/segment/batch", json={"items": [{"status": "Active"}, {}]})
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert 'segmenter_request_duration_seconds_count{method="POST",route="/segment",status="200"} 1' in body
+    assert 'segmenter_batch_size_count{endpoint="segment_batch"} 1' in body
+    assert 'segmenter_items_scored_total{segment="Alpha",type="Core"} 2' in body
+    assert 'segmenter_stage_duration_seconds_count{stage="batch_features"} 1' in body
+    assert "segmenter_cache_misses_total 1" in body
+
+
+def test_metrics_belong_to_their_app() -> None:
+    enabled = TestClient(create_app(_ruleset(), Settings(metrics_enabled=True)))
+    # Creating another app neither disables metrics nor replaces the first
+    # app's collectors.
+    other = TestClient(create_app(_ruleset(), Settings(cache_size=0)))
+    other.post("/segment", json={"status": "Active"})
+    enabled.post("/segment", json={"status": "Active"})
+    enabled.post("/segment", json={"status": "Active"})
+
+    body = enabled.get("/metrics").text
+    assert "segmenter_cache_hits_total 1" in body
+    assert "segmenter_cache_misses_total 1" in body
+    assert other.get("/metrics").status_code == 404
+
+
+def test_metrics_disabled_records_nothing() -> None:
+    client = TestClient(create_app(_ruleset()))
+    client.post("/segment", json={"status": "Active"})
+
+    assert client.get("/metrics").status_code == 404
+    assert "segmenter_items_scored_total{" not in metrics.render()
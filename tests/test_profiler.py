@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import marshal
+import pstats
+import threading
+from collections import Counter
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from app.config import Settings
+from app.main import create_app
+from app.profiler import SamplingProfiler, Stack, collapsed_stacks, pstats_dump
+from app.rules_loader import FeatureRule, RuleSet
+
+
+def _ruleset() -> RuleSet:
+    return RuleSet(
+        segments=["Alpha", "Beta"],
+        intercepts={"Alpha": 0.0, "Beta": 0.0},
+        thresholds={"core_threshold": 1.0, "mid_threshold": 0.5},
+        features=[
+            FeatureRule(
+                feature_id="status==Active",
+                input_field="status",
+                match_value="Active",
+                coefficients={"Alpha": 1.0, "Beta": 0.2},
+            )
+        ],
+        rule_set_version="test",
+        case_insensitive=False,
+    )
+
+
+def _busy_leaf(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def _busy_root(stop: threading.Event) -> None:
+    _busy_leaf(stop)
+
+
+def test_profiler_samples_other_threads_as_collapsed_stacks_and_pstats(tmp_path: Path) -> None:
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_root, args=(stop,))
+    worker.start()
+    try:
+        with SamplingProfiler(0.001, thread_ids={worker.ident}) as profiler:
+            stop.wait(0.2)
+    finally:
+        stop.set()
+        worker.join()
+    assert profiler.samples
+    assert all("_busy_leaf" in [frame[2] for frame in stack] for stack in profiler.samples)
+
+    root_label = f"_busy_root (tests/test_profiler.py:{_busy_root.__code__.co_firstlineno})"
+    leaf_label = f"_busy_leaf (tests/test_profiler.py:{_busy_leaf.__code__.co_firstlineno})"
+    lines = collapsed_stacks(profiler.samples).splitlines()
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == sum(profiler.samples.values())
+    assert all(f"{root_label};{leaf_label}" in line for line in lines)
+
+    leaf = (__file__, _busy_leaf.__code__.co_firstlineno, "_busy_leaf")
+    root = (__file__, _busy_root.__code__.co_firstlineno, "_busy_root")
+    samples: Counter[Stack] = Counter({(root, leaf): 3, (root,): 1})
+    path = tmp_path / "profile.pstats"
+    path.write_bytes(pstats_dump(samples, 0.01))
+    stats = pstats.Stats(str(path)).stats  # type: ignore[attr-defined]
+    assert stats[root][:4] == (4, 4, 0.01, 0.04)
+    assert stats[leaf][:4] == (3, 3, 0.03, 0.03)
+    assert stats[leaf][4] == {root: (3, 3, 0.03, 0.03)}
+    assert marshal.loads(path.read_bytes()) == stats
+
+
+def test_profile_endpoint_is_off_by_default_and_admin_only() -> None:
+    assert TestClient(create_app(_ruleset())).get("/debug/profile").status_code == 404
+    client = TestClient(create_app(_ruleset(), Settings(profiler_enabled=True, admin_token="secret")))
+    assert client.get("/debug/profile").status_code == 401
+    assert client.get("/debug/profile", params={"seconds": 600}, headers={"X-Admin-Token": "secret"}).status_code == 400
+
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_root, args=(stop,))
+    worker.start()
+    try:
+        response = client.get(
+            "/debug/profile", params={"seconds": 0.2, "interval_ms": 1}, headers={"X-Admin-Token": "secret"}
+        )
+    finally:
+        stop.set()
+        worker.join()
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert any(";_busy_leaf (" in line for line in response.text.splitlines())
+
+    dump = client.get(
+        "/debug/profile",
+        params={"seconds": 0.05, "format": "pstats", "idle": "true"},
+        headers={"X-Admin-Token": "secret"},
+    )
+    assert dump.headers["content-type"] == "application/octet-stream"
+    assert isinstance(marshal.loads(dump.content), dict)
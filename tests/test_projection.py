@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from app.batch import score_batch
+from app.config import Settings
+from app.model import BatchRequest
+from app.projection import member_parser
+from app.rules_loader import load_rules
+from app.synthetic import SyntheticMembers
+
+
+def test_parser_keeps_only_scored_fields_without_changing_results() -> None:
+    ruleset = load_rules(Settings())
+    members = SyntheticMembers(ruleset).members(200)
+    noise = {f"Custom_{index}__c": [index, {"nested": None}] for index in range(50)}
+    noisy = [{**member, **noise} for member in members]
+    parser = member_parser(ruleset)
+    assert member_parser(ruleset) is parser
+
+    items = parser.items(json.dumps({"items": noisy}))
+    fields = {field.input_field for field in ruleset.compiled.fields}
+    assert all(set(item) <= fields for item in items)
+    assert score_batch(items, ruleset, include_features=True) == score_batch(members, ruleset, include_features=True)
+    assert member_parser(ruleset, ["Custom_1__c"]).member(json.dumps(noisy[0]))["Custom_1__c"] == [1, {"nested": None}]
+
+    for body in ('{"items": "nope"}', '{"items": [1]}', '{"items": ['):
+        with pytest.raises(ValidationError) as projected:
+            parser.items(body)
+        with pytest.raises(ValidationError) as full:
+            BatchRequest.model_validate_json(body)
+        assert [error["loc"] for error in projected.value.errors()] == [error["loc"] for error in full.value.errors()]
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import shutil
+from pathlib import Path
+
+import pytest
+
+from app.cli import main
+from app.config import Settings
+from app.rules_artifact import StaleArtifact, artifact_path, load_ruleset, read_artifact, write_artifact
+from app.rules_loader import load_rules
+from app.segmenter import score_member
+
+RULES_DIR = Path(__file__).resolve().parents[1] / "rules"
+
+
+@pytest.fixture
+def settings(tmp_path: Path) -> Settings:
+    shutil.copy(RULES_DIR / "bvmw_typing_tool_rules_v2.json", tmp_path / "rules.json")
+    shutil.copy(RULES_DIR / "code_lists.json", tmp_path / "code_lists.json")
+    return Settings(rules_path=tmp_path / "rules.json", code_list_path=tmp_path / "code_lists.json")
+
+
+def test_artifact_round_trips_the_rule_set(settings: Settings) -> None:
+    path = write_artifact(settings)
+    assert path == settings.rules_path.with_suffix(".compiled")
+
+    restored = read_artifact(path, settings)
+    expected = load_rules(settings)
+
+    assert restored == expected
+    assert restored.compiled == expected.compiled
+    member = {"Bundesland": "Berlin", "Position": "2", "Mitgliedsdauer_Jahre": "3"}
+    assert score_member(member, restored, include_features=True) == score_member(
+        member, expected, include_features=True
+    )
+
+
+def test_stale_or_corrupt_artifacts_fall_back_to_json(settings: Settings) -> None:
+    path = write_artifact(settings)
+    settings.code_list_path.write_text("{}", encoding="utf-8")
+    with pytest.raises(StaleArtifact, match="changed"):
+        read_artifact(path, settings)
+    assert load_ruleset(settings).code_mappings == {}
+
+    write_artifact(settings)
+    path.write_bytes(path.read_bytes()[:-1] + b"\x00")
+    with pytest.raises(StaleArtifact, match="checksum"):
+        read_artifact(path, settings)
+    assert load_ruleset(settings) == load_rules(settings)
+
+
+def test_compile_rules_command(settings: Settings, tmp_path: Path) -> None:
+    output = tmp_path / "out.compiled"
+    argv = ["compile-rules", "--rules", str(settings.rules_path), "--code-lists", str(settings.code_list_path)]
+    assert main([*argv, "-o", str(output), "-q"]) == 0
+    assert read_artifact(output, settings) == load_rules(settings)
+    assert artifact_path(settings.model_copy(update={"rules_artifact_path": output})) == output
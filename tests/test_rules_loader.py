@@ -44,3 +44,59 @@ def test_rules_loader_rejects_missing_intercepts(tmp_path: Path) -> None:
 
     with pytest.raises(RulesLoaderError):
         load_rules(Settings(rules_path=rules_path))
+
+
+def test_rules_loader_compiles_field_index(tmp_path: Path) -> None:
+    rules_path = tmp_path / "rules.json"
+    payload = {
+        "segments": [{"id": 1, "name": "Segment A"}, {"id": 2, "name": "Segment B"}],
+        "intercepts": {"seg1": 0.0, "seg2": 1.0},
+        "type_thresholds": {"core_gt": 1.0, "mid_gt": 0.5},
+        "rules": [
+            {"crm_field": "status", "match_value": "Active", "coefficients": {"seg1": 0.1, "seg2": 0.2}},
+            {"crm_field": "tier", "match_value": "Gold", "coefficients": {"seg1": 0.3, "seg2": 0.4}},
+            {"crm_field": "status", "match_value": " Lapsed ", "coefficients": {"seg1": 0.5, "seg2": 0.6}},
+        ],
+    }
+    _write_rules(rules_path, payload)
+
+    compiled = load_rules(Settings(rules_path=rules_path)).compiled
+
+    assert compiled.segments == ("Segment A", "Segment B")
+    assert compiled.intercepts == (0.0, 1.0)
+    assert compiled.coefficients[2] == (0.5, 0.6)
+    fields = {field.input_field: field.index for field in compiled.fields}
+    assert fields == {"status": {"Active": (0,), "Lapsed": (2,)}, "tier": {"Gold": (1,)}}
+
+
+def test_rules_loader_compiles_declared_aliases_and_numeric_buckets(tmp_path: Path) -> None:
+    rules_path = tmp_path / "rules.json"
+    payload = {
+        "segments": [{"id": 1, "name": "Segment A"}, {"id": 2, "name": "Segment B"}],
+        "intercepts": {"seg1": 0.0, "seg2": 0.0},
+        "type_thresholds": {"core_gt": 1.0, "mid_gt": 0.5},
+        "value_aliases": {"size": {"klein": "small"}},
+        "numeric_buckets": {
+            "size": [{"min": 50, "value": "large"}, {"max": 9, "value": "small"}, {"min": 10, "max": 49, "value": "mid"}]
+        },
+        "rules": [
+            {"crm_field": "size", "match_value": "small", "coefficients": {"seg1": 1.0, "seg2": 0.0}},
+            {"crm_field": "size", "match_value": "large", "coefficients": {"seg1": 0.0, "seg2": 1.0}},
+        ],
+        "rule_set_version": "buckets",
+    }
+    _write_rules(rules_path, payload)
+    ruleset = load_rules(Settings(rules_path=rules_path, code_list_path=tmp_path / "missing.json"))
+
+    buckets = ruleset.numeric_buckets["size"]
+    assert buckets.lower == (float("-inf"), 10.0, 50.0)
+    assert [buckets.bucket_text(value) for value in ("3", "9,5", "10", "49", "120", "abc")] == [
+        "small", None, "mid", "mid", "large", None
+    ]
+    (size,) = ruleset.compiled.fields
+    assert size.lookup == {"klein": (0,), "small": (0,), "large": (1,)}
+
+    payload["numeric_buckets"]["size"].append({"min": 40, "max": 60, "value": "overlap"})
+    _write_rules(rules_path, payload)
+    with pytest.raises(RulesLoaderError, match="overlap"):
+        load_rules(Settings(rules_path=rules_path))
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import json
+import time
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.config import Settings
+from app.main import create_app
+from app.rules_loader import RulesLoaderError
+from app.rules_registry import RulesRegistry
+
+
+def _write_rules(path: Path, version: str, alpha: float = 1.0) -> None:
+    payload = {
+        "segments": [{"id": 1, "name": "Alpha"}, {"id": 2, "name": "Beta"}],
+        "intercepts": {"seg1": 0.0, "seg2": 0.0},
+        "type_thresholds": {"core_gt": 1.0, "mid_gt": 0.5},
+        "rules": [{"crm_field": "status", "match_value": "Active", "coefficients": {"seg1": alpha, "seg2": 0.5}}],
+        "rule_set_version": version,
+    }
+    path.write_text(json.dumps(payload), encoding="utf-8")
+
+
+def _settings(tmp_path: Path, **overrides: object) -> Settings:
+    return Settings(rules_path=tmp_path / "rules.json", code_list_path=tmp_path / "codes.json", **overrides)
+
+
+def test_reload_swaps_only_when_files_change(tmp_path: Path) -> None:
+    _write_rules(tmp_path / "rules.json", "v1")
+    registry = RulesRegistry(settings=_settings(tmp_path))
+    seen: list[str] = []
+    registry.add_listener(lambda loaded: seen.append(loaded.ruleset.rule_set_version))
+    original = registry.current
+
+    assert registry.reload() is False
+    _write_rules(tmp_path / "rules.json", "v2")
+    assert registry.reload() is True
+
+    assert registry.current.ruleset.rule_set_version == "v2"
+    assert original.ruleset.rule_set_version == "v1"
+    assert seen == ["v2"]
+
+
+def test_failed_reload_keeps_previous_rules(tmp_path: Path) -> None:
+    _write_rules(tmp_path / "rules.json", "v1")
+    registry = RulesRegistry(settings=_settings(tmp_path))
+    (tmp_path / "rules.json").write_text("{broken", encoding="utf-8")
+
+    with pytest.raises(RulesLoaderError):
+        registry.reload()
+
+    assert registry.current.ruleset.rule_set_version == "v1"
+
+
+def test_reload_endpoint_requires_admin_token(tmp_path: Path) -> None:
+    _write_rules(tmp_path / "rules.json", "v1")
+    client = TestClient(create_app(settings=_settings(tmp_path, admin_token="secret")))
+
+    assert client.post("/rules/reload").status_code == 401
+    assert client.post("/rules/reload", headers={"X-Admin-Token": "geheim-ä".encode("latin-1")}).status_code == 401
+    _write_rules(tmp_path / "rules.json", "v2", alpha=0.0)
+    response = client.post("/rules/reload", headers={"X-Admin-Token": "secret"})
+
+    assert response.status_code == 200
+    assert response.json()["reloaded"] is True
+    meta = client.get("/meta").json()
+    assert meta["rule_set_version"] == "v2"
+    assert meta["loaded_at"] == response.json()["loaded_at"]
+    assert client.post("/segment", json={"status": "Active"}).json()["segment"] == "Beta"
+
+
+def test_reload_endpoint_disabled_without_token(tmp_path: Path) -> None:
+    _write_rules(tmp_path / "rules.json", "v1")
+    client = TestClient(create_app(settings=_settings(tmp_path)))
+    assert client.post("/rules/reload", headers={"X-Admin-Token": "x"}).status_code == 403
+
+
+def test_registry_serves_versions_from_rules_dir(tmp_path: Path) -> None:
+    _write_rules(tmp_path / "rules.json", "v2")
+    versions_dir = tmp_path / "versions"
+    versions_dir.mkdir()
+    _write_rules(versions_dir / "typing_rules_v3.json", "v3", alpha=0.0)
+    client = TestClient(create_app(settings=_settings(tmp_path, rules_dir=versions_dir)))
+
+    assert client.get("/meta").json()["available_versions"] == ["v2", "v3"]
+    v3 = client.post("/segment?rule_set_version=v3", json={"status": "Active"}).json()
+    assert v3["segment"] == "Beta"
+    assert v3["rule_set_version"] == "v3"
+    assert client.post("/segment?rule_set_version=v9", json={}).status_code == 404
+
+    compared = client.post("/segment/compare", json={"status": "Active"}).json()
+    assert {version: result["segment"] for version, result in compared["results"].items()} == {
+        "v2": "Alpha",
+        "v3": "Beta",
+    }
+    assert compared["changed"] is True
+
+
+def test_registry_rejects_duplicate_versions(tmp_path: Path) -> None:
+    _write_rules(tmp_path / "rules.json", "v2")
+    versions_dir = tmp_path / "versions"
+    versions_dir.mkdir()
+    _write_rules(versions_dir / "other_rules.json", "v2")
+
+    with pytest.raises(RulesLoaderError):
+        RulesRegistry(settings=_settings(tmp_path, rules_dir=versions_dir))
+
+
+def _wait_until_settled(client: TestClient) -> dict[str, object]:
+    for _ in range(200):
+        payload = client.get("/ready").json()
+        if payload["status"] != "starting":
+            return payload
+        time.sleep(0.01)
+    raise AssertionError("startup did not finish")
+
+
+def test_rules_load_in_the_background_and_readiness_follows(tmp_path: Path) -> None:
+    settings = _settings(tmp_path, admin_token="secret", jobs_dir=tmp_path / "jobs", warmup_members=16)
+    (tmp_path / "rules.json").write_text("{", encoding="utf-8")
+    # A broken rules file no longer fails app creation; only readiness reports it.
+    with TestClient(create_app(settings=settings)) as client:
+        assert _wait_until_settled(client)["status"] == "failed"
+        assert client.get("/ready").status_code == 503
+        assert client.get("/health").status_code == 200
+        assert client.post("/segment", json={"status": "Active"}).status_code == 503
+
+        _write_rules(tmp_path / "rules.json", "v1")
+        assert client.post("/rules/reload", headers={"X-Admin-Token": "secret"}).status_code == 200
+        assert _wait_until_settled(client)["status"] == "ready"
+        ready = client.get("/ready")
+        assert ready.status_code == 200
+        assert "warm_up" in ready.json()["stages"]
+        assert client.post("/segment", json={"status": "Active"}).json()["segment"] == "Alpha"
+
+    with TestClient(create_app(settings=settings)) as client:
+        ready = _wait_until_settled(client)
+        assert ready["status"] == "ready"
+        assert set(ready["stages"]) == {"load_rules", "warm_up"}
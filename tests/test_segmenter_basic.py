@@ -1,10 +1,10 @@
 from __future__ import annotations
 
-from app.rules_loader import FeatureRule, RuleSet
-from app.segmenter import score_member
+from app.rules_loader import FeatureRule, NumericBuckets, RuleSet
+from app.segmenter import _matched_positions, _matched_positions_per_ruleset, score_member
 
 
-def _ruleset() -> RuleSet:
+def _ruleset(case_insensitive: bool = False) -> RuleSet:
     return RuleSet(
         segments=["Alpha", "Beta"],
         intercepts={"Alpha": 0.0, "Beta": 0.0},
@@ -24,7 +24,7 @@ def _ruleset() -> RuleSet:
             ),
         ],
         rule_set_version="test",
-        case_insensitive=False,
+        case_insensitive=case_insensitive,
     )
 
 
@@ -46,3 +46,70 @@ def test_difference_and_type_logic() -> None:
     assert result.second_segment == "Beta"
     assert result.difference == 2.0
     assert result.type == "Core"
+
+
+def test_code_mapping_resolves_before_lookup() -> None:
+    ruleset = RuleSet(
+        segments=["Alpha", "Beta"],
+        intercepts={"Alpha": 0.0, "Beta": 0.0},
+        thresholds={"core_threshold": 1.0, "mid_threshold": 0.5},
+        features=[
+            FeatureRule(
+                feature_id="status==Active",
+                input_field="status",
+                match_value="Active",
+                coefficients={"Alpha": 0.0, "Beta": 1.0},
+            )
+        ],
+        rule_set_version="test",
+        case_insensitive=False,
+        code_mappings={"status": {"1": "Active"}},
+    )
+    result = score_member({"status": " 1 "}, ruleset, include_features=True)
+    assert result.segment == "Beta"
+    assert result.matched_features == [
+        {"feature_id": "status==Active", "input_field": "status", "match_value": "Active", "value": 1}
+    ]
+
+
+def test_numeric_buckets_apply_only_to_unknown_values() -> None:
+    ruleset = RuleSet(
+        segments=["Alpha", "Beta"],
+        intercepts={"Alpha": 0.0, "Beta": 0.0},
+        thresholds={"core_threshold": 1.0, "mid_threshold": 0.5},
+        features=[
+            FeatureRule(
+                feature_id="years==short",
+                input_field="years",
+                match_value="short",
+                coefficients={"Alpha": 0.0, "Beta": 1.0},
+            ),
+        ],
+        rule_set_version="test",
+        case_insensitive=False,
+        code_mappings={"years": {"1": "unknown code"}},
+        numeric_buckets={"years": NumericBuckets(lower=(0.0,), upper=(2.0,), values=("short",))},
+    )
+    assert score_member({"years": "1,5"}, ruleset).segment == "Beta"
+    assert score_member({"years": 2}, ruleset).segment == "Beta"
+    # Codes resolve first; the mapped value is not numeric and matches nothing.
+    assert score_member({"years": "1"}, ruleset).segment == "Alpha"
+    assert score_member({"years": "3"}, ruleset).segment == "Alpha"
+
+    # Matching for several rule sets at once reads each value only once.
+    rulesets = [ruleset, _ruleset(), _ruleset(case_insensitive=True)]
+    for member in ({"years": "1,5", "status": "active"}, {"years": "1", "tier": "Gold"}, {"years": "x"}, {}):
+        expected = [_matched_positions(member, other) for other in rulesets]
+        assert _matched_positions_per_ruleset(member, rulesets) == expected
+
+
+def test_ranking_and_probabilities_are_opt_in() -> None:
+    plain = score_member({"tier": "Gold"}, _ruleset())
+    assert plain.ranking is None and plain.probabilities is None
+
+    result = score_member({"tier": "Gold"}, _ruleset(), top_k=5, probabilities=True, pretty_scores=True)
+    assert result.ranking == [
+        {"segment": "Alpha", "score": 2.0, "margin": 0.0},
+        {"segment": "Beta", "score": 0.0, "margin": 2.0},
+    ]
+    assert result.probabilities == {"Alpha": 0.8808, "Beta": 0.1192}